@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Brunnhilde benchmarks
+---
+
+Times Brunnhilde's database and report stages on synthetic Siegfried
+CSVs of increasing size, and compares results with a saved baseline.
+
+Usage: python benchmark.py [--rows 10000 100000 1000000] [--repeat N]
+    [--save-baseline PATH] [--compare PATH] [--threshold FRACTION]
+
+Baselines are specific to the machine they were recorded on.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import brunnhilde
+
+
+DEFAULT_ROW_COUNTS = (10000, 100000, 1000000)
+
+REGRESSION_THRESHOLD = 0.2
+
+# Timings shorter than this are too noisy to count as regressions
+MIN_COMPARED_SECONDS = 0.05
+
+# (namespace, id, format, version, mime, class, basis) of identified files,
+# in Siegfried CSV column order
+SYNTHETIC_FORMATS = (
+    (
+        "pronom",
+        "fmt/276",
+        "Acrobat PDF 1.7 - Portable Document Format",
+        "1.7",
+        "application/pdf",
+        "Page Description",
+        "extension match pdf; byte match at [[0 8] [1234 5]]",
+    ),
+    (
+        "pronom",
+        "fmt/43",
+        "JPEG File Interchange Format",
+        "1.01",
+        "image/jpeg",
+        "Image (Raster)",
+        "extension match jpg; byte match at [[0 14] [2500 2]]",
+    ),
+    (
+        "pronom",
+        "fmt/11",
+        "Portable Network Graphics",
+        "1.0",
+        "image/png",
+        "Image (Raster)",
+        "extension match png; byte match at [[0 16] [900 12]]",
+    ),
+    (
+        "pronom",
+        "fmt/412",
+        "Microsoft Word for Windows",
+        "2007 onwards",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "Word Processor",
+        "extension match docx; container name [Content_Types].xml with byte match",
+    ),
+    (
+        "pronom",
+        "x-fmt/111",
+        "Plain Text File",
+        "",
+        "text/plain",
+        "Text (Unstructured)",
+        "extension match txt; text match ASCII",
+    ),
+)
+
+EXTENSIONS = {
+    "fmt/276": "pdf",
+    "fmt/43": "jpg",
+    "fmt/11": "png",
+    "fmt/412": "docx",
+    "x-fmt/111": "txt",
+}
+
+DIRECTORY_NAMES = ("correspondence", "photos", "minutes", "drafts", "website")
+
+UNICODE_DIRECTORY_NAMES = ("Korrespondenz-Müller", "写真", "réunions", "Ωmega")
+
+
+def make_siegfried_csv(
+    csv_file,
+    num_rows,
+    duplicate_ratio=0.1,
+    unknown_ratio=0.05,
+    hash_type="md5",
+    unicode_ratio=0.1,
+    seed=0,
+):
+    """Write synthetic Siegfried CSV with num_rows files to open csv_file
+
+    duplicate_ratio of the files repeat the hash and size of an earlier
+    file, unknown_ratio are unidentified, and unicode_ratio have
+    non-ASCII paths. Pass hash_type=None to leave out the hash column.
+    Output is the same for the same arguments and seed.
+    """
+    rng = random.Random(seed)
+    header = [
+        "filename",
+        "filesize",
+        "modified",
+        "errors",
+        "namespace",
+        "id",
+        "format",
+        "version",
+        "mime",
+        "class",
+        "basis",
+        "warning",
+    ]
+    if hash_type:
+        header.insert(4, hash_type)
+    w = csv.writer(csv_file)
+    w.writerow(header)
+
+    originals = []
+    for i in range(num_rows):
+        if rng.random() < unicode_ratio:
+            directory = rng.choice(UNICODE_DIRECTORY_NAMES)
+        else:
+            directory = rng.choice(DIRECTORY_NAMES)
+
+        if originals and rng.random() < duplicate_ratio:
+            size, hash_value, identification = rng.choice(originals)
+        else:
+            size = 0 if rng.random() < 0.02 else rng.randint(1, 50000000)
+            hash_value = "{:032x}".format(rng.getrandbits(128))
+            if rng.random() < unknown_ratio:
+                identification = (
+                    "pronom",
+                    "UNKNOWN",
+                    "",
+                    "",
+                    "",
+                    "",
+                    "",
+                    "no match",
+                )
+            else:
+                identification = rng.choice(SYNTHETIC_FORMATS) + ("",)
+            if len(originals) < 10000:
+                originals.append((size, hash_value, identification))
+
+        filename = "/accessions/ARCH{:04d}/{}/file{:07d}.{}".format(
+            i % 7, directory, i, EXTENSIONS.get(identification[1], "dat")
+        )
+        modified = (
+            datetime.datetime(1995, 1, 1)
+            + datetime.timedelta(seconds=rng.randint(0, 30 * 365 * 86400))
+        ).strftime("%Y-%m-%dT%H:%M:%SZ")
+        errors = "empty source" if size == 0 else ""
+        row = [filename, size, modified, errors] + list(identification)
+        if hash_type:
+            row.insert(4, hash_value)
+        w.writerow(row)
+
+
+def _time_stages(num_rows, work_dir):
+    """Return metrics for Brunnhilde stages run on num_rows synthetic rows"""
+    csv_path = os.path.join(work_dir, "synthetic.csv")
+    with open(csv_path, "w", newline="", encoding="utf8") as f:
+        make_siegfried_csv(f, num_rows)
+
+    run = brunnhilde.Brunnhilde.from_options(
+        work_dir, os.path.join(work_dir, "report"), csv=csv_path, noclam=True
+    )
+    run.siegfried_version = "synthetic"
+    os.makedirs(run.csv_dir)
+    run.sf_file = csv_path
+    run.html = open(os.path.join(run.report_dir, "report.html"), "w", encoding="utf8")
+    run.conn = sqlite3.connect(os.path.join(run.report_dir, "siegfried.sqlite"))
+    run.conn.text_factory = str
+    run.cursor = run.conn.cursor()
+    metrics = run.metrics
+    try:
+        # Indexes are built as part of every import
+        with metrics.stage("import_csv"):
+            run.import_csv()
+            brunnhilde.index_siegfried_table(run.cursor, run.conn, run.use_hash)
+        with metrics.stage("create_html_report"):
+            run.create_html_report(str(datetime.datetime.now()))
+        with metrics.stage("generate_reports"):
+            run.generate_reports()
+        with metrics.stage("render_html_section"):
+            # Every file through the html renderer, as in a very large section
+            with brunnhilde._open_html_report(
+                os.path.join(run.report_dir, "all_files.html")
+            ) as html:
+                brunnhilde.write_report(
+                    "All files",
+                    "SELECT * FROM siegfried;",
+                    os.path.join(run.csv_dir, "all_files.csv"),
+                    brunnhilde.SIEGFRIED_COLUMNS,
+                    run.cursor,
+                    html,
+                )
+        with metrics.stage("write_duplicates_report"):
+            with brunnhilde._open_html_report(
+                os.path.join(run.report_dir, "duplicates.html")
+            ) as html:
+                brunnhilde.write_duplicates_report(
+                    brunnhilde.DUPLICATES_SQL,
+                    os.path.join(run.csv_dir, "duplicates_benchmark.csv"),
+                    brunnhilde.SIEGFRIED_COLUMNS,
+                    run.cursor,
+                    html,
+                )
+    finally:
+        run.cursor.close()
+        run.conn.close()
+        run.html.close()
+
+    # Only top-level stages, not the report sections within them
+    return dict(
+        (
+            record["name"],
+            dict(
+                wall_seconds=record["wall_seconds"],
+                cpu_seconds=record["cpu_seconds"],
+                peak_rss_bytes=record["peak_rss_bytes"],
+            ),
+        )
+        for record in metrics.stages
+        if not record["name"].startswith("Report: ")
+    )
+
+
+def run_benchmarks(row_counts, repeat=1):
+    """Return dict of benchmark results keyed by row count
+
+    Each benchmark is run repeat times and the fastest run is kept.
+    """
+    results = {}
+    for num_rows in row_counts:
+        best = {}
+        for _ in range(repeat):
+            work_dir = tempfile.mkdtemp(prefix="brunnhilde-benchmark-")
+            try:
+                timings = _time_stages(num_rows, work_dir)
+            finally:
+                shutil.rmtree(work_dir)
+            for name, result in timings.items():
+                if (
+                    name not in best
+                    or result["wall_seconds"] < best[name]["wall_seconds"]
+                ):
+                    best[name] = result
+        results[str(num_rows)] = best
+        for name, result in sorted(results[str(num_rows)].items()):
+            print(
+                "{:>8} rows  {:<28} {:8.2f}s wall {:8.2f}s cpu".format(
+                    num_rows, name, result["wall_seconds"], result["cpu_seconds"]
+                )
+            )
+    return dict(
+        brunnhilde_version=brunnhilde.BRUNNHILDE_VERSION,
+        python_version=sys.version.split()[0],
+        sqlite_version=sqlite3.sqlite_version,
+        recorded=str(datetime.datetime.now()),
+        results=results,
+    )
+
+
+def compare_with_baseline(benchmarks, baseline, threshold=REGRESSION_THRESHOLD):
+    """Print wall time changes from baseline and return list of regressions
+
+    A regression is a benchmark more than threshold (a fraction) slower
+    than in the baseline, ignoring baseline times under
+    MIN_COMPARED_SECONDS. Benchmarks missing from either side are skipped.
+    """
+    regressions = []
+    for num_rows, results in sorted(
+        benchmarks["results"].items(), key=lambda item: int(item[0])
+    ):
+        baseline_results = baseline["results"].get(num_rows, {})
+        for name, result in sorted(results.items()):
+            if name not in baseline_results:
+                continue
+            before = baseline_results[name]["wall_seconds"]
+            after = result["wall_seconds"]
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if change > threshold and before >= MIN_COMPARED_SECONDS:
+                flag = "  REGRESSION"
+                regressions.append((num_rows, name, before, after))
+            print(
+                "{:>8} rows  {:<28} {:8.2f}s -> {:8.2f}s ({:+.0%}){}".format(
+                    num_rows, name, before, after, change, flag
+                )
+            )
+    return regressions
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(
+        description="Time Brunnhilde stages on synthetic Siegfried CSVs"
+    )
+    parser.add_argument(
+        "--rows",
+        help="Row counts to benchmark (default: 10000 100000 1000000)",
+        nargs="+",
+        type=int,
+        default=list(DEFAULT_ROW_COUNTS),
+    )
+    parser.add_argument(
+        "--repeat",
+        help="Run each benchmark REPEAT times and keep the fastest (default: 1)",
+        action="store",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--save-baseline",
+        help="Write results to this JSON file for later comparison",
+        action="store",
+    )
+    parser.add_argument(
+        "--compare",
+        help="Compare results with baseline JSON file and exit with status 1 on regressions",
+        action="store",
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Fraction slower than baseline counted as a regression (default: 0.2)",
+        action="store",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+    )
+    return parser
+
+
+def main():
+    args = _make_parser().parse_args()
+    benchmarks = run_benchmarks(args.rows, args.repeat)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf8") as f:
+            json.dump(benchmarks, f, indent=2)
+        print("Results saved to {}.".format(args.save_baseline))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(benchmarks, baseline, args.threshold)
+        if regressions:
+            print("{} benchmarks regressed.".format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
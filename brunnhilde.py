@@ -9,29 +9,46 @@ A Siegfried-based characterization tool for disk images and directories.
 
 For information on usage and dependencies, see: github.com/tw4l/brunnhilde
 
-Python 2.7 & 3.4+
+Python 3.5+
 
 The MIT License (MIT)
 Copyright (c) 2017-2020 Tessa Walsh
 https://bitarchivist.net
 
 """
-from __future__ import print_function
-
 import argparse
+import base64
 from collections import OrderedDict
+import concurrent.futures
+import contextlib
 import csv
 import datetime
 import errno
-from itertools import islice
+from functools import partial
+from html import escape as escape_html
+import heapq
+import http.client
+import io
+import json
+from itertools import chain, islice
 import logging
 import math
 import os
 import re
+import shlex
 import shutil
+import socket
 import sqlite3
 import subprocess
 import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 
 BRUNNHILDE_VERSION = "brunnhilde 1.9.6"
@@ -125,6 +142,8 @@ hr {
 }
 """
 
+logger = logging.getLogger()
+
 
 def _configure_logging():
     global logger
@@ -143,6 +162,10 @@ def log_info(msg, time_warning=False):
     logger.info(msg)
 
 
+class BrunnhildeError(Exception):
+    """Error that prevents Brunnhilde from finishing a run"""
+
+
 def log_error_and_exit_message(msg):
     """Log error and shutdown message"""
     shutdown_msg = "Brunnhilde was unable to finish processing. Shutting down."
@@ -161,903 +184,2078 @@ def _determine_hash_type(args):
     return "md5"
 
 
-def run_siegfried(args, source_dir, use_hash):
-    """Run siegfried on directory"""
-    log_info("Running Siegfried.", time_warning=True)
-    global sf_command
-    if use_hash:
-        hash_type = _determine_hash_type(args)
-        sf_command = 'sf -csv -hash %s "%s" > "%s"' % (hash_type, source_dir, sf_file)
-    else:
-        sf_command = 'sf -csv "%s" > "%s"' % (source_dir, sf_file)
+def _sf_options(args, use_hash, sf_format="csv"):
+    """Return list of Siegfried command line options"""
+    options = ["-" + sf_format]
     if args.scanarchives:
-        sf_command = sf_command.replace("sf -csv", "sf -z -csv")
-    if args.throttle:
-        sf_command = sf_command.replace("-csv -hash", "-csv -throttle 10ms -hash")
-    if args.verbosesf:
-        sf_command = sf_command.replace(" -hash", " -log p,t -hash")
-    subprocess.call(sf_command, shell=True)
-    log_info("Siegfried scan complete. Processing results.")
-
-
-def run_clamav(args, source_dir):
-    """Run ClamAV on directory"""
-    timestamp = str(datetime.datetime.now())
-    log_info("Running virus scan.", time_warning=True)
-    virus_log = os.path.join(log_dir, "viruscheck-log.txt")
-    if args.largefiles:
-        if sys.platform.startswith("win"):
-            clamav_command = (
-                'clamscan -i -r "%s" --max-scansize=0 --max-filesize=0 > "%s"'
-                % (source_dir, virus_log)
-            )
-        else:
-            clamav_command = (
-                'clamscan -i -r "%s" --max-scansize=0 --max-filesize=0 | tee "%s"'
-                % (source_dir, virus_log)
-            )
+        options.insert(0, "-z")
+    if use_hash:
+        if args.throttle:
+            options.extend(["-throttle", "10ms"])
+        if args.verbosesf:
+            options.extend(["-log", "p,t"])
+        options.extend(["-hash", _determine_hash_type(args)])
+    return options
 
-    else:
-        if sys.platform.startswith("win"):
-            clamav_command = 'clamscan -i -r "%s" > "%s"' % (source_dir, virus_log)
-        else:
-            clamav_command = 'clamscan -i -r "%s" | tee "%s"' % (source_dir, virus_log)
-    subprocess.call(clamav_command, shell=True)
-    # add timestamp
-    target = open(virus_log, "a")
-    target.write("Date scanned: %s" % timestamp)
-    target.close()
-    # check log for infected files
-    if os.path.getsize(virus_log) > 40:  # check to see if clamscan actually ran
-        if "Infected files: 0" not in open(virus_log).read():
-            logger.warning(
-                "INFECTED FILE(S) FOUND. See {} for details.".format(virus_log)
-            )
-        else:
-            log_info("No viruses found.")
-    else:
-        logger.warning("ClamAV not properly configured.")
 
+def _sf_jobs_options(jobs):
+    """Return Siegfried options limiting it to jobs files at a time
 
-def run_bulk_extractor(args, source_dir, ssn_mode):
-    """Run bulk extractor on directory"""
-    bulk_extractor_log = os.path.join(log_dir, "bulk_extractor-log.txt")
-    log_info("Running bulk_extractor.", time_warning=True)
-    try:
-        os.makedirs(bulkext_dir)
-    except OSError as exception:
-        if exception.errno != errno.EEXIST:
-            raise
-    cmd = [
-        "bulk_extractor",
-        "-o",
-        bulkext_dir,
-        "-S",
-        "ssn_mode={}".format(str(ssn_mode)),
-        "-R",
-        source_dir,
-    ]
-    if args.regex:
-        cmd.insert(1, "-F")
-        cmd.insert(2, args.regex)
-    try:
-        if sys.version_info > (3, 0):
-            log_file = open(bulk_extractor_log, "w", encoding="utf-8")
-        else:
-            log_file = open(bulk_extractor_log, "wb")
-        subprocess.call(cmd, stderr=subprocess.STDOUT, stdout=log_file)
-        log_file.close()
-        log_info("bulk_extractor scan complete.")
-    except subprocess.CalledProcessError as e:
-        logger.warning("Error running bulk_extractor: {}".format(e))
+    _sf_options feeds the identification cache key, so -multi is kept
+    out of it to stop a different --jobs from invalidating the cache.
+    """
+    if jobs is None:
+        return []
+    return ["-multi", str(jobs)]
 
 
-def convert_size(size):
-    """Convert size in bytes to human-readable expression"""
-    if size == 0:
-        return "0 bytes"
-    size_name = ("bytes", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")
-    i = int(math.floor(math.log(size, 1024)))
-    p = math.pow(1024, i)
-    s = round(size / p)
-    s = str(s)
-    s = s.replace(".0", "")
-    return "%s %s" % (s, size_name[i])
+def _build_sf_command(args, source_dir, use_hash, sf_format="csv", jobs=None):
+    """Return Siegfried shell command writing sf_format output to stdout"""
+    return 'sf %s "%s"' % (
+        " ".join(_sf_options(args, use_hash, sf_format) + _sf_jobs_options(jobs)),
+        source_dir,
+    )
 
 
-def import_csv(cursor, conn, use_hash):
-    """Import csv file into sqlite db
+def _tee_lines(lines, out_file):
+    """Yield lines or text chunks unchanged while also writing them to out_file"""
+    for line in lines:
+        out_file.write(line)
+        yield line
 
-    Returns use_hash as a mechanism for updating the value if the input
-    Siegfried CSV is found to have a hash column. This provides a
-    double-check for Siegfried CSVs provided as input from stdin or a
-    file and prevents users from having to use the --hash flag when
-    providing their own inputs.
-    """
-    # Create CSV reader
-    if sys.version_info > (3, 0):
-        f = open(sf_file, "r", encoding="utf8", errors="ignore")
-    else:
-        f = open(sf_file, "rb")
 
-    reader = csv.DictReader(f)
+CACHE_SCAN_MAX_FILES = 1000
+CACHE_SCAN_MAX_CHARS = 30000
 
-    HASH_CHOICES = ("md5", "sha1", "sha256", "sha512", "crc")
-    hash_algorithm_used = None
 
-    # Drop table if exists
-    sql = "DROP TABLE IF EXISTS siegfried"
-    cursor.execute(sql)
+LISTING_COLUMNS = (
+    "path",
+    "parent",
+    "name",
+    "is_dir",
+    "is_file",
+    "size",
+    "mtime",
+    "mtime_ns",
+    "inode",
+    "link_target",
+)
 
-    # Create table
-    sql = "CREATE TABLE siegfried (filename text, filesize text, modified text, errors text, hash text, namespace text, id text, format text, version text, mime text, basis text, warning text, class text)"
-    cursor.execute(sql)
 
-    for row in reader:
-        if hash_algorithm_used is None:
-            for hash_algorithm in HASH_CHOICES:
-                if row.get(hash_algorithm):
-                    use_hash = True
-                    hash_algorithm_used = hash_algorithm
-
-        sql = "INSERT INTO siegfried (filename, filesize, modified, errors, hash, namespace, id, format, version, mime, basis, warning, class) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?);"
-        data = (
-            row.get("filename"),
-            row.get("filesize"),
-            row.get("modified"),
-            row.get("errors"),
-            row.get(hash_algorithm_used),
-            row.get("namespace"),
-            row.get("id"),
-            row.get("format"),
-            row.get("version"),
-            row.get("mime"),
-            row.get("basis"),
-            row.get("warning"),
-            row.get("class")
-        )
-        cursor.execute(sql, data)
+def _iter_source_listing(source_dir):
+    """Yield a LISTING_COLUMNS tuple for every entry under source_dir
 
-    conn.commit()
-    f.close()
-    return use_hash
+    Directories are listed once each with os.scandir. Symbolic links are
+    recorded but not followed into. Regular files, including links to
+    them, have is_file set and the size, times and inode of the file.
+    """
+    dirs = [source_dir]
+    while dirs:
+        current_dir = dirs.pop()
+        try:
+            entries = list(os.scandir(current_dir))
+        except OSError as e:
+            logger.warning("Unable to list directory {}: {}".format(current_dir, e))
+            continue
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                is_file = entry.is_file()
+                if is_file:
+                    entry_stat = entry.stat()
+                else:
+                    entry_stat = entry.stat(follow_symlinks=False)
+                link_target = None
+                if entry.is_symlink():
+                    link_target = os.readlink(entry.path)
+            except OSError as e:
+                logger.warning("Unable to stat {}: {}".format(entry.path, e))
+                continue
+            if is_dir:
+                dirs.append(entry.path)
+            yield (
+                entry.path,
+                current_dir,
+                entry.name,
+                int(is_dir),
+                int(is_file),
+                entry_stat.st_size,
+                int(entry_stat.st_mtime),
+                _stat_mtime_ns(entry_stat),
+                entry_stat.st_ino,
+                link_target,
+            )
 
 
-def create_html_report(
-    args, source_dir, scan_started, cursor, html, siegfried_version, use_hash
-):
-    """Get aggregate statistics and write to html report"""
-    # Gather stats from database.
-    cursor.execute("SELECT COUNT(*) from siegfried;")  # total files
-    num_files = cursor.fetchone()[0]
+SOURCE_LISTING_TABLE_SQL = "CREATE TABLE source_listing (path text, parent text, name text, is_dir integer, is_file integer, size integer, mtime integer, mtime_ns integer, inode integer, link_target text)"
 
-    cursor.execute("SELECT COUNT(*) from siegfried where filesize='0';")  # empty files
-    empty_files = cursor.fetchone()[0]
+SOURCE_LISTING_INDEX_SQL = (
+    "CREATE INDEX source_listing_parent ON source_listing (parent, mtime, name);"
+)
 
-    if use_hash:
-        cursor.execute(
-            "SELECT COUNT(DISTINCT hash) from siegfried WHERE filesize<>'0';"
-        )  # distinct files
-        distinct_files = cursor.fetchone()[0]
 
-        cursor.execute(
-            "SELECT COALESCE(SUM(hash_count), 0) FROM (SELECT COUNT(hash) as hash_count FROM siegfried WHERE filesize<>'0' GROUP BY hash HAVING COUNT(hash) > 1 AND COUNT(DISTINCT filename) > 1);"
-        )  # duplicates
-        all_dupes = cursor.fetchone()[0]
+def record_source_listing(cursor, conn, source_dir):
+    """Walk source_dir once and store every entry in source_listing table
 
+    Returns number of entries recorded.
+    """
+    cursor.execute("DROP TABLE IF EXISTS source_listing")
+    cursor.execute(SOURCE_LISTING_TABLE_SQL)
+    sql = "INSERT INTO source_listing ({}) VALUES ({});".format(
+        ", ".join(LISTING_COLUMNS), ",".join("?" * len(LISTING_COLUMNS))
+    )
+    rows = _iter_source_listing(source_dir)
+    num_rows = 0
+    _set_bulk_load_pragmas(cursor)
+    try:
+        while True:
+            batch = list(islice(rows, IMPORT_BATCH_SIZE))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+            num_rows += len(batch)
+        cursor.execute(SOURCE_LISTING_INDEX_SQL)
+        conn.commit()
+    finally:
+        _reset_bulk_load_pragmas(cursor)
+    return num_rows
+
+
+def copy_source_listing(cursor, conn, listing_db):
+    """Copy source_listing table from database file listing_db
+
+    Used when the listing was recorded by a background stage, which has
+    its own database. Returns number of entries copied.
+    """
+    cursor.execute("ATTACH DATABASE ? AS listing", (listing_db,))
+    try:
+        cursor.execute("DROP TABLE IF EXISTS main.source_listing")
+        cursor.execute(SOURCE_LISTING_TABLE_SQL)
         cursor.execute(
-            "SELECT COUNT(DISTINCT hash) FROM (SELECT hash FROM siegfried WHERE filesize<>'0' GROUP BY hash HAVING COUNT(hash) > 1 AND COUNT(DISTINCT filename) > 1);"
-        )  # distinct duplicates
-        distinct_dupes = cursor.fetchone()[0]
+            "INSERT INTO main.source_listing SELECT * FROM listing.source_listing;"
+        )
+        num_rows = cursor.rowcount
+        cursor.execute(SOURCE_LISTING_INDEX_SQL)
+        conn.commit()
+    finally:
+        cursor.execute("DETACH DATABASE listing")
+    return num_rows
 
-        duplicate_copies = int(all_dupes) - int(
-            distinct_dupes
-        )  # number of duplicate copies of unique files
-        duplicate_copies = str(duplicate_copies)
 
+def _listing_children(cursor, parent):
+    """Return listing rows for entries in directory parent, as tree -t sorts them"""
     cursor.execute(
-        "SELECT COUNT(*) FROM siegfried WHERE id='UNKNOWN';"
-    )  # unidentified files
-    unidentified_files = cursor.fetchone()[0]
-
-    year_sql = (
-        "SELECT DISTINCT SUBSTR(modified, 1, 4) as 'year' FROM siegfried;"
-    )  # min and max year
-    year_path = os.path.join(csv_dir, "uniqueyears.csv")
-    # if python3, specify newline to prevent extra csv line in windows
-    # else, open and read csv in bytes mode
-    # see: https://stackoverflow.com/questions/3348460/csv-file-written-with-python-has-blank-lines-between-each-row
-    if sys.version_info > (3, 0):
-        year_report = open(year_path, "w", newline="")
-    else:
-        year_report = open(year_path, "wb")
-    w = csv.writer(year_report)
-    for row in cursor.execute(year_sql):
-        w.writerow(row)
-    year_report.close()
-
-    if sys.version_info > (3, 0):
-        year_report_read = open(year_path, "r", newline="")
-    else:
-        year_report_read = open(year_path, "rb")
-    r = csv.reader(year_report_read)
-    years = []
-    for row in r:
-        if row:
-            years.append(row[0])
-    if not years:
-        begin_date = "N/A"
-        end_date = "N/A"
-    else:
-        begin_date = min(years, key=float)
-        end_date = max(years, key=float)
-    year_report_read.close()
-
-    # delete temporary uniqueyear file from csv reports dir
-    os.remove(year_path)
-
-    datemodified_sql = (
-        "SELECT DISTINCT modified FROM siegfried;"  # min and max full modified date
+        "SELECT path, name, is_dir, size, mtime, link_target FROM source_listing WHERE parent=? ORDER BY mtime, name",
+        (parent,),
     )
-    datemodified_path = os.path.join(csv_dir, "datemodified.csv")
-    # specify newline in python3 to prevent extra csv lines in windows
-    # read and write csv in byte mode in python2
-    if sys.version_info > (3, 0):
-        date_report = open(datemodified_path, "w", newline="")
-    else:
-        date_report = open(datemodified_path, "wb")
-    w = csv.writer(date_report)
-    for row in cursor.execute(datemodified_sql):
-        w.writerow(row)
-    date_report.close()
-
-    if sys.version_info > (3, 0):
-        date_report_read = open(datemodified_path, "r", newline="")
-    else:
-        date_report_read = open(datemodified_path, "rb")
-    r = csv.reader(date_report_read)
-    dates = []
-    for row in r:
-        if row:
-            dates.append(row[0])
-    if not dates:
-        earliest_date = "N/A"
-        latest_date = "N/A"
-    else:
-        earliest_date = min(dates)
-        latest_date = max(dates)
-    date_report_read.close()
-
-    os.remove(
-        datemodified_path
-    )  # delete temporary datemodified file from csv reports dir
-
-    cursor.execute(
-        "SELECT COUNT(DISTINCT format) as formats from siegfried WHERE format <> '';"
-    )  # number of identfied file formats
-    num_formats = cursor.fetchone()[0]
-
-    cursor.execute(
-        "SELECT COUNT(*) FROM siegfried WHERE errors <> '';"
-    )  # number of siegfried errors
-    num_errors = cursor.fetchone()[0]
-
-    cursor.execute(
-        "SELECT COUNT(*) FROM siegfried WHERE warning <> '';"
-    )  # number of siegfried warnings
-    num_warnings = cursor.fetchone()[0]
-
-    # calculate size from recursive dirwalk and format
-    size_bytes = 0
-    if sys.version_info > (3, 0):
-        for root, dirs, files in os.walk(source_dir):
-            for f in files:
-                file_path = os.path.join(root, f)
-                file_info = os.stat(file_path)
-                size_bytes += file_info.st_size
-    else:
-        for root, dirs, files in os.walk(unicode(source_dir, "utf-8")):
-            for f in files:
-                file_path = os.path.join(root, f)
-                try:
-                    file_info = os.stat(file_path)
-                    size_bytes += file_info.st_size
-                except OSError as e:  # report when Brunnhilde can't find file
-                    logger.warning(
-                        "OSError: {}. File size of this file not included in Brunnhilde HTML report statistics.".format(
-                            file_path
-                        )
-                    )
-    size = convert_size(size_bytes)
+    return cursor.fetchall()
+
+
+def _tree_size_text(size):
+    """Return size in the human-readable format of tree -h"""
+    units = " KMGTPEZY"
+    value = float(size)
+    unit = 0
+    while value >= 1024 and unit < len(units) - 1:
+        value /= 1024
+        unit += 1
+    if not unit:
+        return "{:4d}".format(size)
+    if value >= 9.95:
+        return "{:3.0f}{}".format(value, units[unit])
+    return "{:3.1f}{}".format(value, units[unit])
+
+
+def _tree_date_text(mtime, now=None):
+    """Return modification time in the format of tree -D"""
+    if now is None:
+        now = time.time()
+    date_format = "%b %e %H:%M"
+    if mtime > now or mtime + 60 * 60 * 24 * 182 < now:
+        date_format = "%b %e  %Y"
+    return time.strftime(date_format, time.localtime(mtime))
+
+
+def write_tree_text(cursor, source_dir, out):
+    """Write source_listing as a tree -tDh style text tree to out"""
+    out.write("{}\n".format(source_dir))
+    num_dirs = 0
+    num_files = 0
+    # Each frame is [children, index of next child, line prefix]
+    stack = [[_listing_children(cursor, source_dir), 0, ""]]
+    while stack:
+        frame = stack[-1]
+        children, i, prefix = frame
+        if i == len(children):
+            stack.pop()
+            continue
+        frame[1] += 1
+        path, name, is_dir, size, mtime, link_target = children[i]
+        is_last = i == len(children) - 1
+        if link_target is not None:
+            name = "{} -> {}".format(name, link_target)
+        out.write(
+            "{}{} [{} {}]  {}\n".format(
+                prefix,
+                "└──" if is_last else "├──",
+                _tree_size_text(size),
+                _tree_date_text(mtime),
+                name,
+            )
+        )
+        if is_dir:
+            num_dirs += 1
+            child_prefix = prefix + ("    " if is_last else "│   ")
+            stack.append([_listing_children(cursor, path), 0, child_prefix])
+        else:
+            num_files += 1
+    out.write("\n{} directories, {} files\n".format(num_dirs, num_files))
 
-    # write html
-    html.write("<!DOCTYPE html>")
-    html.write('\n<html lang="en">')
-    html.write("\n<head>")
-    html.write("\n<title>Brunnhilde report: {}</title>".format(basename))
-    html.write('\n<meta charset="utf-8">')
-    html.write('\n<style type="text/css">{}</style>'.format(CSS))
-    html.write("\n</head>")
-    html.write("\n<body>")
 
-    # navbar
-    html.write("\n<header>")
-    html.write("\n<h1>Brunnhilde HTML report</h1>")
-    html.write("\n<nav>")
-    html.write('\n<a href="#Provenance">Provenance</a>')
-    html.write('\n<a href="#Stats">Statistics</a>')
-    if not (args.noclam or sys.platform.startswith("win")):
-        html.write('\n<a href="#Virus report">Virus report</a>')
-    html.write('\n<a href="#File formats">File formats</a>')
-    html.write('\n<a href="#File format versions">Versions</a>')
-    html.write('\n<a href="#MIME types">MIME types</a>')
-    html.write('\n<a href="#Last modified dates by year">Dates</a>')
-    html.write('\n<a href="#Unidentified">Unidentified</a>')
-    if args.warnings:
-        html.write('\n<a href="#Warnings">Warnings</a>')
-    html.write('\n<a href="#Errors">Errors</a>')
-    if use_hash:
-        html.write('\n<a href="#Duplicates">Duplicates</a>')
-    if args.bulkextractor:
-        html.write('\n<a href="#SSNs">SSNs</a>')
-    html.write("\n</nav>")
-    html.write("\n</header>")
+def write_tree_json(cursor, source_dir, out):
+    """Write source_listing as JSON in the layout of tree -J to out
 
-    # provenance
-    html.write("\n<div>")
-    html.write('\n<a class="anchor" name="Provenance"></a>')
-    html.write("\n<h2>Provenance</h2>")
-    html.write(
-        "\n<p><strong>Input source (directory or disk image):</strong> {}</p>".format(
-            source
+    Nodes are written as they are reached, so the whole tree is never
+    held in memory.
+    """
+    out.write(
+        '[\n{{"type": "directory", "name": {}, "contents": ['.format(
+            json.dumps(source_dir)
         )
     )
-    html.write("\n<p><strong>Accession/identifier:</strong> {}</p>".format(basename))
-    html.write(
-        "\n<p><strong>Brunnhilde version:</strong> {}</p>".format(BRUNNHILDE_VERSION)
-    )
-    if not (args.csv or args.stdin):
-        html.write(
-            "\n<p><strong>Siegfried version:</strong> {}</p>".format(siegfried_version)
+    num_dirs = 0
+    num_files = 0
+    stack = [[_listing_children(cursor, source_dir), 0]]
+    while stack:
+        frame = stack[-1]
+        children, i = frame
+        if i == len(children):
+            stack.pop()
+            out.write("]}")
+            continue
+        frame[1] += 1
+        path, name, is_dir, size, mtime, link_target = children[i]
+        if i:
+            out.write(",")
+        node = OrderedDict(type="file", name=name)
+        if is_dir:
+            node["type"] = "directory"
+        elif link_target is not None:
+            node["type"] = "link"
+            node["target"] = link_target
+        node["size"] = size
+        node["time"] = datetime.datetime.fromtimestamp(mtime).isoformat()
+        node_json = json.dumps(node, ensure_ascii=False)
+        if is_dir:
+            num_dirs += 1
+            out.write('\n{}, "contents": ['.format(node_json[:-1]))
+            stack.append([_listing_children(cursor, path), 0])
+        else:
+            num_files += 1
+            out.write("\n{}".format(node_json))
+    out.write(
+        ',\n{{"type": "report", "directories": {}, "files": {}}}\n]\n'.format(
+            num_dirs, num_files
         )
-        html.write("\n<p><strong>Siegfried command:</strong> {}</p>".format(sf_command))
-    html.write("\n<p><strong>Scan started:</strong> {}</p>".format(scan_started))
-    html.write("\n</div>")
+    )
 
-    # statistics
-    html.write("\n<div>")
-    html.write('\n<a class="anchor" name="Stats"></a>')
-    html.write("\n<h2>Statistics</h2>")
-    html.write("\n<p><strong>Total files:</strong> {}</p>".format(num_files))
-    html.write("\n<p><strong>Total size:</strong> {}</p>".format(size))
-    if use_hash:
-        html.write(
-            "\n<p><strong>Distinct files:</strong> {}</p>".format(distinct_files)
-        )
-        html.write("\n<p><strong>Duplicates:</strong> {}".format(duplicate_copies))
-        if duplicate_copies:
-            html.write(
-                ' (of {} distinct files) <a href="#Duplicates">(see list)</a></p>'.format(
-                    distinct_dupes
-                )
-            )
-        else:
-            html.write(' <a href="#Duplicates">(see list)</a></p>')
-    html.write(
-        "\n<p><strong>Empty (zero byte) files:</strong> {}</p>".format(empty_files)
+
+def open_sf_cache(cache_path, settings):
+    """Open identification cache db, clearing it if settings have changed
+
+    settings is a string describing the Siegfried version and options
+    used. Cached rows are only valid for identical settings.
+    """
+    cache_conn = sqlite3.connect(cache_path)
+    cache_conn.text_factory = str
+    cache_cursor = cache_conn.cursor()
+    cache_cursor.execute(
+        "CREATE TABLE IF NOT EXISTS cache_settings (key text PRIMARY KEY, value text)"
     )
-    html.write("\n<hr>")
-    html.write(
-        "\n<p><strong>Years (last modified):</strong> {begin} - {end}</p>".format(
-            begin=begin_date, end=end_date
-        )
+    cache_cursor.execute(
+        "CREATE TABLE IF NOT EXISTS cache_files (source_path text PRIMARY KEY, size integer, mtime_ns integer, inode integer)"
     )
-    html.write("\n<p><strong>Earliest date:</strong> {}</p>".format(earliest_date))
-    html.write("\n<p><strong>Latest date:</strong> {}</p>".format(latest_date))
-    html.write("\n<hr>")
-    html.write(
-        "\n<p><strong>Identified file formats:</strong> {}</p>".format(num_formats)
+    cache_cursor.execute(
+        "CREATE TABLE IF NOT EXISTS cache_rows (source_path text, filename text, filesize text, modified text, errors text, hash text, namespace text, id text, format text, version text, mime text, basis text, warning text, class text)"
     )
-    html.write(
-        "\n<p><strong>Unidentified files:</strong> {}".format(unidentified_files)
+    cache_cursor.execute(
+        "CREATE INDEX IF NOT EXISTS cache_rows_source_path ON cache_rows (source_path)"
     )
-    if unidentified_files:
-        html.write(' <a href="#Unidentified">(see list)</a></p>')
-    else:
-        html.write(" </p>")
-    html.write("\n<hr>")
-    if args.warnings:
-        html.write("\n<p><strong>Siegfried warnings:</strong> {}".format(num_warnings))
-        if num_warnings:
-            html.write(' <a href="#Warnings">(see list)</a></p>')
-        else:
-            html.write(" </p>")
-    html.write("\n<p><strong>Siegfried errors:</strong> {}".format(num_errors))
-    if num_errors:
-        html.write(' <a href="#Errors">(see list)</a></p>')
-    else:
-        html.write(" </p>")
-    html.write("\n</div>")
+    cache_cursor.execute("SELECT value FROM cache_settings WHERE key='settings'")
+    row = cache_cursor.fetchone()
+    if row is None or row[0] != settings:
+        if row is not None:
+            log_info("Siegfried settings changed. Clearing identification cache.")
+        cache_cursor.execute("DELETE FROM cache_files")
+        cache_cursor.execute("DELETE FROM cache_rows")
+        cache_cursor.execute(
+            "INSERT OR REPLACE INTO cache_settings (key, value) VALUES ('settings', ?)",
+            (settings,),
+        )
+    cache_conn.commit()
+    return cache_conn, cache_cursor
+
+
+def _chunk_paths(paths):
+    """Yield lists of paths short enough to pass as command line arguments"""
+    chunk = []
+    chunk_chars = 0
+    for path in paths:
+        if chunk and (
+            len(chunk) >= CACHE_SCAN_MAX_FILES
+            or chunk_chars + len(path) > CACHE_SCAN_MAX_CHARS
+        ):
+            yield chunk
+            chunk = []
+            chunk_chars = 0
+        chunk.append(path)
+        chunk_chars += len(path) + 1
+    if chunk:
+        yield chunk
+
+
+def _sf_csv_outputs(sf_options, paths):
+    """Run Siegfried on paths in chunks, yielding (header, csv reader) per run
+
+    Each Siegfried process is waited on once its reader has been
+    consumed and the generator resumed.
+    """
+    for chunk in _chunk_paths(paths):
+        process = subprocess.Popen(["sf"] + sf_options + chunk, stdout=subprocess.PIPE)
+        sf_output = io.TextIOWrapper(
+            process.stdout, encoding="utf8", errors="ignore", newline=""
+        )
+        reader = csv.reader(sf_output)
+        try:
+            yield next(reader, []), reader
+        finally:
+            process.stdout.close()
+            process.wait()
 
-    # virus report
-    if not (args.noclam or sys.platform.startswith("win")):
-        html.write("\n<div>")
-        html.write('\n<a class="anchor" name="Virus report"></a>')
-        html.write("\n<h2>Virus report</h2>")
-        with open(os.path.join(log_dir, "viruscheck-log.txt")) as f:
-            for line in f:
-                html.write("\n<p>{}</p>".format(line))
-        html.write("\n</div>")
 
+def _scan_files_into_cache(args, use_hash, paths, identities, cache_cursor, jobs=None):
+    """Run Siegfried on list of files and replace their rows in the cache
 
-def generate_reports(args, cursor, html, use_hash):
-    """Run sql queries on db to generate reports, write to csv and html"""
-    full_header = [
-        "Filename",
-        "Filesize",
-        "Date modified",
-        "Errors",
-        "Namespace",
-        "ID",
-        "Format",
-        "Format version",
-        "MIME type",
-        "Basis for ID",
-        "Warning",
-    ]
-    if use_hash:
-        full_header.insert(4, "Checksum")
-
-    # sorted format list report
-    sql = "SELECT format, id, COUNT(*) as 'num' FROM siegfried GROUP BY format ORDER BY num DESC"
-    path = os.path.join(csv_dir, "formats.csv")
-    format_header = ["Format", "ID", "Count"]
-    sqlite_to_csv(sql, path, format_header, cursor)
-    write_html_report_section("File formats", path, ",", html)
-
-    # sorted format and version list report
-    sql = "SELECT format, id, version, COUNT(*) as 'num' FROM siegfried GROUP BY format, version ORDER BY num DESC"
-    path = os.path.join(csv_dir, "formatVersions.csv")
-    version_header = ["Format", "ID", "Version", "Count"]
-    sqlite_to_csv(sql, path, version_header, cursor)
-    write_html_report_section("File format versions", path, ",", html)
-
-    # sorted mimetype list report
-    sql = (
-        "SELECT mime, COUNT(*) as 'num' FROM siegfried GROUP BY mime ORDER BY num DESC"
-    )
-    path = os.path.join(csv_dir, "mimetypes.csv")
-    mime_header = ["MIME type", "Count"]
-    sqlite_to_csv(sql, path, mime_header, cursor)
-    write_html_report_section("MIME types", path, ",", html)
-
-    # dates report
-    sql = "SELECT SUBSTR(modified, 1, 4) as 'year', COUNT(*) as 'num' FROM siegfried GROUP BY year ORDER BY num DESC"
-    path = os.path.join(csv_dir, "years.csv")
-    year_header = ["Year Last Modified", "Count"]
-    sqlite_to_csv(sql, path, year_header, cursor)
-    write_html_report_section("Last modified dates by year", path, ",", html)
-
-    # unidentified files report
-    sql = "SELECT filename, filesize, modified FROM siegfried WHERE id='UNKNOWN';"
-    path = os.path.join(csv_dir, "unidentified.csv")
-    unidentified_header = ["File", "Size", "Date Modified"]
-    sqlite_to_csv(sql, path, unidentified_header, cursor)
-    write_html_report_section("Unidentified", path, ",", html)
-
-    # warnings report
-    sql = "SELECT filename, errors, id, format, version, basis, warning FROM siegfried WHERE warning <> '';"
-    path = os.path.join(csv_dir, "warnings.csv")
-    warnings_header = [
-        "File",
-        "Errors",
-        "ID",
-        "Format",
-        "Version",
-        "Basis for ID",
-        "Warning",
-    ]
-    sqlite_to_csv(sql, path, warnings_header, cursor)
-    if args.warnings:
-        write_html_report_section("Warnings", path, ",", html)
+    identities maps each path to its (size, mtime_ns, inode).
+    """
+    scanned = set(paths)
+    sf_options = _sf_options(args, use_hash) + _sf_jobs_options(jobs)
+    for header, reader in _sf_csv_outputs(sf_options, paths):
+        indexes, hash_algorithm_used = _siegfried_column_indexes(header)
+        rows_by_path = {}
+        for row in _siegfried_row_tuples(reader, indexes):
+            # Rows for archive members are named "archive#member"
+            source_path = row[0]
+            while source_path not in scanned and "#" in source_path:
+                source_path = source_path.rsplit("#", 1)[0]
+            rows_by_path.setdefault(source_path, []).append(row)
+
+        for source_path, rows in rows_by_path.items():
+            if source_path not in scanned:
+                continue
+            cache_cursor.execute(
+                "DELETE FROM cache_rows WHERE source_path=?", (source_path,)
+            )
+            cache_cursor.executemany(
+                "INSERT INTO cache_rows VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                [(source_path,) + row for row in rows],
+            )
+            cache_cursor.execute(
+                "INSERT OR REPLACE INTO cache_files (source_path, size, mtime_ns, inode) VALUES (?,?,?,?)",
+                (source_path,) + identities[source_path],
+            )
 
-    # errors report
-    sql = "SELECT filename, filesize, modified, errors, warning FROM siegfried WHERE errors <> '';"
-    path = os.path.join(csv_dir, "errors.csv")
-    errors_header = ["File", "Size", "Date Modified", "Errors", "Warnings"]
-    sqlite_to_csv(sql, path, errors_header, cursor)
-    write_html_report_section("Errors", path, ",", html)
 
-    if use_hash:
-        # duplicates report
-        sql = "SELECT * FROM siegfried WHERE hash IN (SELECT hash FROM siegfried WHERE filesize<>'0' GROUP BY hash HAVING COUNT(hash) > 1 AND COUNT(DISTINCT filename) > 1) ORDER BY hash;"
-        path = os.path.join(csv_dir, "duplicates.csv")
-        sqlite_to_csv(sql, path, full_header, cursor)
-        write_html_report_section("Duplicates", path, ",", html)
+def _stat_mtime_ns(file_stat):
+    """Return modification time of stat result in integer nanoseconds"""
+    if hasattr(file_stat, "st_mtime_ns"):
+        return file_stat.st_mtime_ns
+    return int(file_stat.st_mtime * 1e9)
 
 
-def sqlite_to_csv(sql, path, header, cursor):
-    """Execute SQL query and write results, if any, to a CSV file
+def make_size_balanced_shards(files, num_shards):
+    """Partition (path, size) pairs into num_shards bins of similar total size
 
-    In Python 3, specify newline to prevent extra lines in Windows.
-    In Python 2, write the CSV in byte mode.
+    Files are placed largest first into the bin with the smallest total
+    so far, so one very large file does not end up alongside a long tail
+    of small ones. Ties are broken by path, making the partition
+    deterministic for a given tree. Empty bins are dropped and paths in
+    each bin are sorted.
     """
-    cursor.execute(sql)
-    results = cursor.fetchall()
-    if not results:
-        return
-    if sys.version_info > (3, 0):
-        report = open(path, "w", newline="", encoding="utf8")
-    else:
-        report = open(path, "wb")
-    w = csv.writer(report)
-    w.writerow(header)
-    for row in results:
-        w.writerow(row)
-    report.close()
+    bins = [(0, i) for i in range(num_shards)]
+    heapq.heapify(bins)
+    shards = [[] for i in range(num_shards)]
+    for path, size in sorted(files, key=lambda f: (-f[1], f[0])):
+        total, i = heapq.heappop(bins)
+        shards[i].append(path)
+        heapq.heappush(bins, (total + size, i))
+    return [sorted(shard) for shard in shards if shard]
+
+
+def _run_sf_shard(sf_options, paths, shard_csv):
+    """Run Siegfried on one shard of files, writing its CSV to shard_csv"""
+    out = open(shard_csv, "w", newline="", encoding="utf8")
+    w = csv.writer(out)
+    header_written = False
+    try:
+        for header, reader in _sf_csv_outputs(sf_options, paths):
+            if not header_written:
+                w.writerow(header)
+                header_written = True
+            w.writerows(reader)
+    finally:
+        out.close()
+
 
+SF_SERVER_TIMEOUT = 60
 
-def write_html_report_section(header, path, file_delimiter, html):
-    """Write HTML report section from input CSV file or bulk_extractor feature file
+_sf_server_pool = {}
+_sf_server_pool_lock = threading.Lock()
 
-    If expected source doesn't exist, write default message instead.
+
+def _get_sf_server_connection(server_url):
+    """Return idle keep-alive connection to Siegfried server, or a new one"""
+    parts = urlsplit(server_url)
+    with _sf_server_pool_lock:
+        idle = _sf_server_pool.setdefault(parts.netloc, [])
+        if idle:
+            return idle.pop()
+    if parts.scheme == "https":
+        return http.client.HTTPSConnection(parts.netloc, timeout=SF_SERVER_TIMEOUT)
+    return http.client.HTTPConnection(parts.netloc, timeout=SF_SERVER_TIMEOUT)
+
+
+def _release_sf_server_connection(server_url, connection):
+    """Return connection to pool for reuse by later requests"""
+    with _sf_server_pool_lock:
+        _sf_server_pool.setdefault(urlsplit(server_url).netloc, []).append(connection)
+
+
+def _sf_server_request(server_url, path):
+    """Send GET request to Siegfried server, returning (connection, response)
+
+    A pooled connection that the server has since closed is retried once
+    on a fresh connection.
     """
-    input_exists = True
-    if os.path.isfile(path) and os.path.getsize(path) > 0:
-        if sys.version_info > (3, 0):
-            in_file = open(path, "r", encoding="utf8")
-        else:
-            in_file = open(path, "rb")
-        # open csv reader
-        r = csv.reader(in_file, delimiter="%s" % file_delimiter)
-    else:
-        input_exists = False
+    for attempt in (1, 2):
+        connection = _get_sf_server_connection(server_url)
+        try:
+            connection.request("GET", path)
+            return connection, connection.getresponse()
+        except (http.client.HTTPException, socket.error):
+            connection.close()
+            if attempt == 2:
+                raise
 
-    # write header
-    html.write("\n<div>")
-    html.write('\n<a class="anchor" name="{}"></a>'.format(header))
-    html.write("\n<h2>{}</h2>".format(header))
-    if header == "Duplicates":
-        html.write("\n<p><em>Duplicates are grouped by hash value.</em></p>")
-    elif header == "SSNs":
-        html.write(
-            "\n<p><em>Potential Social Security Numbers identified by bulk_extractor.</em></p>"
+
+def sf_server_available(server_url):
+    """Return True if a Siegfried server answers at server_url"""
+    try:
+        connection, response = _sf_server_request(server_url, "/")
+        response.read()
+    except (http.client.HTTPException, socket.error) as e:
+        logger.warning("Siegfried server at {} unavailable: {}".format(server_url, e))
+        return False
+    _release_sf_server_connection(server_url, connection)
+    return response.status == 200
+
+
+def _sf_server_identify_path(args, source_dir, use_hash):
+    """Return request path asking Siegfried server to identify source_dir"""
+    if not isinstance(source_dir, bytes):
+        source_dir = source_dir.encode("utf8")
+    params = [("base64", "true"), ("format", "csv")]
+    if use_hash:
+        params.append(("hash", _determine_hash_type(args)))
+    if args.scanarchives:
+        params.append(("z", "true"))
+    encoded = base64.urlsafe_b64encode(source_dir).decode("ascii")
+    return "{}/identify/{}?{}".format(
+        urlsplit(args.sf_server).path.rstrip("/"), encoded, urlencode(params)
+    )
+
+
+def clamd_available():
+    """Return True if clamdscan is installed and a clamd daemon answers
+
+    clamdscan --ping exits with status 0 only if clamd responds. Older
+    versions of clamdscan without --ping are treated as unavailable.
+    """
+    try:
+        status = subprocess.call(
+            ["clamdscan", "--ping", "1"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
         )
+    except OSError:
+        return False
+    return status == 0
 
-    DEFAULT_TEXT = "\nNone found.\n<br><br>"
-    if not input_exists:
-        html.write(DEFAULT_TEXT)
-        html.write("\n</div>")
-        return
-
-    # if writing PII, handle separately
-    if header == "SSNs":
-        html.write("\n<table>")
-        # write header
-        html.write("\n<thead>")
-        html.write("\n<tr>")
-        html.write("\n<th>File</th>")
-        html.write("\n<th>Feature</th>")
-        html.write("\n<th>Context</th>")
-        html.write("\n</tr>")
-        html.write("\n</thead>")
-        # write data
-        html.write("\n<tbody>")
-        for row in islice(r, 4, None):  # skip header lines
-            for row in r:
-                # write data
-                html.write("\n<tr>")
-                for column in row:
-                    html.write("\n<td>" + column + "</td>")
-                html.write("\n</tr>")
-        html.write("\n</tbody>")
-        html.write("\n</table>")
-
-    # if writing duplicates, handle separately
-    elif header == "Duplicates":
-        # read md5s from csv and write to dict
-        duplicates_dict = {}
-        for row in r:
-            if row and row[4]:
-                hash_value = row[4]
-                if hash_value not in duplicates_dict.keys():
-                    # Store info from first file with matching hash
-                    duplicates_dict[hash_value] = {
-                        "info": {
-                            "row_size": row[1],
-                            "row_errors": row[3],
-                            "row_id": row[6],
-                            "row_format": row[7],
-                            "row_format_version": row[8],
-                            "row_mime": row[9],
-                            "row_basis": row[10],
-                            "row_warning": row[11],
-                        },
-                        "files": [],
-                    }
-                row_file_info = {"row_filename": row[0], "row_date_modified": row[2]}
-                duplicates_dict[hash_value]["files"].append(row_file_info)
-
-        # deduplicate md5_list and remove column header from list
-        hash_list = sorted(list(OrderedDict.fromkeys(duplicates_dict)))
-        hash_list.remove("Checksum")
-        # for each hash in md5_list, print header, file info, and list of matching files
-        for hash_value in hash_list:
-            html.write(
-                "\n<p>Files matching hash <strong>{}</strong>:</p>".format(hash_value)
-            )
-            # Print info for the group
-            hash_info = duplicates_dict[hash_value]["info"]
-            row_size_readable = convert_size(int(hash_info["row_size"]))
-            html.write("\n<ul>")
-            if " bytes" in row_size_readable:
-                html.write(
-                    "\n<li><strong>Size:</strong> {} bytes</li>".format(
-                        hash_info["row_size"]
-                    )
-                )
-            else:
-                html.write(
-                    "\n<li><strong>Size:</strong> {bytes} bytes ({readable})</li>".format(
-                        bytes=hash_info["row_size"], readable=row_size_readable
-                    )
-                )
-            html.write(
-                "\n<li><strong>ID:</strong> {}</li>".format(
-                    add_pronom_link_for_puids(hash_info["row_id"])
-                )
-            )
-            html.write(
-                "\n<li><strong>Format:</strong> {}</li>".format(hash_info["row_format"])
-            )
-            if hash_info["row_format_version"]:
-                html.write(
-                    "\n<li><strong>Format version:</strong> {}</li>".format(
-                        hash_info["row_format_version"]
-                    )
-                )
-            if hash_info["row_mime"]:
-                html.write(
-                    "\n<li><strong>MIME type:</strong> {}</li>".format(
-                        hash_info["row_mime"]
-                    )
-                )
-            if hash_info["row_basis"]:
-                html.write(
-                    "\n<li><strong>Basis for ID:</strong> {}</li>".format(
-                        hash_info["row_basis"]
-                    )
-                )
-            if hash_info["row_warning"]:
-                html.write(
-                    "\n<li><strong>Warning:</strong> {}</li>".format(
-                        hash_info["row_warning"]
-                    )
-                )
-            if hash_info["row_errors"]:
-                html.write(
-                    "\n<li><strong>Errors:</strong> {}</li>".format(
-                        hash_info["row_errors"]
-                    )
-                )
-            html.write("\n</ul>")
-
-            # Write table of matching files (columns: filename, modified date)
-            html.write("\n<table>")
-            html.write("\n<thead>")
-            html.write("\n<tr>")
-            html.write("\n<th>Filename</th><th>Date modified</th>")
-            html.write("\n</tr>")
-            html.write("\n</thead>")
-            html.write("\n<tbody>")
-            for file_info in duplicates_dict[hash_value]["files"]:
-                # write data
-                html.write("\n<tr>")
-                html.write("\n<td>" + file_info["row_filename"] + "</td>")
-                html.write("\n<td>" + file_info["row_date_modified"] + "</td>")
-                html.write("\n</tr>")
-            html.write("\n</tbody>")
-            html.write("\n</table>")
-            html.write("<br>")
-
-    # otherwise write as normal
-    else:
-        html.write("\n<table>")
-        # write header row
-        html.write("\n<thead>")
-        html.write("\n<tr>")
-        row1 = next(r)
-        for column in row1:
-            html.write("\n<th>" + column + "</th>")
-        html.write("\n</tr>")
-        html.write("\n</thead>")
-        # write data rows
-        html.write("\n<tbody>")
-        for row in r:
-            # write data
-            html.write("\n<tr>")
-            for column in row:
-                column = add_pronom_link_for_puids(column)
-                html.write("\n<td>" + column + "</td>")
-            html.write("\n</tr>")
-        html.write("\n</tbody>")
-        html.write("\n</table>")
 
-    html.write("\n</div>")
-    in_file.close()
+def _clamdscan_command(source_dir):
+    """Return clamdscan command scanning source_dir with all clamd threads
 
+    --fdpass passes open file descriptors to clamd, so that the daemon
+    can scan files its own user would not have permission to read.
+    """
+    return ["clamdscan", "-i", "--multiscan", "--fdpass", source_dir]
 
-def _return_csv_reader_to_start_of_file(csv_reader_instance):
-    csv_reader_instance.seek(0)
 
+CLAMAV_STATUSES = ("FOUND", "ERROR")
 
-def add_pronom_link_for_puids(text):
-    """If text is a PUID, add a link to the PRONOM website"""
-    PUID_REGEX = r"fmt\/[0-9]+|x\-fmt\/[0-9]+"  # regex to match fmt/# or x-fmt/#
-    if re.match(PUID_REGEX, text) is not None:
-        return '<a href="https://nationalarchives.gov.uk/PRONOM/{}" target="_blank">{}</a>'.format(
-            text, text
-        )
-    return text
+# clamscan scans one file at a time, and the threads of clamd are set
+# in clamd.conf, so ClamAV takes one job from a --jobs budget
+CLAMAV_JOBS = 1
 
 
-def close_html_report(html):
-    """Add JavaScript and write html closing tags"""
-    html.write("\n</body>")
-    html.write("\n</html>")
+def _iter_clamav_results(lines, summary):
+    """Yield (filename, signature, status) for each file in ClamAV output
 
+    Lines after the scan summary heading are appended to the summary
+    list as (name, value) pairs instead. Signature names do not contain
+    ": ", but error messages may, so FOUND lines are split at the last
+    ": " and ERROR lines at the first.
+    """
+    in_summary = False
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if in_summary:
+            name, sep, value = line.partition(": ")
+            if sep:
+                summary.append((name, value))
+            continue
+        if line.strip("- ") == "SCAN SUMMARY":
+            in_summary = True
+            continue
+        text, sep, status = line.rpartition(" ")
+        if status not in CLAMAV_STATUSES:
+            continue
+        if status == "FOUND":
+            filename, sep, signature = text.rpartition(": ")
+        else:
+            filename, sep, signature = text.partition(": ")
+        if sep:
+            yield (filename, signature, status)
 
-def make_tree(source_dir):
-    """Call tree on source directory and save output to tree.txt"""
-    tree_command = 'tree -tDhR "%s" > "%s"' % (
-        source_dir,
-        os.path.join(report_dir, "tree.txt"),
-    )
-    subprocess.call(tree_command, shell=True)
 
+def load_clamav_log(cursor, conn, log_file):
+    """Parse clamscan or clamdscan output into clamav and clamav_summary tables
 
-def accept_or_run_siegfried(args, source_dir, use_hash):
-    """Write file/stdin Siegfried CSV to sf_file or run Siegfried to create it"""
-    if args.csv:
-        try:
-            shutil.copyfile(os.path.abspath(args.csv), sf_file)
-        except (IOError, OSError) as e:
-            log_error_and_exit_message("Unable to copy CSV file: {}".format(e))
-            sys.exit(1)
+    log_file is read a line at a time. clamav has one row per file
+    reported as infected or not scanned, and clamav_summary the name and
+    value of each line of the scan summary. Returns number of clamav rows.
+    """
+    cursor.execute("DROP TABLE IF EXISTS clamav")
+    cursor.execute("DROP TABLE IF EXISTS clamav_summary")
+    cursor.execute("CREATE TABLE clamav (filename text, signature text, status text)")
+    cursor.execute("CREATE TABLE clamav_summary (name text, value text)")
+    summary = []
+    rows = _iter_clamav_results(log_file, summary)
+    num_rows = 0
+    while True:
+        batch = list(islice(rows, IMPORT_BATCH_SIZE))
+        if not batch:
+            break
+        cursor.executemany("INSERT INTO clamav VALUES (?,?,?);", batch)
+        num_rows += len(batch)
+    cursor.executemany("INSERT INTO clamav_summary VALUES (?,?);", summary)
+    cursor.execute("CREATE INDEX clamav_filename ON clamav (filename);")
+    conn.commit()
+    return num_rows
 
-    elif args.stdin:
-        try:
-            if sys.version_info > (3, 0):
-                csv_out = open(sf_file, "w", newline="")
-            else:
-                csv_out = open(sf_file, "wb")
-            csv_writer = csv.writer(csv_out)
-            csv_reader = csv.reader(sys.stdin, delimiter=",")
-            for line in csv_reader:
-                csv_writer.writerow(line)
-            csv_out.close()
-        except Exception as e:
-            log_error_and_exit_message(
-                "Unable to read CSV from piped stdin: {}".format(e)
-            )
-            sys.exit(1)
 
-    else:
-        run_siegfried(args, source_dir, use_hash)
+# Files reported by ClamAV, with Siegfried's identification where the
+# path is one Siegfried scanned
+CLAMAV_FINDINGS_SQL = """SELECT c.filename, c.signature, c.status, i.id, i.format, i.version, i.mime
+    FROM clamav AS c
+    LEFT JOIN siegfried_files AS f ON f.filename = c.filename
+    LEFT JOIN siegfried_identifications AS i ON i.ident_id = f.ident_id
+    ORDER BY c.rowid;"""
 
 
-def process_content(
-    args, source_dir, cursor, conn, html, siegfried_version, use_hash, ssn_mode
-):
-    """Run through main processing flow on specified directory"""
-    scan_started = str(datetime.datetime.now())
-    accept_or_run_siegfried(args, source_dir, use_hash)
-    use_hash = import_csv(cursor, conn, use_hash)
-    create_html_report(
-        args, source_dir, scan_started, cursor, html, siegfried_version, use_hash
-    )
-    generate_reports(args, cursor, html, use_hash)
-    if args.bulkextractor:
-        run_bulk_extractor(args, source_dir, ssn_mode)
-        write_html_report_section(
-            "SSNs", os.path.join(bulkext_dir, "pii.txt"), "\t", html
-        )
-    close_html_report(html)  # close HTML file tags
-    if not sys.platform.startswith("win"):
-        make_tree(source_dir)  # create tree.txt on mac and linux machines
-
-
-def carve_files_with_unhfs(args, html, out_dir, disk_image):
-    """Carve files from HFS disk image"""
-    if sys.platform.startswith("linux"):
-        unhfs_bin = "/usr/share/hfsexplorer/bin/unhfs"
-    elif sys.platform.startswith("darwin"):
-        unhfs_bin = "/usr/local/share/hfsexplorer/bin/unhfs"
-    # TODO: Add else statement with path to unhfs binary on windows
-
-    cmd = [unhfs_bin, "-v", "-o", out_dir, disk_image]
-    if args.hfs_resforks:
-        cmd.insert(1, "-resforks")
-        cmd.insert(2, "APPLEDOUBLE")
-    if args.hfs_partition:
-        cmd.insert(1, "-partition")
-        cmd.insert(2, str(args.hfs_partition))
-    if args.hfs_fsroot:
-        cmd.insert(1, "-fsroot")
-        cmd.insert(2, args.hfs_fsroot)
-
-    log_info("Attempting to carve files from disk image using HFS Explorer.")
-    try:
-        subprocess.check_output(cmd)
-        log_info("File carving successful.")
-    except subprocess.CalledProcessError as e:
-        log_error_and_exit_message(
-            "Unable to export files from disk image: {}".format(e.output)
-        )
-        close_files_conns_on_exit(html, conn, cursor, report_dir)
-        sys.exit(1)
+# bulk_extractor feature files and histograms loaded into the database,
+# named by feature recorder
+BULK_EXTRACTOR_FEATURE_FILES = ("pii", "email", "ccn", "url")
+BULK_EXTRACTOR_HISTOGRAMS = ("email_histogram", "ccn_histogram", "url_histogram")
 
+# Offset at the end of a forensic path, after "-RECORDER-offset" for each
+# layer of decoding, e.g. "/src/a.zip-1024-ZIP-30"
+_BULK_EXTRACTOR_OFFSET_REGEX = re.compile(r"-[0-9]+(?:-[A-Z0-9_]+-[0-9]+)*$")
 
-def carve_files_with_tsk_recover(args, html, out_dir, disk_image):
-    """Attempt to carve files from disk image with tsk_recover"""
-    mode = "-e"
-    if args.allocated:
-        mode = "-a"
-
-    cmd = ["tsk_recover", mode, disk_image, out_dir]
-    if args.tsk_fstype:
-        cmd.insert(2, "-f")
-        cmd.insert(3, args.tsk_fstype)
-    if args.tsk_imgtype:
-        cmd.insert(2, "-i")
-        cmd.insert(3, args.tsk_imgtype)
-    if args.tsk_sector_offset:
-        cmd.insert(2, "-o")
-        cmd.insert(3, args.tsk_sector_offset)
-
-    log_info("Attempting to carve files from disk image using tsk_recover.")
-    try:
-        subprocess.check_output(cmd)
-        log_info("File carving successful.")
-    except subprocess.CalledProcessError as e:
-        log_error_and_exit_message(
-            "Unable to export files from disk image: {}".format(e.output)
+
+def _bulk_extractor_filename(forensic_path):
+    """Return path of scanned file from forensic path in a feature file"""
+    match = _BULK_EXTRACTOR_OFFSET_REGEX.search(forensic_path)
+    if match is None:
+        return forensic_path
+    return forensic_path[: match.start()]
+
+
+def _iter_bulk_extractor_features(recorder, lines):
+    """Yield feature rows from lines of a bulk_extractor feature file
+
+    Rows are (recorder, forensic_path, filename, feature, context).
+    Comment lines, which bulk_extractor writes at the top of each file
+    in a number that varies between versions, are skipped.
+    """
+    for line in lines:
+        if line.startswith("#"):
+            continue
+        fields = line.rstrip("\r\n").split("\t", 2)
+        if len(fields) < 2:
+            continue
+        context = fields[2] if len(fields) > 2 else ""
+        yield (
+            recorder,
+            fields[0],
+            _bulk_extractor_filename(fields[0]),
+            fields[1],
+            context,
         )
-        close_files_conns_on_exit(html, conn, cursor, report_dir)
-        sys.exit(1)
 
 
-def create_dfxml():
-    """Create DFXML with fiwalk"""
-    fiwalk_file = os.path.join(report_dir, "dfxml.xml")
-    log_info("Attempting to generate DFXML file from disk image using fiwalk.")
-    try:
-        subprocess.check_output(["fiwalk", "-X", fiwalk_file, source])
-        log_info("DFXML file created.")
-    except subprocess.CalledProcessError as e:
-        logger.warning("Fiwalk could not create DFXML for disk: {}".format(e.output))
+def _iter_bulk_extractor_histogram(histogram, lines):
+    """Yield (histogram, count, feature) from lines of a histogram file"""
+    for line in lines:
+        fields = line.rstrip("\r\n").split("\t")
+        if len(fields) < 2 or not fields[0].startswith("n="):
+            continue
+        try:
+            count = int(fields[0][2:])
+        except ValueError:
+            continue
+        yield (histogram, count, fields[1])
 
 
-def close_files_conns_on_exit(html, conn, cursor, report_dir):
-    cursor.close()
-    conn.close()
-    html.close()
-    shutil.rmtree(report_dir)
+def _open_bulk_extractor_file(path):
+    """Open bulk_extractor output, which may start with a byte order mark"""
+    return open(path, "r", encoding="utf-8-sig", errors="replace")
 
 
-def _make_parser():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "-a",
-        "--allocated",
-        help="Instruct tsk_recover to export only allocated files (recovers all files by default)",
-        action="store_true",
+def load_bulk_extractor_output(cursor, conn, bulkext_dir):
+    """Load bulk_extractor feature files and histograms from bulkext_dir
+
+    Features from each of BULK_EXTRACTOR_FEATURE_FILES go in the
+    bulk_extractor_features table, and counts from each of
+    BULK_EXTRACTOR_HISTOGRAMS in bulk_extractor_histograms. Files are
+    read a line at a time and missing files are skipped. Returns number
+    of features loaded.
+    """
+    cursor.execute("DROP TABLE IF EXISTS bulk_extractor_features")
+    cursor.execute("DROP TABLE IF EXISTS bulk_extractor_histograms")
+    cursor.execute(
+        "CREATE TABLE bulk_extractor_features (recorder text, forensic_path text, filename text, feature text, context text)"
     )
-    parser.add_argument(
-        "-b",
-        "--bulkextractor",
-        help="Run Bulk Extractor on source",
-        action="store_true",
+    cursor.execute(
+        "CREATE TABLE bulk_extractor_histograms (histogram text, count integer, feature text)"
+    )
+    sources = [
+        (
+            name,
+            _iter_bulk_extractor_features,
+            "INSERT INTO bulk_extractor_features VALUES (?,?,?,?,?);",
+        )
+        for name in BULK_EXTRACTOR_FEATURE_FILES
+    ] + [
+        (
+            name,
+            _iter_bulk_extractor_histogram,
+            "INSERT INTO bulk_extractor_histograms VALUES (?,?,?);",
+        )
+        for name in BULK_EXTRACTOR_HISTOGRAMS
+    ]
+    num_features = 0
+    _set_bulk_load_pragmas(cursor)
+    try:
+        for name, iter_rows, sql in sources:
+            path = os.path.join(bulkext_dir, "{}.txt".format(name))
+            if not os.path.isfile(path):
+                continue
+            with _open_bulk_extractor_file(path) as f:
+                rows = iter_rows(name, f)
+                while True:
+                    batch = list(islice(rows, IMPORT_BATCH_SIZE))
+                    if not batch:
+                        break
+                    cursor.executemany(sql, batch)
+                    if iter_rows is _iter_bulk_extractor_features:
+                        num_features += len(batch)
+        cursor.execute(
+            "CREATE INDEX bulk_extractor_features_recorder ON bulk_extractor_features (recorder, filename);"
+        )
+        cursor.execute(
+            "CREATE INDEX bulk_extractor_histograms_histogram ON bulk_extractor_histograms (histogram, count);"
+        )
+        conn.commit()
+    finally:
+        _reset_bulk_load_pragmas(cursor)
+    return num_features
+
+
+SSNS_SQL = "SELECT forensic_path, feature, context FROM bulk_extractor_features WHERE recorder = 'pii' ORDER BY rowid;"
+
+# Number of features of each kind of PII per file, with the file's
+# Siegfried identification
+PII_COUNTS_SQL = """SELECT p.filename, p.ssns, p.emails, p.ccns, i.id, i.format
+    FROM (SELECT filename,
+            SUM(recorder = 'pii') AS ssns,
+            SUM(recorder = 'email') AS emails,
+            SUM(recorder = 'ccn') AS ccns
+        FROM bulk_extractor_features
+        WHERE recorder IN ('pii', 'email', 'ccn')
+        GROUP BY filename) AS p
+    LEFT JOIN siegfried_files AS f ON f.filename = p.filename
+    LEFT JOIN siegfried_identifications AS i ON i.ident_id = f.ident_id
+    ORDER BY p.filename;"""
+
+
+def convert_size(size):
+    """Convert size in bytes to human-readable expression"""
+    if size == 0:
+        return "0 bytes"
+    size_name = ("bytes", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")
+    i = int(math.floor(math.log(size, 1024)))
+    p = math.pow(1024, i)
+    s = round(size / p)
+    s = str(s)
+    s = s.replace(".0", "")
+    return "%s %s" % (s, size_name[i])
+
+
+def get_total_size(args, cursor, stats):
+    """Return total size in bytes of files in source
+
+    Siegfried has already recorded the size of every file, so the total
+    is summed from the siegfried table. When scanning archives, rows for
+    archive members would be counted on top of the archives themselves,
+    so the files in the source listing are summed instead.
+    """
+    if args.scanarchives:
+        cursor.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM source_listing WHERE is_file=1;"
+        )
+        return cursor.fetchone()[0]
+    return stats["size_bytes"]
+
+
+def get_aggregate_stats(cursor):
+    """Return dict of summary statistics gathered in one scan of siegfried_files
+
+    Identification and warning conditions are resolved against the small
+    lookup tables once rather than per file. Every lookup row is used by
+    at least one file, so formats are counted from the lookup table.
+    Years and dates are None if no modified dates were recorded.
+    """
+    cursor.execute(
+        """SELECT
+            COUNT(*),
+            COALESCE(SUM(filesize = '0'), 0),
+            COALESCE(SUM(CAST(filesize AS INTEGER)), 0),
+            COUNT(DISTINCT CASE WHEN filesize <> '0' THEN hash END),
+            COALESCE(SUM(ident_id IN (SELECT ident_id FROM siegfried_identifications WHERE id = 'UNKNOWN')), 0),
+            (SELECT COUNT(DISTINCT format) FROM siegfried_identifications WHERE format <> ''),
+            COALESCE(SUM(errors <> ''), 0),
+            COALESCE(SUM(warning_id IN (SELECT warning_id FROM siegfried_warnings WHERE warning <> '')), 0),
+            MIN(CASE WHEN modified <> '' THEN SUBSTR(modified, 1, 4) END),
+            MAX(CASE WHEN modified <> '' THEN SUBSTR(modified, 1, 4) END),
+            MIN(CASE WHEN modified <> '' THEN modified END),
+            MAX(CASE WHEN modified <> '' THEN modified END)
+        FROM siegfried_files;"""
+    )
+    row = cursor.fetchone()
+    keys = (
+        "num_files",
+        "empty_files",
+        "size_bytes",
+        "distinct_files",
+        "unidentified_files",
+        "num_formats",
+        "num_errors",
+        "num_warnings",
+        "begin_year",
+        "end_year",
+        "earliest_date",
+        "latest_date",
+    )
+    return dict(zip(keys, row))
+
+
+SIEGFRIED_COLUMNS = (
+    "filename",
+    "filesize",
+    "modified",
+    "errors",
+    "hash",
+    "namespace",
+    "id",
+    "format",
+    "version",
+    "mime",
+    "basis",
+    "warning",
+    "class",
+)
+
+HASH_COLUMNS = ("md5", "sha1", "sha256", "sha512", "crc")
+
+IMPORT_BATCH_SIZE = 50000
+
+
+def _set_bulk_load_pragmas(cursor):
+    """Tune sqlite for a single large write transaction
+
+    The database is a scratch artifact that can always be rebuilt from
+    the Siegfried CSV, so durability is traded for speed while loading.
+    """
+    cursor.execute("PRAGMA journal_mode=MEMORY;")
+    cursor.execute("PRAGMA synchronous=OFF;")
+    cursor.execute("PRAGMA cache_size=-262144;")  # 256 MB
+    cursor.execute("PRAGMA temp_store=MEMORY;")
+
+
+def _reset_bulk_load_pragmas(cursor):
+    """Restore default durability settings after bulk load"""
+    cursor.execute("PRAGMA journal_mode=DELETE;")
+    cursor.execute("PRAGMA synchronous=FULL;")
+
+
+def _siegfried_column_indexes(header):
+    """Return tuple of header indexes (or None) in SIEGFRIED_COLUMNS order
+
+    The hash column is found under whichever algorithm name Siegfried
+    used. Also returns the name of that algorithm, or None.
+    """
+    positions = dict((name, i) for i, name in enumerate(header))
+    hash_algorithm_used = None
+    for hash_algorithm in HASH_COLUMNS:
+        if hash_algorithm in positions:
+            hash_algorithm_used = hash_algorithm
+            break
+    indexes = []
+    for column in SIEGFRIED_COLUMNS:
+        if column == "hash":
+            indexes.append(positions.get(hash_algorithm_used))
+        else:
+            indexes.append(positions.get(column))
+    return tuple(indexes), hash_algorithm_used
+
+
+def _siegfried_row_tuples(reader, indexes):
+    """Yield rows from a csv reader as tuples in SIEGFRIED_COLUMNS order"""
+    for row in reader:
+        if not row:
+            continue
+        row_length = len(row)
+        yield tuple(
+            row[i] if i is not None and i < row_length else None for i in indexes
+        )
+
+
+# Siegfried results are stored dictionary-encoded: each distinct
+# identification, basis and warning is stored once in a lookup table and
+# siegfried_files refers to it by integer key. The siegfried view joins
+# them back into the flat layout of Siegfried's CSV.
+SIEGFRIED_LOOKUPS = (
+    (
+        "siegfried_identifications",
+        "ident_id",
+        ("namespace", "id", "format", "version", "mime", "class"),
+    ),
+    ("siegfried_bases", "basis_id", ("basis",)),
+    ("siegfried_warnings", "warning_id", ("warning",)),
+)
+
+SIEGFRIED_VIEW_SQL = """CREATE VIEW siegfried AS SELECT
+    f.filename AS filename,
+    f.filesize AS filesize,
+    f.modified AS modified,
+    f.errors AS errors,
+    f.hash AS hash,
+    i.namespace AS namespace,
+    i.id AS id,
+    i.format AS format,
+    i.version AS version,
+    i.mime AS mime,
+    b.basis AS basis,
+    w.warning AS warning,
+    i.class AS class
+FROM siegfried_files AS f
+CROSS JOIN siegfried_identifications AS i ON i.ident_id = f.ident_id
+CROSS JOIN siegfried_bases AS b ON b.basis_id = f.basis_id
+CROSS JOIN siegfried_warnings AS w ON w.warning_id = f.warning_id"""
+
+
+def create_siegfried_table(cursor):
+    """Drop and recreate siegfried tables and the siegfried view
+
+    CROSS JOIN keeps siegfried_files as the outer loop of the view, so
+    unordered queries on the view return files in import order.
+    """
+    cursor.execute("DROP VIEW IF EXISTS siegfried")
+    cursor.execute("DROP TABLE IF EXISTS siegfried")
+    cursor.execute("DROP TABLE IF EXISTS siegfried_files")
+    for table, key, columns in SIEGFRIED_LOOKUPS:
+        cursor.execute("DROP TABLE IF EXISTS {}".format(table))
+        cursor.execute(
+            "CREATE TABLE {} ({} INTEGER PRIMARY KEY, {})".format(
+                table, key, ", ".join("{} text".format(c) for c in columns)
+            )
+        )
+    cursor.execute(
+        "CREATE TABLE siegfried_files (filename text, filesize text, modified text, errors text, hash text, ident_id integer, basis_id integer, warning_id integer)"
+    )
+    cursor.execute(SIEGFRIED_VIEW_SQL)
+
+
+def insert_siegfried_rows(cursor, conn, rows):
+    """Insert iterable of SIEGFRIED_COLUMNS tuples in batches
+
+    Identification, basis and warning values are replaced by keys into
+    the lookup tables, which gain a row the first time a value is seen.
+    Returns number of rows inserted.
+    """
+    lookups = []
+    for table, key, columns in SIEGFRIED_LOOKUPS:
+        cursor.execute("SELECT {}, {} FROM {}".format(key, ", ".join(columns), table))
+        known = dict((tuple(row[1:]), row[0]) for row in cursor.fetchall())
+        sql = "INSERT INTO {} ({}, {}) VALUES ({});".format(
+            table, key, ", ".join(columns), ",".join("?" * (len(columns) + 1))
+        )
+        lookups.append((known, sql))
+    (idents, ident_sql), (bases, basis_sql), (warnings, warning_sql) = lookups
+
+    sql = "INSERT INTO siegfried_files (filename, filesize, modified, errors, hash, ident_id, basis_id, warning_id) VALUES (?,?,?,?,?,?,?,?);"
+    rows = iter(rows)
+    num_rows = 0
+    while True:
+        batch = list(islice(rows, IMPORT_BATCH_SIZE))
+        if not batch:
+            break
+        new_idents = []
+        new_bases = []
+        new_warnings = []
+        encoded = []
+        for row in batch:
+            ident = row[5:10] + row[12:13]
+            ident_id = idents.get(ident)
+            if ident_id is None:
+                ident_id = idents[ident] = len(idents) + 1
+                new_idents.append((ident_id,) + ident)
+            basis = row[10:11]
+            basis_id = bases.get(basis)
+            if basis_id is None:
+                basis_id = bases[basis] = len(bases) + 1
+                new_bases.append((basis_id,) + basis)
+            warning = row[11:12]
+            warning_id = warnings.get(warning)
+            if warning_id is None:
+                warning_id = warnings[warning] = len(warnings) + 1
+                new_warnings.append((warning_id,) + warning)
+            encoded.append(row[:5] + (ident_id, basis_id, warning_id))
+        cursor.executemany(ident_sql, new_idents)
+        cursor.executemany(basis_sql, new_bases)
+        cursor.executemany(warning_sql, new_warnings)
+        cursor.executemany(sql, encoded)
+        num_rows += len(batch)
+    conn.commit()
+    return num_rows
+
+
+SIEGFRIED_INDEXES = (
+    ("siegfried_files_hash", "hash"),
+    ("siegfried_files_ident", "ident_id"),
+    ("siegfried_files_warning", "warning_id"),
+)
+
+# Files with duplicates, in Siegfried CSV column order and grouped by hash.
+# Driven from duplicate_groups so the view's joins are only made for them
+DUPLICATES_SQL = "SELECT siegfried.* FROM duplicate_groups CROSS JOIN siegfried ON siegfried.hash = duplicate_groups.hash ORDER BY duplicate_groups.hash;"
+
+# Number of files per identification, for aggregate reports that group
+# on columns of siegfried_identifications
+IDENTIFICATION_COUNTS_SQL = "(SELECT ident_id, COUNT(*) AS num FROM siegfried_files GROUP BY ident_id) AS counts JOIN siegfried_identifications AS i ON i.ident_id = counts.ident_id"
+
+
+def index_siegfried_table(cursor, conn, use_hash):
+    """Create indexes on loaded siegfried_files table and materialize duplicates
+
+    Indexes are built once after bulk load rather than maintained row by
+    row. If hashes are in use, the duplicate_groups table holds one row
+    per hash shared by more than one non-empty file, for use by both the
+    statistics and the duplicates report.
+    """
+    for index_name, columns in SIEGFRIED_INDEXES:
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS {} ON siegfried_files ({});".format(
+                index_name, columns
+            )
+        )
+    cursor.execute("DROP TABLE IF EXISTS duplicate_groups;")
+    if use_hash:
+        cursor.execute(
+            "CREATE TABLE duplicate_groups AS SELECT hash, COUNT(hash) AS num_files FROM siegfried_files WHERE filesize<>'0' GROUP BY hash HAVING COUNT(hash) > 1 AND COUNT(DISTINCT filename) > 1;"
+        )
+        cursor.execute(
+            "CREATE UNIQUE INDEX duplicate_groups_hash ON duplicate_groups (hash);"
+        )
+    conn.commit()
+
+
+def update_duplicate_index(cursor, conn, dup_index_path, accession):
+    """Find files held in other accessions and add this run to the index
+
+    The duplicate index at dup_index_path is a sqlite db shared between
+    runs, with one row per non-empty file (hash, accession, filename)
+    and an index on hash, so that matching this run's files costs one
+    index lookup per file however large the index grows. Matches are
+    stored in the other_accessions table. Rows previously recorded for
+    this accession are then replaced with the files from this run.
+    """
+    cursor.execute("PRAGMA busy_timeout = 600000;")
+    cursor.execute("ATTACH DATABASE ? AS dup_index;", (dup_index_path,))
+    try:
+        cursor.execute("PRAGMA dup_index.journal_mode=WAL;")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS dup_index.hashes (hash text, accession text, filename text)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS dup_index.hashes_hash ON hashes (hash)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS dup_index.hashes_accession ON hashes (accession)"
+        )
+        conn.commit()
+
+        cursor.execute("DROP TABLE IF EXISTS other_accessions;")
+        cursor.execute(
+            "CREATE TABLE other_accessions AS SELECT f.filename AS filename, f.hash AS hash, hashes.accession AS accession, hashes.filename AS accession_filename FROM siegfried_files AS f JOIN dup_index.hashes AS hashes ON hashes.hash = f.hash WHERE f.filesize<>'0' AND f.hash<>'' AND hashes.accession<>? ORDER BY f.filename, hashes.accession, hashes.filename;",
+            (accession,),
+        )
+
+        cursor.execute("DELETE FROM dup_index.hashes WHERE accession=?;", (accession,))
+        cursor.execute(
+            "INSERT INTO dup_index.hashes (hash, accession, filename) SELECT hash, ?, filename FROM siegfried_files WHERE filesize<>'0' AND hash<>'';",
+            (accession,),
+        )
+        conn.commit()
+    finally:
+        cursor.execute("DETACH DATABASE dup_index;")
+
+
+def _load_siegfried_tuples(cursor, conn, rows):
+    """Recreate siegfried tables and bulk load SIEGFRIED_COLUMNS tuples"""
+    load_started = time.time()
+    create_siegfried_table(cursor)
+    _set_bulk_load_pragmas(cursor)
+    try:
+        num_rows = insert_siegfried_rows(cursor, conn, rows)
+    finally:
+        _reset_bulk_load_pragmas(cursor)
+
+    elapsed = max(time.time() - load_started, 0.001)
+    log_info(
+        "Imported {} Siegfried rows in {:.2f}s ({:.0f} rows/sec).".format(
+            num_rows, elapsed, num_rows / elapsed
+        )
+    )
+
+
+def load_siegfried_csv(cursor, conn, csv_file, use_hash):
+    """Load Siegfried CSV rows from open file object into siegfried table
+
+    Returns use_hash, updated to True if a hash column is found.
+    """
+    reader = csv.reader(csv_file)
+    try:
+        header = next(reader)
+    except StopIteration:
+        header = []
+    indexes, hash_algorithm_used = _siegfried_column_indexes(header)
+    if hash_algorithm_used is not None:
+        use_hash = True
+
+    _load_siegfried_tuples(cursor, conn, _siegfried_row_tuples(reader, indexes))
+    return use_hash
+
+
+SF_FORMATS = ("csv", "json", "yaml")
+
+SF_READ_SIZE = 65536
+
+# Keys of a Siegfried JSON or YAML match in SIEGFRIED_COLUMNS order
+SF_MATCH_KEYS = ("ns", "id", "format", "version", "mime", "basis", "warning", "class")
+
+_SF_JSON_FILES_START = re.compile(r'(?<!\\)"files"\s*:\s*\[')
+
+
+def siegfried_output_format(text):
+    """Return "json", "yaml" or "csv" from the start of Siegfried output"""
+    text = text.lstrip("\ufeff \t\r\n")
+    if text.startswith("{"):
+        return "json"
+    if text.startswith("---"):
+        return "yaml"
+    return "csv"
+
+
+def _iter_siegfried_json_files(chunks):
+    """Yield file records from Siegfried JSON output given as text chunks
+
+    Only the "files" array is decoded, one file object at a time, so
+    memory use is bounded by the largest single file record rather than
+    the size of the whole document. Chunks need not end on line or
+    record boundaries.
+    """
+    chunks = iter(chunks)
+    buf = ""
+    while True:
+        match = _SF_JSON_FILES_START.search(buf)
+        if match:
+            buf = buf[match.end() :]
+            break
+        chunk = next(chunks, "")
+        if not chunk:
+            return
+        buf += chunk
+
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        if pos < len(buf):
+            try:
+                record, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise BrunnhildeError(
+                        "Unable to parse Siegfried JSON output near: {}".format(
+                            buf[pos : pos + 80]
+                        )
+                    )
+            else:
+                yield record
+                continue
+        elif eof:
+            return
+        chunk = next(chunks, "")
+        if chunk:
+            buf = buf[pos:] + chunk
+            pos = 0
+        else:
+            eof = True
+
+
+def _yaml_scalar(value):
+    """Return value of a scalar as written by Siegfried's YAML writer"""
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == "'":
+        return value[1:-1].replace("''", "'")
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value[1:-1]
+    return value
+
+
+def _iter_siegfried_yaml_files(lines):
+    """Yield file records from Siegfried YAML output given as lines
+
+    Siegfried writes one YAML document per file: a flat mapping with a
+    list of match mappings under "matches". Documents are parsed a line
+    at a time, and the header document, which has no filename, is
+    skipped.
+    """
+    record = None
+    match = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped in ("---", "..."):
+            if record and "filename" in record:
+                yield record
+            record = {}
+            match = None
+            continue
+        if record is None or not stripped:
+            continue
+        if stripped.startswith("- "):
+            match = {}
+            record.setdefault("matches", []).append(match)
+            stripped = stripped[2:]
+        key, sep, value = stripped.partition(":")
+        if not sep:
+            continue
+        key = key.strip()
+        if line[:1] in (" ", "\t"):
+            if match is not None:
+                match[key] = _yaml_scalar(value)
+        elif key in ("matches", "identifiers"):
+            record[key] = []
+            match = None
+        else:
+            record[key] = _yaml_scalar(value)
+    if record and "filename" in record:
+        yield record
+
+
+def _siegfried_record_tuples(records, hash_algorithm):
+    """Yield Siegfried JSON or YAML file records as SIEGFRIED_COLUMNS tuples
+
+    Where a file has several matches (one per identifier), the last is
+    kept, as with repeated columns in Siegfried CSV.
+    """
+    for record in records:
+        match = (record.get("matches") or [{}])[-1]
+        filesize = record.get("filesize")
+        yield (
+            record.get("filename"),
+            None if filesize is None else str(filesize),
+            record.get("modified"),
+            record.get("errors"),
+            record.get(hash_algorithm) if hash_algorithm else None,
+        ) + tuple(match.get(key) for key in SF_MATCH_KEYS)
+
+
+def load_siegfried_output(cursor, conn, sf_output, use_hash, sf_format="csv"):
+    """Load Siegfried output of any of SF_FORMATS into siegfried table
+
+    sf_output is an open text file or, for CSV and YAML, any iterable of
+    lines and, for JSON, any iterable of text chunks. All formats feed
+    the same batched insert path. Returns use_hash, updated to True if
+    file hashes are found.
+    """
+    if sf_format == "csv":
+        return load_siegfried_csv(cursor, conn, sf_output, use_hash)
+    if sf_format == "json":
+        if hasattr(sf_output, "read"):
+            sf_output = iter(partial(sf_output.read, SF_READ_SIZE), "")
+        records = _iter_siegfried_json_files(sf_output)
+    else:
+        records = _iter_siegfried_yaml_files(sf_output)
+
+    # Siegfried names the hash key after the algorithm used
+    first = next(records, None)
+    hash_algorithm_used = None
+    if first is not None:
+        records = chain([first], records)
+        for hash_algorithm in HASH_COLUMNS:
+            if hash_algorithm in first:
+                hash_algorithm_used = hash_algorithm
+                use_hash = True
+                break
+    _load_siegfried_tuples(
+        cursor, conn, _siegfried_record_tuples(records, hash_algorithm_used)
+    )
+    return use_hash
+
+
+REPORT_FETCH_SIZE = 10000
+
+
+def _open_csv_report(path):
+    """Open CSV report file for writing
+
+    Specify newline to prevent extra lines in Windows.
+    """
+    return open(path, "w", newline="", encoding="utf8")
+
+
+def _html_cell_text(value):
+    """Return database or CSV value as escaped text for an html table cell"""
+    if value is None:
+        return ""
+    return escape_html(str(value))
+
+
+def _html_cell(value):
+    """Return html for a table cell value, linking PUIDs to PRONOM"""
+    return add_pronom_link_for_puids(_html_cell_text(value))
+
+
+HTML_BUFFER_SIZE = 1024 * 1024
+
+
+def _open_html_report(path):
+    """Open html report or page file for writing
+
+    Sections are written a row or block at a time, so a large buffer
+    turns these into few large writes to disk.
+    """
+    return open(path, "w", encoding="utf8", buffering=HTML_BUFFER_SIZE)
+
+
+def write_report(
+    section_header,
+    sql,
+    path,
+    header,
+    cursor,
+    html,
+    page_size=0,
+    report_dir=None,
+    basename="",
+):
+    """Execute SQL query and write results to CSV and html in one pass
+
+    Rows are fetched in chunks of REPORT_FETCH_SIZE and each chunk is
+    written to both outputs before the next is fetched, so memory use
+    does not grow with the size of the report. No CSV is written if the
+    query returns no results. Pass html=None to write the CSV only.
+    If page_size is set, html rows past the first page_size are written
+    to separate page files in report_dir.
+
+    Returns number of rows written.
+    """
+    cursor.execute(sql)
+    rows = cursor.fetchmany(REPORT_FETCH_SIZE)
+
+    if html is not None:
+        _write_html_section_start(section_header, html)
+    if not rows:
+        if html is not None:
+            html.write(DEFAULT_SECTION_TEXT)
+            html.write("\n</div>")
+        return 0
+
+    report = _open_csv_report(path)
+    w = csv.writer(report)
+    w.writerow(header)
+    if html is not None:
+        pager = HtmlPager(
+            section_header,
+            html,
+            page_size,
+            open_text=_html_table_open_text(header),
+            close_text=HTML_TABLE_CLOSE_TEXT,
+            report_dir=report_dir,
+            basename=basename,
+        )
+    num_rows = 0
+    while rows:
+        w.writerows(rows)
+        num_rows += len(rows)
+        if html is not None:
+            pager.write_rows(rows)
+        rows = cursor.fetchmany(REPORT_FETCH_SIZE)
+    report.close()
+    if html is not None:
+        pager.close()
+        html.write("\n</div>")
+    return num_rows
+
+
+PAGES_DIR_NAME = "report_pages"
+
+
+def _write_html_head(title, html):
+    """Write doctype, head, and opening body tag for html document"""
+    html.write("<!DOCTYPE html>")
+    html.write('\n<html lang="en">')
+    html.write("\n<head>")
+    html.write("\n<title>{}</title>".format(escape_html(title)))
+    html.write('\n<meta charset="utf-8">')
+    html.write('\n<style type="text/css">{}</style>'.format(CSS))
+    html.write("\n</head>")
+    html.write("\n<body>")
+
+
+class HtmlPager(object):
+    """Split the rows of an html report section across page files
+
+    The first page_size rows are written to the main report. Further
+    rows go to numbered page files in the report_pages directory of
+    report_dir, each wrapped in open_text and close_text (e.g. table
+    tags) and linked to its neighbours. basename is used in page
+    titles. Blocks are never split across pages, so a group of
+    duplicates always appears on one page. A page_size of 0 disables
+    paging and writes every row to the main report.
+    """
+
+    def __init__(
+        self,
+        header,
+        html,
+        page_size=0,
+        open_text="",
+        close_text="",
+        report_dir=None,
+        basename="",
+    ):
+        self.header = header
+        self.html = html
+        self.out = html
+        self.page_size = page_size
+        self.open_text = open_text
+        self.close_text = close_text
+        self.report_dir = report_dir
+        self.basename = basename
+        self.page = 1
+        self.rows_on_page = 0
+        self.total_rows = 0
+        self.first_page_rows = 0
+        self.html.write(open_text)
+
+    def _page_filename(self, page):
+        return "{}_{}.html".format(self.header.lower().replace(" ", "_"), page)
+
+    def _write_page_nav(self, page, last_page):
+        links = ['<a href="../report.html#{}">Back to report</a>'.format(self.header)]
+        if page > 2:
+            links.append(
+                '<a href="{}">Previous</a>'.format(self._page_filename(page - 1))
+            )
+        else:
+            links.append('<a href="../report.html#{}">Previous</a>'.format(self.header))
+        if page < last_page:
+            links.append('<a href="{}">Next</a>'.format(self._page_filename(page + 1)))
+        self.out.write("\n<nav>\n{}\n</nav>".format("\n".join(links)))
+
+    def _close_page(self, last_page):
+        self.out.write(self.close_text)
+        if self.out is not self.html:
+            self._write_page_nav(self.page, last_page)
+            self.out.write("\n</div>")
+            self.out.write("\n</body>")
+            self.out.write("\n</html>")
+            self.out.close()
+        else:
+            self.first_page_rows = self.rows_on_page
+
+    def _next_page(self):
+        self._close_page(last_page=self.page + 1)
+        self.page += 1
+        self.rows_on_page = 0
+        pages_dir = os.path.join(self.report_dir, PAGES_DIR_NAME)
+        if not os.path.isdir(pages_dir):
+            os.makedirs(pages_dir)
+        page_path = os.path.join(pages_dir, self._page_filename(self.page))
+        self.out = _open_html_report(page_path)
+        _write_html_head(
+            "Brunnhilde report: {} - {} (page {})".format(
+                self.basename, self.header, self.page
+            ),
+            self.out,
+        )
+        self.out.write("\n<header>")
+        self.out.write("\n<h1>Brunnhilde HTML report</h1>")
+        self._write_page_nav(self.page, last_page=self.page)
+        self.out.write("\n</header>")
+        self.out.write("\n<div>")
+        self.out.write("\n<h2>{} (page {})</h2>".format(self.header, self.page))
+        self.out.write(self.open_text)
+
+    def write(self, text, num_rows=1, same_block=False):
+        """Write html for a block of num_rows rows to the current page
+
+        Pass same_block=True to add text to the previous block, so that
+        a block written in parts is never split across pages.
+        """
+        if self.page_size and self.rows_on_page >= self.page_size and not same_block:
+            self._next_page()
+        self.out.write(text)
+        self.rows_on_page += num_rows
+        self.total_rows += num_rows
+
+    def write_rows(self, rows):
+        """Render list of table rows of values and write them, one write per page"""
+        start = 0
+        while start < len(rows):
+            end = len(rows)
+            if self.page_size:
+                if self.rows_on_page >= self.page_size:
+                    self._next_page()
+                end = min(end, start + self.page_size - self.rows_on_page)
+            self.out.write(_html_table_rows(rows[start:end]))
+            self.rows_on_page += end - start
+            self.total_rows += end - start
+            start = end
+
+    def close(self):
+        """Close last page and write links to page files in main report"""
+        self._close_page(last_page=self.page)
+        if self.page == 1:
+            return
+        links = []
+        for page in range(2, self.page + 1):
+            links.append(
+                '<a href="{}/{}">{}</a>'.format(
+                    PAGES_DIR_NAME, self._page_filename(page), page
+                )
+            )
+        self.html.write(
+            "\n<p><em>Showing first {shown} of {total} rows.</em> More pages: {links}</p>".format(
+                shown=self.first_page_rows, total=self.total_rows, links=" ".join(links)
+            )
+        )
+
+
+DEFAULT_SECTION_TEXT = "\nNone found.\n<br><br>"
+
+
+def _write_html_section_start(header, html):
+    """Write opening div, anchor, and heading for html report section"""
+    html.write("\n<div>")
+    html.write('\n<a class="anchor" name="{}"></a>'.format(header))
+    html.write("\n<h2>{}</h2>".format(header))
+    if header == "Duplicates":
+        html.write("\n<p><em>Duplicates are grouped by hash value.</em></p>")
+    elif header == "Other accessions":
+        html.write(
+            "\n<p><em>Files matching the hash of a file recorded for another accession in the duplicate index.</em></p>"
+        )
+    elif header == "SSNs":
+        html.write(
+            "\n<p><em>Potential Social Security Numbers identified by bulk_extractor.</em></p>"
+        )
+    elif header == "PII by file":
+        html.write(
+            "\n<p><em>Number of SSNs, email addresses and credit card numbers identified by bulk_extractor in each file.</em></p>"
+        )
+    elif header == "Virus findings":
+        html.write(
+            "\n<p><em>Files ClamAV reported as infected (FOUND) or could not scan (ERROR).</em></p>"
+        )
+
+
+HTML_TABLE_CLOSE_TEXT = "\n</tbody>\n</table>"
+
+
+def _html_table_open_text(columns):
+    """Return opening table tags and thead for html table"""
+    header_cells = "".join(
+        "\n<th>" + escape_html(column) + "</th>" for column in columns
+    )
+    return "\n<table>\n<thead>\n<tr>{}\n</tr>\n</thead>\n<tbody>".format(header_cells)
+
+
+def _html_table_row(columns):
+    """Return html table row for iterable of (already escaped) cell html"""
+    return "\n<tr>\n<td>" + "</td>\n<td>".join(columns) + "</td>\n</tr>"
+
+
+def _html_column_cells(column):
+    """Return list of cell html for one column of a chunk of rows
+
+    The column is escaped as a single string and split back into cells.
+    PUIDs are looked up once per distinct value, and only in columns
+    where one may occur.
+    """
+    try:
+        text = "\x00".join(column)
+    except TypeError:
+        text = "\x00".join(["" if value is None else str(value) for value in column])
+    cells = escape_html(text).split("\x00")
+    if len(cells) != len(column):
+        # Values themselves contain NUL, which is not valid in html
+        cells = [_html_cell_text(value).replace("\x00", "\ufffd") for value in column]
+    if "fmt/" in text:
+        links = dict((cell, add_pronom_link_for_puids(cell)) for cell in set(cells))
+        cells = list(map(links.__getitem__, cells))
+    return cells
+
+
+def _html_table_rows(rows):
+    """Return html table rows for list of rows of database or CSV values
+
+    Values are escaped and PUIDs linked as for _html_cell, but a column
+    at a time, so that a chunk of rows is rendered with a few string
+    operations per column rather than several function calls per cell.
+    """
+    if not rows:
+        return ""
+    if len(set(map(len, rows))) != 1:
+        # Ragged CSV rows
+        return "".join(_html_table_row(map(_html_cell, row)) for row in rows)
+    columns = [_html_column_cells(column) for column in zip(*rows)]
+    return (
+        "\n<tr>\n<td>"
+        + "</td>\n</tr>\n<tr>\n<td>".join(map("</td>\n<td>".join, zip(*columns)))
+        + "</td>\n</tr>"
+    )
+
+
+# Column positions in Siegfried CSV order, as in duplicates.csv
+DUPLICATE_COLUMNS = dict(
+    filename=0,
+    size=1,
+    modified=2,
+    errors=3,
+    hash=4,
+    id=6,
+    format=7,
+    version=8,
+    mime=9,
+    basis=10,
+    warning=11,
+)
+
+DUPLICATE_GROUP_CLOSE_TEXT = "\n</tbody>\n</table><br>"
+
+
+def _duplicate_group_html(hash_value, row):
+    """Return opening html for group of duplicate files sharing hash_value
+
+    The size, identification, errors and warnings shown for the group
+    are taken from row, its first file. The html ends with an open
+    table body, to which each file's _duplicate_file_html is added,
+    followed by DUPLICATE_GROUP_CLOSE_TEXT.
+    """
+    c = DUPLICATE_COLUMNS
+    parts = ["\n<p>Files matching hash <strong>{}</strong>:</p>".format(hash_value)]
+    # Print info for the group
+    row_size_readable = convert_size(int(row[c["size"]]))
+    parts.append("\n<ul>")
+    if " bytes" in row_size_readable:
+        parts.append(
+            "\n<li><strong>Size:</strong> {} bytes</li>".format(row[c["size"]])
+        )
+    else:
+        parts.append(
+            "\n<li><strong>Size:</strong> {bytes} bytes ({readable})</li>".format(
+                bytes=row[c["size"]], readable=row_size_readable
+            )
+        )
+    parts.append(
+        "\n<li><strong>ID:</strong> {}</li>".format(
+            add_pronom_link_for_puids(row[c["id"]])
+        )
+    )
+    parts.append("\n<li><strong>Format:</strong> {}</li>".format(row[c["format"]]))
+    if row[c["version"]]:
+        parts.append(
+            "\n<li><strong>Format version:</strong> {}</li>".format(row[c["version"]])
+        )
+    if row[c["mime"]]:
+        parts.append("\n<li><strong>MIME type:</strong> {}</li>".format(row[c["mime"]]))
+    if row[c["basis"]]:
+        parts.append(
+            "\n<li><strong>Basis for ID:</strong> {}</li>".format(row[c["basis"]])
+        )
+    if row[c["warning"]]:
+        parts.append(
+            "\n<li><strong>Warning:</strong> {}</li>".format(row[c["warning"]])
+        )
+    if row[c["errors"]]:
+        parts.append("\n<li><strong>Errors:</strong> {}</li>".format(row[c["errors"]]))
+    parts.append("\n</ul>")
+
+    # Open table of matching files (columns: filename, modified date)
+    parts.append("\n<table>")
+    parts.append("\n<thead>")
+    parts.append("\n<tr>")
+    parts.append("\n<th>Filename</th><th>Date modified</th>")
+    parts.append("\n</tr>")
+    parts.append("\n</thead>")
+    parts.append("\n<tbody>")
+    return "".join(parts)
+
+
+def _duplicate_file_html(row):
+    """Return html table row for one file in a group of duplicates"""
+    c = DUPLICATE_COLUMNS
+    return "\n<tr>\n<td>{}</td>\n<td>{}</td>\n</tr>".format(
+        row[c["filename"]], row[c["modified"]]
+    )
+
+
+class DuplicateGroupWriter(object):
+    """Write html for duplicate file rows ordered by hash to an HtmlPager
+
+    Rows are in Siegfried CSV column order. Each group is opened when its
+    first row is written and closed when the hash changes. Its files are
+    written one at a time as part of the group's block, so memory use
+    does not depend on the number or size of groups and no group is
+    split across pages.
+    """
+
+    def __init__(self, pager):
+        self.pager = pager
+        self.current_hash = None
+
+    def write(self, row):
+        """Write html for one file row, escaping its values"""
+        if not row or not row[DUPLICATE_COLUMNS["hash"]]:
+            return
+        row = [_html_cell_text(column) for column in row]
+        hash_value = row[DUPLICATE_COLUMNS["hash"]]
+        if hash_value != self.current_hash:
+            self._close_group()
+            self.pager.write(_duplicate_group_html(hash_value, row), num_rows=0)
+            self.current_hash = hash_value
+        self.pager.write(_duplicate_file_html(row), same_block=True)
+
+    def _close_group(self):
+        if self.current_hash is not None:
+            self.pager.write(DUPLICATE_GROUP_CLOSE_TEXT, num_rows=0, same_block=True)
+        self.current_hash = None
+
+    def close(self):
+        """Close the last group and the pager"""
+        self._close_group()
+        self.pager.close()
+
+
+def write_duplicates_report(
+    sql, path, header, cursor, html, page_size=0, report_dir=None, basename=""
+):
+    """Execute duplicates SQL query and write CSV and html section in one pass
+
+    The query must return rows in Siegfried CSV column order, ordered by
+    hash. Rows are fetched in chunks of REPORT_FETCH_SIZE and each chunk
+    is written to the CSV and, a group at a time, to the Duplicates
+    section before the next is fetched, so memory use is the same
+    however many duplicates there are. No CSV is written if the query
+    returns no results.
+
+    Returns number of rows written.
+    """
+    cursor.execute(sql)
+    rows = cursor.fetchmany(REPORT_FETCH_SIZE)
+
+    _write_html_section_start("Duplicates", html)
+    if not rows:
+        html.write(DEFAULT_SECTION_TEXT)
+        html.write("\n</div>")
+        return 0
+
+    report = _open_csv_report(path)
+    w = csv.writer(report)
+    w.writerow(header)
+    groups = DuplicateGroupWriter(
+        HtmlPager(
+            "Duplicates",
+            html,
+            page_size,
+            report_dir=report_dir,
+            basename=basename,
+        )
+    )
+    num_rows = 0
+    while rows:
+        w.writerows(rows)
+        num_rows += len(rows)
+        for row in rows:
+            groups.write(row)
+        rows = cursor.fetchmany(REPORT_FETCH_SIZE)
+    report.close()
+    groups.close()
+    html.write("\n</div>")
+    return num_rows
+
+
+def _return_csv_reader_to_start_of_file(csv_reader_instance):
+    csv_reader_instance.seek(0)
+
+
+PUID_REGEX = re.compile(r"fmt\/[0-9]+|x\-fmt\/[0-9]+")  # matches fmt/# or x-fmt/#
+
+PRONOM_LINK_TEXT = (
+    '<a href="https://nationalarchives.gov.uk/PRONOM/{0}" target="_blank">{0}</a>'
+)
+
+
+def add_pronom_link_for_puids(text):
+    """If text is a PUID, add a link to the PRONOM website
+
+    text must already be html-escaped.
+    """
+    if PUID_REGEX.match(text) is not None:
+        return PRONOM_LINK_TEXT.format(text)
+    return text
+
+
+def close_html_report(html):
+    """Add JavaScript and write html closing tags"""
+    html.write("\n</body>")
+    html.write("\n</html>")
+
+
+class StageRunner(object):
+    """Run independent processing stages, optionally in background threads
+
+    Stages started with start() run immediately in the calling thread
+    unless parallel is True, in which case each runs in its own thread
+    and callers use wait() to block only on the stages they depend on.
+    Exceptions raised by a stage are re-raised from wait(), or logged
+    instead when raise_errors is False. If metrics is given, each stage
+    is recorded in it under its name.
+    """
+
+    def __init__(self, parallel=False, metrics=None):
+        self.parallel = parallel
+        self.metrics = metrics
+        self.threads = {}
+        self.errors = {}
+
+    def _call(self, name, func, args):
+        if self.metrics is None:
+            func(*args)
+            return
+        with self.metrics.stage(name):
+            func(*args)
+
+    def _run(self, name, func, args):
+        try:
+            self._call(name, func, args)
+        except BaseException:
+            self.errors[name] = sys.exc_info()
+
+    def start(self, name, func, *args):
+        if not self.parallel:
+            self._call(name, func, args)
+            return
+        log_info("Starting {} in parallel.".format(name))
+        thread = threading.Thread(target=self._run, args=(name, func, args), name=name)
+        thread.daemon = True
+        thread.start()
+        self.threads[name] = thread
+
+    def wait(self, name, raise_errors=True):
+        thread = self.threads.pop(name, None)
+        if thread is None:
+            return
+        thread.join()
+        if name in self.errors:
+            exc_type, exc_value, exc_traceback = self.errors.pop(name)
+            if raise_errors:
+                raise exc_value
+            logger.error("{} failed: {!r}".format(name, exc_value))
+
+    def wait_all(self, raise_errors=True):
+        for name in list(self.threads):
+            self.wait(name, raise_errors)
+
+
+class JobBudget(object):
+    """Divide a budget of CPU jobs among the external tools of a run
+
+    Tools expected to run at the same time are given their shares up
+    front, so the split does not depend on the order in which they
+    start. Tools with a fixed limit get that many jobs and the others
+    divide the rest equally, with any remainder going to those expected
+    first, and each gets at least one job. A tool that was not expected
+    gets the jobs not reserved by running tools. With no budget,
+    reserve() gives None and tools use their own defaults.
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = jobs
+        self.reserved = {}
+        self.expected = []
+        self.shares = {}
+        self._lock = threading.Lock()
+
+    def expect(self, name, max_jobs=None):
+        """Declare tool that will run at the same time as the others expected"""
+        with self._lock:
+            self.expected.append((name, max_jobs))
+            if self.jobs is not None:
+                self.shares = self._divide()
+
+    def _divide(self):
+        free = self.jobs
+        shares = {}
+        uncapped = []
+        for name, max_jobs in self.expected:
+            if max_jobs is None:
+                uncapped.append(name)
+            else:
+                shares[name] = min(max_jobs, self.jobs)
+                free -= shares[name]
+        for i, name in enumerate(uncapped):
+            share = free // len(uncapped)
+            if i < free % len(uncapped):
+                share += 1
+            shares[name] = max(1, share)
+        return shares
+
+    @contextlib.contextmanager
+    def reserve(self, name, max_jobs=None):
+        if self.jobs is None:
+            yield None
+            return
+        with self._lock:
+            if name in self.shares:
+                jobs = self.shares.pop(name)
+            else:
+                jobs = max(1, self.jobs - sum(self.reserved.values()))
+            if max_jobs is not None:
+                jobs = min(jobs, max_jobs)
+            self.reserved[name] = jobs
+        try:
+            yield jobs
+        finally:
+            with self._lock:
+                del self.reserved[name]
+
+
+METRICS_FILE_NAME = "metrics.json"
+
+
+def _resource_usage():
+    """Return CPU seconds and peak RSS bytes of process and finished children
+
+    Peak RSS values are None where the resource module is unavailable.
+    """
+    if resource is None:
+        return dict(
+            cpu_seconds=time.process_time(),
+            child_cpu_seconds=0.0,
+            peak_rss_bytes=None,
+            child_peak_rss_bytes=None,
+        )
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    rss_scale = 1 if sys.platform.startswith("darwin") else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return dict(
+        cpu_seconds=own.ru_utime + own.ru_stime,
+        child_cpu_seconds=children.ru_utime + children.ru_stime,
+        peak_rss_bytes=own.ru_maxrss * rss_scale,
+        child_peak_rss_bytes=children.ru_maxrss * rss_scale,
+    )
+
+
+def _io_counters():
+    """Return (bytes read, bytes written) from /proc/self/io, or None
+
+    The counters include child processes once they have been waited for,
+    so they cover the tools Brunnhilde runs as well as its own I/O.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except (IOError, OSError, ValueError):
+        return None
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+class RunMetrics(object):
+    """Record wall time, CPU time, memory, I/O and row counts per stage
+
+    Each stage() block adds a record with its wall and CPU seconds, the
+    CPU seconds of child processes that finished during it, peak RSS of
+    Brunnhilde and of its largest child so far, bytes read and written,
+    and any row count set on the record by the caller. CPU and I/O are
+    process-wide counters, so stages run at the same time with
+    --parallel share them.
+    """
+
+    def __init__(self):
+        self.started = str(datetime.datetime.now())
+        self.start_time = time.time()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = dict(name=name, rows=None)
+        usage_before = _resource_usage()
+        io_before = _io_counters()
+        started = time.time()
+        try:
+            yield record
+        finally:
+            usage_after = _resource_usage()
+            io_after = _io_counters()
+            record["wall_seconds"] = round(time.time() - started, 3)
+            for key in ("cpu_seconds", "child_cpu_seconds"):
+                record[key] = round(usage_after[key] - usage_before[key], 3)
+            for key in ("peak_rss_bytes", "child_peak_rss_bytes"):
+                record[key] = usage_after[key]
+            if io_before is None or io_after is None:
+                record["read_bytes"] = record["write_bytes"] = None
+            else:
+                record["read_bytes"] = io_after[0] - io_before[0]
+                record["write_bytes"] = io_after[1] - io_before[1]
+            with self._lock:
+                self.stages.append(record)
+
+    def as_dict(self):
+        usage = _resource_usage()
+        with self._lock:
+            stages = list(self.stages)
+        return dict(
+            brunnhilde_version=BRUNNHILDE_VERSION,
+            started=self.started,
+            wall_seconds=round(time.time() - self.start_time, 3),
+            peak_rss_bytes=usage["peak_rss_bytes"],
+            child_peak_rss_bytes=usage["child_peak_rss_bytes"],
+            stages=stages,
+        )
+
+    def write(self, path):
+        """Write metrics to JSON file at path"""
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+def _metrics_size_text(size):
+    if size is None:
+        return "N/A"
+    return convert_size(size)
+
+
+def write_metrics_section(metrics, html):
+    """Write table of stage metrics recorded so far to html report"""
+    _write_html_section_start("Run metrics", html)
+    html.write(
+        _html_table_open_text(
+            [
+                "Stage",
+                "Wall time (s)",
+                "CPU time (s)",
+                "Child CPU time (s)",
+                "Peak memory",
+                "Peak child memory",
+                "Read",
+                "Written",
+                "Rows",
+            ]
+        )
+    )
+    for record in metrics.as_dict()["stages"]:
+        html.write(
+            _html_table_row(
+                [
+                    record["name"],
+                    "{:.2f}".format(record["wall_seconds"]),
+                    "{:.2f}".format(record["cpu_seconds"]),
+                    "{:.2f}".format(record["child_cpu_seconds"]),
+                    _metrics_size_text(record["peak_rss_bytes"]),
+                    _metrics_size_text(record["child_peak_rss_bytes"]),
+                    _metrics_size_text(record["read_bytes"]),
+                    _metrics_size_text(record["write_bytes"]),
+                    "" if record["rows"] is None else str(record["rows"]),
+                ]
+            )
+        )
+    html.write(HTML_TABLE_CLOSE_TEXT)
+    html.write(
+        "\n<p>Full metrics for every stage are written to {}.</p>".format(
+            METRICS_FILE_NAME
+        )
+    )
+    html.write("\n</div>")
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-a",
+        "--allocated",
+        help="Instruct tsk_recover to export only allocated files (recovers all files by default)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-b",
+        "--bulkextractor",
+        help="Run Bulk Extractor on source",
+        action="store_true",
     )
     parser.add_argument(
         "--ssn_mode",
@@ -1109,28 +2307,121 @@ def _make_parser():
         action="store",
     )
     parser.add_argument(
-        "--hash", help="Specify hash algorithm", dest="hash", action="store", type=str
+        "--hash", help="Specify hash algorithm", dest="hash", action="store", type=str
+    )
+    parser.add_argument(
+        "-k",
+        "--keepsqlite",
+        help="Retain Brunnhilde-generated sqlite db after processing",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-l",
+        "--largefiles",
+        help="Enable virus scanning of large files",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-n", "--noclam", help="Skip ClamAV virus scan", action="store_true"
+    )
+    parser.add_argument(
+        "--clamd",
+        help=(
+            "Scan with a running clamd (clamdscan --multiscan), falling back "
+            "to clamscan if clamd is unavailable"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "-r",
+        "--removefiles",
+        help="Delete 'carved_files' directory when done (disk image input only)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--page-size",
+        help=(
+            "Show at most PAGE_SIZE rows of the Unidentified, Warnings, Errors, "
+            "Duplicates, SSNs and PII by file sections in report.html, writing "
+            "the remaining rows to numbered page files in report_pages "
+            "(default: no paging)"
+        ),
+        action="store",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--tree-json",
+        help="Also write directory tree to tree.json",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--parallel",
+        help="Run ClamAV and bulk_extractor alongside Siegfried",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache",
+        help=(
+            "Path to persistent identification cache db. Only files that are "
+            "new or changed since the cached scan are passed to Siegfried"
+        ),
+        action="store",
+        type=str,
+    )
+    parser.add_argument(
+        "--jobs",
+        help=(
+            "Number of CPU jobs to divide among Siegfried (-multi), "
+            "bulk_extractor (-j), ClamAV and Siegfried shards "
+            "(default: each tool's own default)"
+        ),
+        action="store",
+        type=int,
+    )
+    parser.add_argument(
+        "--shards",
+        help=(
+            "Split source into SHARDS size-balanced sets of files and scan "
+            "them with parallel Siegfried processes"
+        ),
+        action="store",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--sf-server",
+        help=(
+            "URL of a running Siegfried server (sf -serve) to use for "
+            "identification instead of starting sf, e.g. http://localhost:5138"
+        ),
+        action="store",
+        type=str,
+    )
+    parser.add_argument(
+        "--dup-index",
+        help=(
+            "Path to duplicate index db shared between runs. Files already "
+            "recorded there for other accessions are listed in the report"
+        ),
+        action="store",
+        type=str,
     )
     parser.add_argument(
-        "-k",
-        "--keepsqlite",
-        help="Retain Brunnhilde-generated sqlite db after processing",
+        "--stream",
+        help="Import Siegfried output into the sqlite db while the scan is running",
         action="store_true",
     )
     parser.add_argument(
-        "-l",
-        "--largefiles",
-        help="Enable virus scanning of large files",
+        "--no-sf-csv",
+        help="With --stream, do not also write Siegfried output to siegfried.csv",
         action="store_true",
     )
     parser.add_argument(
-        "-n", "--noclam", help="Skip ClamAV virus scan", action="store_true"
-    )
-    parser.add_argument(
-        "-r",
-        "--removefiles",
-        help="Delete 'carved_files' directory when done (disk image input only)",
-        action="store_true",
+        "--sf-format",
+        help="Output format to request from Siegfried (default: csv). Ignored with --cache, --shards and --sf-server, which use CSV",
+        choices=SF_FORMATS,
+        default="csv",
     )
     parser.add_argument(
         "-t",
@@ -1176,13 +2467,13 @@ def _make_parser():
     )
     parser.add_argument(
         "--csv",
-        help="Path to Siegfried CSV file to read as input (directories only)",
+        help="Path to Siegfried CSV, JSON or YAML file to read as input (directories only)",
         action="store",
         type=str,
     )
     parser.add_argument(
         "--stdin",
-        help="Read Siegfried CSV from piped stdin (directories only)",
+        help="Read Siegfried CSV, JSON or YAML from piped stdin (directories only)",
         action="store_true",
     )
     parser.add_argument(
@@ -1212,181 +2503,1410 @@ def _make_parser():
     return parser
 
 
-def main():
-    parser = _make_parser()
-    args = parser.parse_args()
+def get_siegfried_version():
+    """Return output of sf -version, running sf only once per process"""
+    global _siegfried_version
+    with _siegfried_version_lock:
+        if _siegfried_version is None:
+            _siegfried_version = subprocess.check_output(["sf", "-version"]).decode()
+    return _siegfried_version
 
-    _configure_logging()
 
-    global source, destination, basename, report_dir, csv_dir, log_dir, bulkext_dir, sf_file, ssn_mode
-    source = os.path.abspath(args.source)
-    destination = os.path.abspath(args.destination)
-    # Brunnhilde API backward compatibility: Use basename positional
-    # arg if provided. Otherwise use destination as report directory.
-    if args.basename:
-        basename = str(args.basename)
-        report_dir = os.path.join(destination, basename)
-    else:
-        basename = os.path.basename(destination)
-        report_dir = destination
-    csv_dir = os.path.join(report_dir, "csv_reports")
-    log_dir = os.path.join(report_dir, "logs")
-    bulkext_dir = os.path.join(report_dir, "bulk_extractor")
-    sf_file = os.path.join(report_dir, "siegfried.csv")
-
-    # Create report directory
-    if os.path.exists(report_dir):
-        if not args.overwrite:
-            log_error_and_exit_message(
-                "Output directory already exists. To overwrite, use the -o/--overwrite option."
-            )
-            sys.exit(1)
+_siegfried_version = None
+_siegfried_version_lock = threading.Lock()
 
-        try:
-            shutil.rmtree(report_dir)
-        except OSError as e:
-            log_error_and_exit_message(
-                "Unable to delete existing output directory: {}".format(e)
-            )
-            sys.exit(1)
 
-    try:
-        os.makedirs(report_dir)
-    except OSError as exception:
-        if exception.errno != errno.EEXIST:
-            raise
+class Brunnhilde(object):
+    """Characterization run for one source, carrying all of its state
 
-    # Check that Siegfried is installed and save version.
-    try:
-        siegfried_version = subprocess.check_output(["sf", "-version"]).decode()
-    except subprocess.CalledProcessError:
-        log_error_and_exit_message(
-            "Siegfried is not installed or available on PATH. "
-            "Please ensure that all dependencies are properly installed."
+    args is an argparse.Namespace as returned by the command line
+    parser (see from_options to build one from keyword arguments).
+    Report paths, the Siegfried command, and the database connection
+    belong to the instance, so separate runs can be made in one process
+    or in threads without interfering with each other.
+    """
+
+    def __init__(self, args):
+        self.args = argparse.Namespace(**vars(args))
+        self.source = os.path.abspath(args.source)
+        self.destination = os.path.abspath(args.destination)
+        # Brunnhilde API backward compatibility: Use basename positional
+        # arg if provided. Otherwise use destination as report directory.
+        if args.basename:
+            self.basename = str(args.basename)
+            self.report_dir = os.path.join(self.destination, self.basename)
+        else:
+            self.basename = os.path.basename(self.destination)
+            self.report_dir = self.destination
+        self.csv_dir = os.path.join(self.report_dir, "csv_reports")
+        self.log_dir = os.path.join(self.report_dir, "logs")
+        self.bulkext_dir = os.path.join(self.report_dir, "bulk_extractor")
+        # Cached, sharded and server scans are always collected as CSV
+        if args.cache or args.shards > 1 or args.sf_server:
+            self._set_sf_format("csv")
+        else:
+            self._set_sf_format(args.sf_format)
+
+        self.use_hash = args.hash != "none"
+        self.ssn_mode = 1
+        if args.ssn_mode in (0, 2):
+            self.ssn_mode = args.ssn_mode
+        self.sf_command = ""
+        self.sf_jobs = None
+        self.jobs = JobBudget(args.jobs)
+        self.siegfried_version = None
+        self.html = None
+        self.conn = None
+        self.cursor = None
+        self.metrics = RunMetrics()
+
+    @classmethod
+    def from_options(cls, source, destination, basename=None, **options):
+        """Return run for source with options named as in the parser
+
+        Options not given take their command line defaults, e.g.
+        Brunnhilde.from_options(src, dest, noclam=True, hash="sha256").
+        """
+        args = _make_parser().parse_args([source, destination])
+        args.basename = basename
+        for name, value in options.items():
+            if not hasattr(args, name):
+                raise TypeError("Unknown Brunnhilde option: {}".format(name))
+            setattr(args, name, value)
+        return cls(args)
+
+    def run_siegfried(self, source_dir):
+        """Run siegfried on directory"""
+        log_info("Running Siegfried.", time_warning=True)
+        self.sf_command = '%s > "%s"' % (
+            _build_sf_command(
+                self.args, source_dir, self.use_hash, self.sf_format, self.sf_jobs
+            ),
+            self.sf_file,
         )
-        sys.exit(1)
+        subprocess.call(self.sf_command, shell=True)
+        log_info("Siegfried scan complete. Processing results.")
+
+    def run_siegfried_streaming(self, source_dir):
+        """Run siegfried on directory, importing rows into sqlite as produced
+
+        Siegfried's output is read from a pipe and fed straight to the
+        batched insert path, so import overlaps scanning. Unless disabled
+        with --no-sf-csv, the output is also copied to sf_file.
+        """
+        log_info("Running Siegfried in streaming mode.", time_warning=True)
+        self.sf_command = _build_sf_command(
+            self.args, source_dir, self.use_hash, self.sf_format, self.sf_jobs
+        )
+        process = subprocess.Popen(self.sf_command, shell=True, stdout=subprocess.PIPE)
+        sf_output = io.TextIOWrapper(
+            process.stdout, encoding="utf8", errors="ignore", newline=""
+        )
+        if self.sf_format == "json":
+            # JSON from Siegfried may have no line breaks to split on
+            sf_output = iter(partial(sf_output.read, SF_READ_SIZE), "")
 
-    # Check that source type is correct.
-    if args.diskimage and not os.path.isfile(source):
-        log_error_and_exit_message(
-            "Source is not a file. Do not use the -d/--diskimage argument unless source is a disk image."
+        tee_file = None
+        try:
+            if not self.args.no_sf_csv:
+                tee_file = open(self.sf_file, "w", newline="", encoding="utf8")
+                sf_output = _tee_lines(sf_output, tee_file)
+            self.use_hash = load_siegfried_output(
+                self.cursor, self.conn, sf_output, self.use_hash, self.sf_format
+            )
+        finally:
+            if tee_file is not None:
+                tee_file.close()
+            process.stdout.close()
+            process.wait()
+        log_info("Siegfried scan and import complete. Processing results.")
+
+    def run_siegfried_with_cache(self, source_dir):
+        """Run siegfried only on files not already identified in the cache
+
+        Files are matched to the cache at args.cache by path, size,
+        modification time, and inode. New and changed files are passed to
+        Siegfried, and their results replace any cached rows. Results for
+        every file in source_dir are then written from the cache to sf_file
+        in path order. Cache entries for files that no longer exist under
+        source_dir are removed.
+        """
+        log_info("Running Siegfried with identification cache.", time_warning=True)
+        args = self.args
+        use_hash = self.use_hash
+        sf_options = _sf_options(args, use_hash)
+        settings = "{} | {}".format(
+            self.siegfried_version.strip(), " ".join(sf_options)
         )
-        sys.exit(1)
-    elif not args.diskimage and os.path.isfile(source):
-        log_error_and_exit_message(
-            "Source is not a directory. Use the -d/--diskimage argument if source is a disk image."
+        cache_conn, cache_cursor = open_sf_cache(args.cache, settings)
+
+        # Load cached file identities for this source
+        prefix = os.path.join(source_dir, "")
+        cached = {}
+        cache_cursor.execute(
+            "SELECT source_path, size, mtime_ns, inode FROM cache_files WHERE substr(source_path, 1, ?) = ?",
+            (len(prefix), prefix),
         )
-        sys.exit(1)
+        for source_path, size, mtime_ns, inode in cache_cursor:
+            cached[source_path] = (size, mtime_ns, inode)
 
-    # Check that Siegfried CSV options were not used with disk image source.
-    if args.diskimage and (args.csv or args.stdin):
-        log_error_and_exit_message(
-            "Use of the --stdin and --csv options is not supported for disk images."
+        identities = {}
+        changed = []
+        self.cursor.execute(
+            "SELECT path, size, mtime_ns, inode FROM source_listing WHERE is_file=1;"
         )
-        sys.exit(1)
+        for row in self.cursor:
+            path, identity = row[0], tuple(row[1:])
+            identities[path] = identity
+            if cached.get(path) != identity:
+                changed.append(path)
+        changed.sort()
+
+        log_info(
+            "{} of {} files are new or changed since last cached scan.".format(
+                len(changed), len(identities)
+            )
+        )
+        self.sf_command = (
+            "sf {} [{} new or changed files] (cached results from {})".format(
+                " ".join(sf_options), len(changed), os.path.abspath(args.cache)
+            )
+        )
+        if changed:
+            _scan_files_into_cache(
+                args, use_hash, changed, identities, cache_cursor, self.sf_jobs
+            )
 
-    # Print warnings for deprecated flags.
-    if args.save_assets or args.load_assets:
-        logger.warning(
-            "DEPRECATION NOTICE: --save_assets and --load_assets options are "
-            "deprecated. In Brunnhilde 1.9+, the HTML report has no external "
-            "JavaScript or CSS dependencies to be managed. The flags are "
-            "retained for API stability but are no longer functional."
-        )
-    if args.basename:
-        logger.warning(
-            "DEPRECATION NOTICE: The basename argument is deprecated in Brunnhilde 1.9.0. "
-            "Prefer using the new simpler `brunnhilde.py source destination` syntax. "
-            "The basename argument is retained for API stability and used if provided."
+        removed = [path for path in cached if path not in identities]
+        for path in removed:
+            cache_cursor.execute("DELETE FROM cache_files WHERE source_path=?", (path,))
+            cache_cursor.execute("DELETE FROM cache_rows WHERE source_path=?", (path,))
+        cache_conn.commit()
+
+        # Write merged results to sf_file in same layout as Siegfried CSV
+        header = list(SIEGFRIED_COLUMNS)
+        if use_hash:
+            header[header.index("hash")] = _determine_hash_type(args)
+        else:
+            header.remove("hash")
+        csv_out = open(self.sf_file, "w", newline="", encoding="utf8")
+        w = csv.writer(csv_out)
+        w.writerow(header)
+        for path in sorted(identities):
+            cache_cursor.execute(
+                "SELECT filename, filesize, modified, errors, hash, namespace, id, format, version, mime, basis, warning, class FROM cache_rows WHERE source_path=? ORDER BY rowid",
+                (path,),
+            )
+            for row in cache_cursor:
+                if not use_hash:
+                    row = row[:4] + row[5:]
+                w.writerow(row)
+        csv_out.close()
+
+        cache_cursor.close()
+        cache_conn.close()
+        log_info("Siegfried scan complete. Processing results.")
+
+    def run_siegfried_sharded(self, source_dir):
+        """Run siegfried as parallel processes over size-balanced shards of source
+
+        Each of the args.shards shards is scanned by its own sf process.
+        With --jobs, at most sf_jobs shards are scanned at once, and the
+        jobs are divided between their sf processes. The shard CSVs are
+        concatenated into sf_file in shard order.
+        """
+        log_info(
+            "Running Siegfried on {} shards.".format(self.args.shards),
+            time_warning=True,
         )
+        sf_options = _sf_options(self.args, self.use_hash)
+        self.cursor.execute("SELECT path, size FROM source_listing WHERE is_file=1;")
+        files = self.cursor.fetchall()
+        shards = make_size_balanced_shards(files, self.args.shards)
+        workers = len(shards) or 1
+        if self.sf_jobs is not None:
+            workers = min(workers, self.sf_jobs)
+            sf_options = sf_options + _sf_jobs_options(max(1, self.sf_jobs // workers))
+        self.sf_command = "sf {} [{} files in {} parallel shards of {}]".format(
+            " ".join(sf_options), len(files), len(shards), source_dir
+        )
+
+        shards_dir = os.path.join(self.report_dir, "sf_shards")
+        os.makedirs(shards_dir)
+        shard_csvs = [
+            os.path.join(shards_dir, "shard{}.csv".format(i))
+            for i in range(len(shards))
+        ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_run_sf_shard, sf_options, shard, shard_csv)
+                for shard, shard_csv in zip(shards, shard_csvs)
+            ]
+            for future in futures:
+                future.result()
+
+        # Merge shard outputs, keeping only the first header
+        out = open(self.sf_file, "w", newline="", encoding="utf8")
+        header_written = False
+        for shard_csv in shard_csvs:
+            shard_in = open(shard_csv, "r", newline="", encoding="utf8")
+            header = shard_in.readline()
+            if header and not header_written:
+                out.write(header)
+                header_written = True
+            shutil.copyfileobj(shard_in, out)
+            shard_in.close()
+        out.close()
+        shutil.rmtree(shards_dir)
+        log_info("Siegfried scan complete. Processing results.")
+
+    def run_siegfried_server(self, source_dir):
+        """Identify directory with a long-running Siegfried server (sf -serve)
+
+        The server's CSV response is streamed to sf_file. Falls back to
+        running sf as a subprocess if the request fails.
+        """
+        server_url = self.args.sf_server
+        log_info(
+            "Requesting identification from Siegfried server at {}.".format(server_url),
+            time_warning=True,
+        )
+        request_path = _sf_server_identify_path(self.args, source_dir, self.use_hash)
+        try:
+            connection, response = _sf_server_request(server_url, request_path)
+            if response.status != 200:
+                response.read()
+                _release_sf_server_connection(server_url, connection)
+                raise http.client.HTTPException(
+                    "HTTP {} {}".format(response.status, response.reason)
+                )
+            with open(self.sf_file, "wb") as out:
+                shutil.copyfileobj(response, out)
+        except (http.client.HTTPException, socket.error) as e:
+            logger.warning(
+                "Siegfried server request failed ({}). Running sf instead.".format(e)
+            )
+            self.run_siegfried(source_dir)
+            return
+        _release_sf_server_connection(server_url, connection)
+        self.sf_command = "GET {}{}".format(server_url.rstrip("/"), request_path)
+        log_info("Siegfried scan complete. Processing results.")
+
+    def run_clamav(self, source_dir):
+        """Run ClamAV on directory"""
+        timestamp = str(datetime.datetime.now())
+        log_info("Running virus scan.", time_warning=True)
+        virus_log = os.path.join(self.log_dir, "viruscheck-log.txt")
+        with self.jobs.reserve("ClamAV", max_jobs=CLAMAV_JOBS):
+            if self.args.clamd:
+                if clamd_available():
+                    self._run_clamdscan(source_dir, virus_log)
+                else:
+                    logger.warning("clamd unavailable. Falling back to clamscan.")
+                    self._run_clamscan(source_dir, virus_log)
+            else:
+                self._run_clamscan(source_dir, virus_log)
+        # add timestamp
+        target = open(virus_log, "a")
+        target.write("Date scanned: %s" % timestamp)
+        target.close()
+
+    def import_clamav_log(self):
+        """Load virus log into the database and warn of infected files
+
+        Run in the main thread once run_clamav has finished, as the
+        database connection is not shared with stage threads.
+        """
+        virus_log = os.path.join(self.log_dir, "viruscheck-log.txt")
+        with open(virus_log, encoding="utf8", errors="replace") as f:
+            load_clamav_log(self.cursor, self.conn, f)
+        self.cursor.execute("SELECT COUNT(*) FROM clamav_summary;")
+        if not self.cursor.fetchone()[0]:
+            logger.warning("ClamAV not properly configured.")
+            return
+        self.cursor.execute("SELECT COUNT(*) FROM clamav WHERE status='FOUND';")
+        if self.cursor.fetchone()[0]:
+            logger.warning(
+                "INFECTED FILE(S) FOUND. See {} for details.".format(virus_log)
+            )
+        else:
+            log_info("No viruses found.")
+
+    def _run_clamdscan(self, source_dir, virus_log):
+        """Scan directory with running clamd, writing output to virus_log
 
-    log_info("Brunnhilde started. Source: {}.".format(source))
+        The daemon keeps its signatures loaded between runs and scans
+        files in parallel. File and scan size limits are those set in
+        clamd.conf, so --largefiles has no effect here.
+        """
+        if self.args.largefiles:
+            logger.warning(
+                "--largefiles is ignored with --clamd. Set MaxFileSize and "
+                "MaxScanSize in clamd.conf instead."
+            )
+        cmd = _clamdscan_command(source_dir)
+        if sys.platform.startswith("win"):
+            with open(virus_log, "w") as log:
+                subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+        else:
+            subprocess.call(
+                "{} 2>&1 | tee {}".format(
+                    " ".join(shlex.quote(arg) for arg in cmd), shlex.quote(virus_log)
+                ),
+                shell=True,
+            )
 
-    use_hash = True
-    if args.hash == "none":
-        use_hash = False
+    def _run_clamscan(self, source_dir, virus_log):
+        """Scan directory with clamscan, writing output to virus_log"""
+        if self.args.largefiles:
+            if sys.platform.startswith("win"):
+                clamav_command = (
+                    'clamscan -i -r "%s" --max-scansize=0 --max-filesize=0 > "%s"'
+                    % (source_dir, virus_log)
+                )
+            else:
+                clamav_command = (
+                    'clamscan -i -r "%s" --max-scansize=0 --max-filesize=0 | tee "%s"'
+                    % (source_dir, virus_log)
+                )
 
-    ssn_mode = 1
-    if args.ssn_mode in (0, 2):
-        ssn_mode = args.ssn_mode
+        else:
+            if sys.platform.startswith("win"):
+                clamav_command = 'clamscan -i -r "%s" > "%s"' % (source_dir, virus_log)
+            else:
+                clamav_command = 'clamscan -i -r "%s" | tee "%s"' % (
+                    source_dir,
+                    virus_log,
+                )
+        subprocess.call(clamav_command, shell=True)
 
-    # Create report subdirectories directories
-    dirs_to_create = [csv_dir]
-    if not (args.bulkextractor is False and args.noclam is True):
-        dirs_to_create.append(log_dir)
-    for new_dir in dirs_to_create:
+    def run_bulk_extractor(self, source_dir):
+        """Run bulk extractor on directory"""
+        bulk_extractor_log = os.path.join(self.log_dir, "bulk_extractor-log.txt")
+        log_info("Running bulk_extractor.", time_warning=True)
         try:
-            os.makedirs(new_dir)
+            os.makedirs(self.bulkext_dir)
         except OSError as exception:
             if exception.errno != errno.EEXIST:
                 raise
+        cmd = [
+            "bulk_extractor",
+            "-o",
+            self.bulkext_dir,
+            "-S",
+            "ssn_mode={}".format(str(self.ssn_mode)),
+            "-R",
+            source_dir,
+        ]
+        if self.args.regex:
+            cmd.insert(1, "-F")
+            cmd.insert(2, self.args.regex)
+        try:
+            log_file = open(bulk_extractor_log, "w", encoding="utf-8")
+            with self.jobs.reserve("bulk_extractor") as jobs:
+                if jobs is not None:
+                    cmd[1:1] = ["-j", str(jobs)]
+                subprocess.call(cmd, stderr=subprocess.STDOUT, stdout=log_file)
+            log_file.close()
+            log_info("bulk_extractor scan complete.")
+        except subprocess.CalledProcessError as e:
+            logger.warning("Error running bulk_extractor: {}".format(e))
+
+    def import_csv(self):
+        """Import Siegfried output in sf_file into sqlite db
+
+        Updates use_hash if the input Siegfried output is found to have
+        file hashes. This provides a double-check for Siegfried CSVs
+        provided as input from stdin or a file and prevents users from
+        having to use the --hash flag when providing their own inputs.
+        """
+        f = open(self.sf_file, "r", newline="", encoding="utf8", errors="ignore")
+        try:
+            self.use_hash = load_siegfried_output(
+                self.cursor, self.conn, f, self.use_hash, self.sf_format
+            )
+        finally:
+            f.close()
+
+    def create_html_report(self, scan_started):
+        """Get aggregate statistics and write to html report"""
+        args = self.args
+        cursor = self.cursor
+        html = self.html
+        use_hash = self.use_hash
+        # Gather stats from database.
+        stats = get_aggregate_stats(cursor)
+        num_files = stats["num_files"]
+        empty_files = stats["empty_files"]
+        unidentified_files = stats["unidentified_files"]
+        num_formats = stats["num_formats"]
+        num_errors = stats["num_errors"]
+        num_warnings = stats["num_warnings"]
+        begin_date = stats["begin_year"] or "N/A"
+        end_date = stats["end_year"] or "N/A"
+        earliest_date = stats["earliest_date"] or "N/A"
+        latest_date = stats["latest_date"] or "N/A"
+
+        if use_hash:
+            distinct_files = stats["distinct_files"]
+
+            cursor.execute(
+                "SELECT COALESCE(SUM(num_files), 0), COUNT(*) FROM duplicate_groups;"
+            )  # duplicates and distinct duplicates
+            all_dupes, distinct_dupes = cursor.fetchone()
+
+            duplicate_copies = int(all_dupes) - int(
+                distinct_dupes
+            )  # number of duplicate copies of unique files
+            duplicate_copies = str(duplicate_copies)
+
+        size_bytes = get_total_size(args, cursor, stats)
+        size = convert_size(size_bytes)
+
+        # write html
+        _write_html_head("Brunnhilde report: {}".format(self.basename), html)
+
+        # navbar
+        html.write("\n<header>")
+        html.write("\n<h1>Brunnhilde HTML report</h1>")
+        html.write("\n<nav>")
+        html.write('\n<a href="#Provenance">Provenance</a>')
+        html.write('\n<a href="#Stats">Statistics</a>')
+        if not (args.noclam or sys.platform.startswith("win")):
+            html.write('\n<a href="#Virus report">Virus report</a>')
+            html.write('\n<a href="#Virus findings">Virus findings</a>')
+        html.write('\n<a href="#File formats">File formats</a>')
+        html.write('\n<a href="#File format versions">Versions</a>')
+        html.write('\n<a href="#MIME types">MIME types</a>')
+        html.write('\n<a href="#Last modified dates by year">Dates</a>')
+        html.write('\n<a href="#Unidentified">Unidentified</a>')
+        if args.warnings:
+            html.write('\n<a href="#Warnings">Warnings</a>')
+        html.write('\n<a href="#Errors">Errors</a>')
+        if use_hash:
+            html.write('\n<a href="#Duplicates">Duplicates</a>')
+        if use_hash and args.dup_index:
+            html.write('\n<a href="#Other accessions">Other accessions</a>')
+        if args.bulkextractor:
+            html.write('\n<a href="#SSNs">SSNs</a>')
+            html.write('\n<a href="#PII by file">PII</a>')
+        html.write('\n<a href="#Run metrics">Metrics</a>')
+        html.write("\n</nav>")
+        html.write("\n</header>")
+
+        # provenance
+        html.write("\n<div>")
+        html.write('\n<a class="anchor" name="Provenance"></a>')
+        html.write("\n<h2>Provenance</h2>")
+        html.write(
+            "\n<p><strong>Input source (directory or disk image):</strong> {}</p>".format(
+                escape_html(self.source)
+            )
+        )
+        html.write(
+            "\n<p><strong>Accession/identifier:</strong> {}</p>".format(
+                escape_html(self.basename)
+            )
+        )
+        html.write(
+            "\n<p><strong>Brunnhilde version:</strong> {}</p>".format(
+                BRUNNHILDE_VERSION
+            )
+        )
+        if not (args.csv or args.stdin):
+            html.write(
+                "\n<p><strong>Siegfried version:</strong> {}</p>".format(
+                    _html_cell_text(self.siegfried_version)
+                )
+            )
+            html.write(
+                "\n<p><strong>Siegfried command:</strong> {}</p>".format(
+                    escape_html(self.sf_command)
+                )
+            )
+        html.write("\n<p><strong>Scan started:</strong> {}</p>".format(scan_started))
+        html.write("\n</div>")
 
-    # Create html report
-    html_report_path = os.path.join(report_dir, "report.html")
-    if sys.version_info > (3, 0):
-        html = open(html_report_path, "w", encoding="utf8")
-    else:
-        html = open(html_report_path, "wb")
-
-    # Open database connection and cursor
-    db = os.path.join(report_dir, "siegfried.sqlite")
-    if args.in_memory_db:
-        db = ":memory:"
-    conn = sqlite3.connect(db)
-    conn.text_factory = str  # allows utf-8 data to be stored
-    cursor = conn.cursor()
-
-    # If source is a disk image, carve files for analysis and create DFXML if possible
-    if args.diskimage:
-        if sys.platform.startswith("win"):
-            log_error_and_exit_message(
-                "Disk images not supported as inputs in Windows."
+        # statistics
+        html.write("\n<div>")
+        html.write('\n<a class="anchor" name="Stats"></a>')
+        html.write("\n<h2>Statistics</h2>")
+        html.write("\n<p><strong>Total files:</strong> {}</p>".format(num_files))
+        html.write("\n<p><strong>Total size:</strong> {}</p>".format(size))
+        if use_hash:
+            html.write(
+                "\n<p><strong>Distinct files:</strong> {}</p>".format(distinct_files)
             )
-            close_files_conns_on_exit(html, conn, cursor, report_dir)
-            sys.exit(1)
+            html.write("\n<p><strong>Duplicates:</strong> {}".format(duplicate_copies))
+            if duplicate_copies:
+                html.write(
+                    ' (of {} distinct files) <a href="#Duplicates">(see list)</a></p>'.format(
+                        distinct_dupes
+                    )
+                )
+            else:
+                html.write(' <a href="#Duplicates">(see list)</a></p>')
+            if args.dup_index:
+                cursor.execute("SELECT COUNT(DISTINCT filename) FROM other_accessions;")
+                other_accession_files = cursor.fetchone()[0]
+                html.write(
+                    "\n<p><strong>Files already held in other accessions:</strong> {}".format(
+                        other_accession_files
+                    )
+                )
+                if other_accession_files:
+                    html.write(' <a href="#Other accessions">(see list)</a></p>')
+                else:
+                    html.write(" </p>")
+        html.write(
+            "\n<p><strong>Empty (zero byte) files:</strong> {}</p>".format(empty_files)
+        )
+        html.write("\n<hr>")
+        html.write(
+            "\n<p><strong>Years (last modified):</strong> {begin} - {end}</p>".format(
+                begin=begin_date, end=end_date
+            )
+        )
+        html.write("\n<p><strong>Earliest date:</strong> {}</p>".format(earliest_date))
+        html.write("\n<p><strong>Latest date:</strong> {}</p>".format(latest_date))
+        html.write("\n<hr>")
+        html.write(
+            "\n<p><strong>Identified file formats:</strong> {}</p>".format(num_formats)
+        )
+        html.write(
+            "\n<p><strong>Unidentified files:</strong> {}".format(unidentified_files)
+        )
+        if unidentified_files:
+            html.write(' <a href="#Unidentified">(see list)</a></p>')
+        else:
+            html.write(" </p>")
+        html.write("\n<hr>")
+        if args.warnings:
+            html.write(
+                "\n<p><strong>Siegfried warnings:</strong> {}".format(num_warnings)
+            )
+            if num_warnings:
+                html.write(' <a href="#Warnings">(see list)</a></p>')
+            else:
+                html.write(" </p>")
+        html.write("\n<p><strong>Siegfried errors:</strong> {}".format(num_errors))
+        if num_errors:
+            html.write(' <a href="#Errors">(see list)</a></p>')
+        else:
+            html.write(" </p>")
+        html.write("\n</div>")
+
+    def write_virus_report_section(self):
+        """Write ClamAV scan summary and findings to html report"""
+        if not (self.args.noclam or sys.platform.startswith("win")):
+            html = self.html
+            html.write("\n<div>")
+            html.write('\n<a class="anchor" name="Virus report"></a>')
+            html.write("\n<h2>Virus report</h2>")
+            self.cursor.execute(
+                "SELECT name, value FROM clamav_summary ORDER BY rowid;"
+            )
+            summary = self.cursor.fetchall()
+            if not summary:
+                html.write(
+                    "\n<p>ClamAV did not complete a scan. See logs/viruscheck-log.txt.</p>"
+                )
+            for name, value in summary:
+                html.write(
+                    "\n<p><strong>{}:</strong> {}</p>".format(
+                        escape_html(name), escape_html(value)
+                    )
+                )
+            html.write("\n</div>")
+            self._write_report(
+                "Virus findings",
+                CLAMAV_FINDINGS_SQL,
+                os.path.join(self.csv_dir, "viruses.csv"),
+                [
+                    "Filename",
+                    "Signature",
+                    "Status",
+                    "ID",
+                    "Format",
+                    "Version",
+                    "MIME type",
+                ],
+                html,
+            )
+
+    def write_pii_report_sections(self):
+        """Write SSNs and PII by file sections from bulk_extractor tables"""
+        paging = dict(
+            page_size=self.args.page_size,
+            report_dir=self.report_dir,
+            basename=self.basename,
+        )
+        self._write_report(
+            "SSNs",
+            SSNS_SQL,
+            os.path.join(self.csv_dir, "ssns.csv"),
+            ["File", "Feature", "Context"],
+            self.html,
+            **paging
+        )
+        self._write_report(
+            "PII by file",
+            PII_COUNTS_SQL,
+            os.path.join(self.csv_dir, "pii_counts.csv"),
+            [
+                "Filename",
+                "SSNs",
+                "Email addresses",
+                "Credit card numbers",
+                "ID",
+                "Format",
+            ],
+            self.html,
+            **paging
+        )
+
+    def _write_report(self, section_header, sql, path, header, html, **paging):
+        """Call write_report, recording the section in run metrics"""
+        with self.metrics.stage("Report: {}".format(section_header)) as stage:
+            stage["rows"] = write_report(
+                section_header, sql, path, header, self.cursor, html, **paging
+            )
+
+    def generate_reports(self):
+        """Run sql queries on db to generate reports, write to csv and html"""
+        args = self.args
+        cursor = self.cursor
+        html = self.html
+        csv_dir = self.csv_dir
+        paging = dict(
+            page_size=args.page_size,
+            report_dir=self.report_dir,
+            basename=self.basename,
+        )
+        full_header = [
+            "Filename",
+            "Filesize",
+            "Date modified",
+            "Errors",
+            "Namespace",
+            "ID",
+            "Format",
+            "Format version",
+            "MIME type",
+            "Basis for ID",
+            "Warning",
+        ]
+        if self.use_hash:
+            full_header.insert(4, "Checksum")
+
+        # sorted format list report
+        sql = "SELECT i.format, i.id, SUM(counts.num) as 'num' FROM {} GROUP BY i.format ORDER BY num DESC, i.format".format(
+            IDENTIFICATION_COUNTS_SQL
+        )
+        path = os.path.join(csv_dir, "formats.csv")
+        format_header = ["Format", "ID", "Count"]
+        self._write_report("File formats", sql, path, format_header, html)
+
+        # sorted format and version list report
+        sql = "SELECT i.format, i.id, i.version, SUM(counts.num) as 'num' FROM {} GROUP BY i.format, i.version ORDER BY num DESC, i.format, i.version".format(
+            IDENTIFICATION_COUNTS_SQL
+        )
+        path = os.path.join(csv_dir, "formatVersions.csv")
+        version_header = ["Format", "ID", "Version", "Count"]
+        self._write_report("File format versions", sql, path, version_header, html)
+
+        # sorted mimetype list report
+        sql = "SELECT i.mime, SUM(counts.num) as 'num' FROM {} GROUP BY i.mime ORDER BY num DESC, i.mime".format(
+            IDENTIFICATION_COUNTS_SQL
+        )
+        path = os.path.join(csv_dir, "mimetypes.csv")
+        mime_header = ["MIME type", "Count"]
+        self._write_report("MIME types", sql, path, mime_header, html)
+
+        # dates report
+        sql = "SELECT SUBSTR(modified, 1, 4) as 'year', COUNT(*) as 'num' FROM siegfried_files GROUP BY year ORDER BY num DESC, year"
+        path = os.path.join(csv_dir, "years.csv")
+        year_header = ["Year Last Modified", "Count"]
+        self._write_report("Last modified dates by year", sql, path, year_header, html)
+
+        # unidentified files report
+        sql = "SELECT filename, filesize, modified FROM siegfried_files WHERE ident_id IN (SELECT ident_id FROM siegfried_identifications WHERE id='UNKNOWN') ORDER BY rowid;"
+        path = os.path.join(csv_dir, "unidentified.csv")
+        unidentified_header = ["File", "Size", "Date Modified"]
+        self._write_report(
+            "Unidentified", sql, path, unidentified_header, html, **paging
+        )
+
+        # warnings report
+        sql = "SELECT f.filename, f.errors, i.id, i.format, i.version, b.basis, w.warning FROM siegfried_files AS f JOIN siegfried_warnings AS w ON w.warning_id = f.warning_id JOIN siegfried_identifications AS i ON i.ident_id = f.ident_id JOIN siegfried_bases AS b ON b.basis_id = f.basis_id WHERE w.warning <> '' ORDER BY f.rowid;"
+        path = os.path.join(csv_dir, "warnings.csv")
+        warnings_header = [
+            "File",
+            "Errors",
+            "ID",
+            "Format",
+            "Version",
+            "Basis for ID",
+            "Warning",
+        ]
+        # warnings are only added to the html report if requested
+        warnings_html = html if args.warnings else None
+        self._write_report(
+            "Warnings", sql, path, warnings_header, warnings_html, **paging
+        )
+
+        # errors report
+        sql = "SELECT f.filename, f.filesize, f.modified, f.errors, w.warning FROM siegfried_files AS f JOIN siegfried_warnings AS w ON w.warning_id = f.warning_id WHERE f.errors <> '' ORDER BY f.rowid;"
+        path = os.path.join(csv_dir, "errors.csv")
+        errors_header = ["File", "Size", "Date Modified", "Errors", "Warnings"]
+        self._write_report("Errors", sql, path, errors_header, html, **paging)
+
+        if self.use_hash:
+            # duplicates report
+            path = os.path.join(csv_dir, "duplicates.csv")
+            with self.metrics.stage("Report: Duplicates") as stage:
+                stage["rows"] = write_duplicates_report(
+                    DUPLICATES_SQL, path, full_header, cursor, html, **paging
+                )
+
+        if self.use_hash and args.dup_index:
+            # files held in other accessions report
+            sql = "SELECT filename, hash, accession, accession_filename FROM other_accessions;"
+            path = os.path.join(csv_dir, "otherAccessions.csv")
+            other_accessions_header = [
+                "File",
+                "Checksum",
+                "Other accession",
+                "File in other accession",
+            ]
+            self._write_report(
+                "Other accessions", sql, path, other_accessions_header, html, **paging
+            )
+
+    def make_tree(self, source_dir, cursor=None):
+        """Write tree.txt, and tree.json if requested, from source listing
+
+        The listing is read with cursor, by default the run's cursor.
+        """
+        if cursor is None:
+            cursor = self.cursor
+        with open(
+            os.path.join(self.report_dir, "tree.txt"), "w", encoding="utf8"
+        ) as out:
+            write_tree_text(cursor, source_dir, out)
+        if self.args.tree_json:
+            with open(
+                os.path.join(self.report_dir, "tree.json"), "w", encoding="utf8"
+            ) as out:
+                write_tree_json(cursor, source_dir, out)
+
+    def record_listing_and_tree(self, source_dir, listing_db):
+        """Record source listing in listing_db and write tree from it
+
+        Run as a background stage, so the listing is written with its own
+        connection to a separate database rather than the run's, which
+        may be in memory and is not shared between threads.
+        """
+        conn = sqlite3.connect(listing_db)
+        conn.text_factory = str
+        cursor = conn.cursor()
+        try:
+            record_source_listing(cursor, conn, source_dir)
+            with self.metrics.stage("tree"):
+                self.make_tree(source_dir, cursor)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _set_sf_format(self, sf_format):
+        """Set format of Siegfried output and name sf_file to match"""
+        self.sf_format = sf_format
+        self.sf_file = os.path.join(self.report_dir, "siegfried." + sf_format)
+
+    def accept_or_run_siegfried(self, source_dir):
+        """Write file/stdin Siegfried output to sf_file or run Siegfried to create it
+
+        The format of file or stdin input (CSV, JSON or YAML) is detected
+        from its first characters.
+        """
+        args = self.args
+        if args.csv:
+            try:
+                with open(args.csv, "r", encoding="utf8", errors="ignore") as f:
+                    self._set_sf_format(siegfried_output_format(f.read(1024)))
+                shutil.copyfile(os.path.abspath(args.csv), self.sf_file)
+            except (IOError, OSError) as e:
+                raise BrunnhildeError("Unable to copy CSV file: {}".format(e))
+
+        elif args.stdin:
+            try:
+                start = sys.stdin.read(1024)
+                self._set_sf_format(siegfried_output_format(start))
+                with open(self.sf_file, "w", newline="", encoding="utf8") as sf_out:
+                    sf_out.write(start)
+                    shutil.copyfileobj(sys.stdin, sf_out)
+            except Exception as e:
+                raise BrunnhildeError(
+                    "Unable to read Siegfried output from piped stdin: {}".format(e)
+                )
+
+        elif args.cache:
+            self.run_siegfried_with_cache(source_dir)
+
+        elif args.shards > 1:
+            self.run_siegfried_sharded(source_dir)
+
+        elif args.sf_server:
+            self.run_siegfried_server(source_dir)
+
+        else:
+            self.run_siegfried(source_dir)
+
+    def process_content(self, source_dir):
+        """Run through main processing flow on specified directory
+
+        source_dir is walked once to record its listing, from which the
+        tree is written. The cache, shards and total size with -z also use
+        the listing, so in those cases, or without --parallel, it is
+        recorded before Siegfried runs. Otherwise the listing and tree,
+        like ClamAV and bulk_extractor, only read source_dir, so with
+        --parallel they run alongside the rest and the report only waits
+        for each of them where its output is needed.
+        """
+        args = self.args
+        metrics = self.metrics
+        scan_started = str(datetime.datetime.now())
+        stages = StageRunner(parallel=args.parallel, metrics=metrics)
+        runs_sf = not (args.csv or args.stdin or args.sf_server)
+        listing_first = not args.parallel or (
+            args.cache or args.shards > 1 or args.scanarchives
+        )
+        listing_db = os.path.join(self.report_dir, "source_listing.sqlite")
+        if args.parallel:
+            # Tools started in the background share the budget with sf
+            if runs_sf:
+                self.jobs.expect("Siegfried")
+            if not args.noclam:
+                self.jobs.expect("ClamAV", max_jobs=CLAMAV_JOBS)
+            if args.bulkextractor:
+                self.jobs.expect("bulk_extractor")
+        try:
+            if not args.noclam:
+                stages.start("ClamAV", self.run_clamav, source_dir)
+            if args.bulkextractor:
+                stages.start("bulk_extractor", self.run_bulk_extractor, source_dir)
+            if listing_first:
+                with metrics.stage("Listing") as stage:
+                    stage["rows"] = record_source_listing(
+                        self.cursor, self.conn, source_dir
+                    )
+                with metrics.stage("tree"):
+                    self.make_tree(source_dir)
+            else:
+                stages.start(
+                    "Listing", self.record_listing_and_tree, source_dir, listing_db
+                )
+
+            if args.stream and not (
+                args.csv
+                or args.stdin
+                or args.cache
+                or args.shards > 1
+                or args.sf_server
+            ):
+                with metrics.stage("Siegfried and import") as stage:
+                    with self.jobs.reserve("Siegfried") as self.sf_jobs:
+                        self.run_siegfried_streaming(source_dir)
+                    stage["rows"] = self._count_siegfried_rows()
+            else:
+                with metrics.stage("Siegfried"):
+                    if runs_sf:
+                        with self.jobs.reserve("Siegfried") as self.sf_jobs:
+                            self.accept_or_run_siegfried(source_dir)
+                    else:
+                        self.accept_or_run_siegfried(source_dir)
+                with metrics.stage("Import") as stage:
+                    self.import_csv()
+                    stage["rows"] = self._count_siegfried_rows()
+            with metrics.stage("Indexing"):
+                index_siegfried_table(self.cursor, self.conn, self.use_hash)
+            if args.dup_index and self.use_hash:
+                log_info("Checking duplicate index for files held in other accessions.")
+                with metrics.stage("Duplicate index"):
+                    update_duplicate_index(
+                        self.cursor, self.conn, args.dup_index, self.basename
+                    )
+            with metrics.stage("Statistics"):
+                self.create_html_report(scan_started)
+            stages.wait("ClamAV")
+            if not args.noclam:
+                with metrics.stage("ClamAV import"):
+                    self.import_clamav_log()
+            self.write_virus_report_section()
+            if not listing_first:
+                stages.wait("Listing")
+                with metrics.stage("Listing copy") as stage:
+                    stage["rows"] = copy_source_listing(
+                        self.cursor, self.conn, listing_db
+                    )
+                os.remove(listing_db)
+            self.generate_reports()
+            if args.bulkextractor:
+                stages.wait("bulk_extractor")
+                with metrics.stage("bulk_extractor import") as stage:
+                    stage["rows"] = load_bulk_extractor_output(
+                        self.cursor, self.conn, self.bulkext_dir
+                    )
+                self.write_pii_report_sections()
+            stages.wait_all()
+            write_metrics_section(metrics, self.html)
+            close_html_report(self.html)  # close HTML file tags
+        finally:
+            # Only reached with stages still running if an error is
+            # propagating; log their failures rather than replace it
+            stages.wait_all(raise_errors=False)
+
+    def _count_siegfried_rows(self):
+        self.cursor.execute("SELECT COUNT(*) FROM siegfried_files;")
+        return self.cursor.fetchone()[0]
+
+    def carve_files_with_unhfs(self, out_dir, disk_image):
+        """Carve files from HFS disk image"""
+        args = self.args
+        if sys.platform.startswith("linux"):
+            unhfs_bin = "/usr/share/hfsexplorer/bin/unhfs"
+        elif sys.platform.startswith("darwin"):
+            unhfs_bin = "/usr/local/share/hfsexplorer/bin/unhfs"
+        # TODO: Add else statement with path to unhfs binary on windows
+
+        cmd = [unhfs_bin, "-v", "-o", out_dir, disk_image]
+        if args.hfs_resforks:
+            cmd.insert(1, "-resforks")
+            cmd.insert(2, "APPLEDOUBLE")
+        if args.hfs_partition:
+            cmd.insert(1, "-partition")
+            cmd.insert(2, str(args.hfs_partition))
+        if args.hfs_fsroot:
+            cmd.insert(1, "-fsroot")
+            cmd.insert(2, args.hfs_fsroot)
+
+        log_info("Attempting to carve files from disk image using HFS Explorer.")
+        try:
+            subprocess.check_output(cmd)
+            log_info("File carving successful.")
+        except subprocess.CalledProcessError as e:
+            self.close_files_conns_on_exit()
+            raise BrunnhildeError(
+                "Unable to export files from disk image: {}".format(e.output)
+            )
+
+    def carve_files_with_tsk_recover(self, out_dir, disk_image):
+        """Attempt to carve files from disk image with tsk_recover"""
+        args = self.args
+        mode = "-e"
+        if args.allocated:
+            mode = "-a"
+
+        cmd = ["tsk_recover", mode, disk_image, out_dir]
+        if args.tsk_fstype:
+            cmd.insert(2, "-f")
+            cmd.insert(3, args.tsk_fstype)
+        if args.tsk_imgtype:
+            cmd.insert(2, "-i")
+            cmd.insert(3, args.tsk_imgtype)
+        if args.tsk_sector_offset:
+            cmd.insert(2, "-o")
+            cmd.insert(3, args.tsk_sector_offset)
+
+        log_info("Attempting to carve files from disk image using tsk_recover.")
+        try:
+            subprocess.check_output(cmd)
+            log_info("File carving successful.")
+        except subprocess.CalledProcessError as e:
+            self.close_files_conns_on_exit()
+            raise BrunnhildeError(
+                "Unable to export files from disk image: {}".format(e.output)
+            )
+
+    def create_dfxml(self):
+        """Create DFXML with fiwalk"""
+        fiwalk_file = os.path.join(self.report_dir, "dfxml.xml")
+        log_info("Attempting to generate DFXML file from disk image using fiwalk.")
+        try:
+            subprocess.check_output(["fiwalk", "-X", fiwalk_file, self.source])
+            log_info("DFXML file created.")
+        except subprocess.CalledProcessError as e:
+            logger.warning(
+                "Fiwalk could not create DFXML for disk: {}".format(e.output)
+            )
+
+    def close_files_conns_on_exit(self):
+        self.cursor.close()
+        self.conn.close()
+        self.html.close()
+        shutil.rmtree(self.report_dir)
+
+    def run(self):
+        """Characterize source and write reports
+
+        Raises BrunnhildeError if the run cannot be completed.
+        """
+        args = self.args
+        report_dir = self.report_dir
+
+        if args.jobs is not None and args.jobs < 1:
+            raise BrunnhildeError("--jobs must be at least 1.")
+        if args.page_size < 0:
+            raise BrunnhildeError("--page-size must not be negative.")
+
+        # Create report directory
+        if os.path.exists(report_dir):
+            if not args.overwrite:
+                raise BrunnhildeError(
+                    "Output directory already exists. To overwrite, use the -o/--overwrite option."
+                )
+
+            try:
+                shutil.rmtree(report_dir)
+            except OSError as e:
+                raise BrunnhildeError(
+                    "Unable to delete existing output directory: {}".format(e)
+                )
 
-        tempdir = os.path.join(report_dir, "carved_files")
         try:
-            os.makedirs(tempdir)
+            os.makedirs(report_dir)
         except OSError as exception:
             if exception.errno != errno.EEXIST:
                 raise
 
-        if args.hfs:
-            carve_files_with_unhfs(args, html, tempdir, source)
-        else:
-            carve_files_with_tsk_recover(args, html, tempdir, source)
-            create_dfxml()
+        # Check that Siegfried is installed and save version. When a Siegfried
+        # server is available, sf is not started at all.
+        if args.sf_server and not (args.csv or args.stdin):
+            if sf_server_available(args.sf_server):
+                self.siegfried_version = "Siegfried server at {}".format(args.sf_server)
+            else:
+                logger.warning("Falling back to running sf for this scan.")
+                args.sf_server = None
+        try:
+            if not args.sf_server:
+                self.siegfried_version = get_siegfried_version()
+        except (subprocess.CalledProcessError, OSError):
+            raise BrunnhildeError(
+                "Siegfried is not installed or available on PATH. "
+                "Please ensure that all dependencies are properly installed."
+            )
+
+        # Check that source type is correct.
+        if args.diskimage and not os.path.isfile(self.source):
+            raise BrunnhildeError(
+                "Source is not a file. Do not use the -d/--diskimage argument unless source is a disk image."
+            )
+        elif not args.diskimage and os.path.isfile(self.source):
+            raise BrunnhildeError(
+                "Source is not a directory. Use the -d/--diskimage argument if source is a disk image."
+            )
+
+        # Check that Siegfried CSV options were not used with disk image source.
+        if args.diskimage and (args.csv or args.stdin):
+            raise BrunnhildeError(
+                "Use of the --stdin and --csv options is not supported for disk images."
+            )
+
+        # Print warnings for deprecated flags.
+        if args.save_assets or args.load_assets:
+            logger.warning(
+                "DEPRECATION NOTICE: --save_assets and --load_assets options are "
+                "deprecated. In Brunnhilde 1.9+, the HTML report has no external "
+                "JavaScript or CSS dependencies to be managed. The flags are "
+                "retained for API stability but are no longer functional."
+            )
+        if args.basename:
+            logger.warning(
+                "DEPRECATION NOTICE: The basename argument is deprecated in Brunnhilde 1.9.0. "
+                "Prefer using the new simpler `brunnhilde.py source destination` syntax. "
+                "The basename argument is retained for API stability and used if provided."
+            )
+
+        log_info("Brunnhilde started. Source: {}.".format(self.source))
+
+        # Create report subdirectories directories
+        dirs_to_create = [self.csv_dir]
+        if not (args.bulkextractor is False and args.noclam is True):
+            dirs_to_create.append(self.log_dir)
+        for new_dir in dirs_to_create:
+            try:
+                os.makedirs(new_dir)
+            except OSError as exception:
+                if exception.errno != errno.EEXIST:
+                    raise
+
+        # Create html report
+        self.html = _open_html_report(os.path.join(report_dir, "report.html"))
+
+        # Open database connection and cursor
+        db = os.path.join(report_dir, "siegfried.sqlite")
+        if args.in_memory_db:
+            db = ":memory:"
+        self.conn = sqlite3.connect(db)
+        self.conn.text_factory = str  # allows utf-8 data to be stored
+        self.cursor = self.conn.cursor()
+
+        # If source is a disk image, carve files for analysis and create DFXML if possible
+        source_dir = self.source
+        if args.diskimage:
+            if sys.platform.startswith("win"):
+                self.close_files_conns_on_exit()
+                raise BrunnhildeError("Disk images not supported as inputs in Windows.")
+
+            tempdir = os.path.join(report_dir, "carved_files")
+            try:
+                os.makedirs(tempdir)
+            except OSError as exception:
+                if exception.errno != errno.EEXIST:
+                    raise
+
+            if args.hfs:
+                with self.metrics.stage("Carving"):
+                    self.carve_files_with_unhfs(tempdir, self.source)
+            else:
+                with self.metrics.stage("Carving"):
+                    self.carve_files_with_tsk_recover(tempdir, self.source)
+                with self.metrics.stage("DFXML"):
+                    self.create_dfxml()
+
+            # Use the carved_files directory as source for analysis moving forward
+            source_dir = tempdir
+
+        try:
+            self.process_content(source_dir)
+        finally:
+            # Close HTML file
+            self.html.close()
+
+            # Close database connections
+            self.cursor.close()
+            self.conn.close()
+
+        # Delete carved_files directory if user elected not to keep it
+        if args.diskimage:
+            if args.removefiles:
+                shutil.rmtree(tempdir)
+
+        # Remove sqlite db
+        if not args.in_memory_db and not args.keepsqlite:
+            os.remove(os.path.join(report_dir, "siegfried.sqlite"))
 
-        # Use the carved_files directory as source for analysis moving forward
-        source = tempdir
+        self.metrics.write(os.path.join(report_dir, METRICS_FILE_NAME))
+
+        log_info(
+            "Brunnhilde characterization complete. Reports written to %s." % report_dir
+        )
+
+
+BATCH_SUMMARY_FIELDS = [
+    "source",
+    "destination",
+    "basename",
+    "status",
+    "started",
+    "seconds",
+    "error",
+]
 
-    if not args.noclam:
-        run_clamav(args, source)
 
-    process_content(
-        args, source, cursor, conn, html, siegfried_version, use_hash, ssn_mode
+def read_batch_manifest(manifest_path):
+    """Return list of accession dicts from CSV or JSON batch manifest
+
+    Each accession has a source, a destination, and optionally a
+    basename and options. Options may be a string of command line
+    options (e.g. "-n -z") or, in JSON, a list of them.
+    """
+    if manifest_path.lower().endswith(".json"):
+        with open(manifest_path, "r", encoding="utf8") as f:
+            accessions = json.load(f)
+    else:
+        with open(manifest_path, "r", newline="", encoding="utf8") as f:
+            accessions = list(csv.DictReader(f))
+    for accession in accessions:
+        if not accession.get("source") or not accession.get("destination"):
+            raise ValueError(
+                "Manifest entry missing source or destination: {}".format(accession)
+            )
+    return accessions
+
+
+def _batch_accession_argv(accession, common_options):
+    """Return Brunnhilde command line arguments for one manifest entry"""
+    options = accession.get("options") or []
+    if not isinstance(options, list):
+        options = shlex.split(options)
+    argv = (
+        list(common_options)
+        + options
+        + [
+            accession["source"],
+            accession["destination"],
+        ]
     )
+    if accession.get("basename"):
+        argv.append(accession["basename"])
+    return argv
 
-    # Delete carved_files directory if user elected not to keep it
-    if args.diskimage:
-        if args.removefiles:
-            shutil.rmtree(tempdir)
 
-    # Close HTML file
-    html.close()
+def _run_batch_accession(accession, common_options):
+    """Run Brunnhilde for one accession in a batch worker process
 
-    # Close database connections
-    cursor.close()
-    conn.close()
+    Failures, including argument errors, are recorded in the returned
+    summary instead of stopping the worker.
+    """
+    if not logger.handlers:
+        _configure_logging()
+    result = dict(
+        source=accession["source"],
+        destination=accession["destination"],
+        basename=accession.get("basename") or "",
+        status="ok",
+        started=str(datetime.datetime.now()),
+        error="",
+    )
+    started = time.time()
+    try:
+        args = _make_parser().parse_args(
+            _batch_accession_argv(accession, common_options)
+        )
+        Brunnhilde(args).run()
+    except BrunnhildeError as e:
+        log_error_and_exit_message(str(e))
+        result["status"] = "failed"
+        result["error"] = str(e)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            result["status"] = "failed"
+            result["error"] = "Exited with status {}".format(e.code)
+    except Exception as e:
+        logger.exception("Error processing {}".format(accession["source"]))
+        result["status"] = "failed"
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["seconds"] = "{:.2f}".format(time.time() - started)
+    return result
+
+
+def run_batch(batch_args, common_options):
+    """Process every accession in a manifest with a pool of worker processes
+
+    Worker processes are reused across accessions, so interpreter
+    start-up and the sf -version probe are paid once per worker.
+    Writes a CSV summary of each accession's outcome and timing.
+    Returns the number of failed accessions. Raises BrunnhildeError if
+    the batch cannot be started.
+    """
+    if batch_args.workers < 1:
+        raise BrunnhildeError("--workers must be at least 1.")
+    accessions = read_batch_manifest(batch_args.batch)
+    log_info(
+        "Brunnhilde batch started: {} accessions, {} workers.".format(
+            len(accessions), batch_args.workers
+        )
+    )
+    batch_started = time.time()
+    results = [None] * len(accessions)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=batch_args.workers
+    ) as executor:
+        futures = dict(
+            (executor.submit(_run_batch_accession, accession, common_options), i)
+            for i, accession in enumerate(accessions)
+        )
+        for future in concurrent.futures.as_completed(futures):
+            accession = accessions[futures[future]]
+            try:
+                result = future.result()
+            except Exception as e:  # worker process died
+                result = dict(
+                    source=accession["source"],
+                    destination=accession["destination"],
+                    basename=accession.get("basename") or "",
+                    status="failed",
+                    started="",
+                    seconds="",
+                    error="{}: {}".format(type(e).__name__, e),
+                )
+            log_info(
+                "Batch: {} {} ({}s).".format(
+                    result["source"], result["status"], result["seconds"]
+                )
+            )
+            # Keep summary in manifest order
+            results[futures[future]] = result
 
-    # Remove sqlite db
-    if not args.in_memory_db and not args.keepsqlite:
-        os.remove(os.path.join(report_dir, "siegfried.sqlite"))
+    with open(batch_args.summary, "w", newline="", encoding="utf8") as f:
+        w = csv.DictWriter(f, fieldnames=BATCH_SUMMARY_FIELDS)
+        w.writeheader()
+        w.writerows(results)
 
+    num_failed = len([r for r in results if r["status"] != "ok"])
     log_info(
-        "Brunnhilde characterization complete. Reports written to %s." % report_dir
+        "Brunnhilde batch complete in {:.2f}s: {} succeeded, {} failed. Summary written to {}.".format(
+            time.time() - batch_started,
+            len(results) - num_failed,
+            num_failed,
+            batch_args.summary,
+        )
+    )
+    return num_failed
+
+
+def _make_batch_parser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Process a manifest of sources. Any other options given are "
+            "applied to every accession, before the manifest's own options."
+        )
+    )
+    parser.add_argument(
+        "--batch",
+        help="Path to CSV or JSON manifest with source, destination, basename and options for each accession",
+        action="store",
+        required=True,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of accessions to process at once (default: 2)",
+        action="store",
+        type=int,
+        default=2,
     )
+    parser.add_argument(
+        "--summary",
+        help="Path for CSV summary of batch outcomes (default: brunnhilde-batch-summary.csv)",
+        action="store",
+        default="brunnhilde-batch-summary.csv",
+    )
+    return parser
+
+
+def main():
+    argv = sys.argv[1:]
+    if any(a == "--batch" or a.startswith("--batch=") for a in argv):
+        _configure_logging()
+        batch_args, common_options = _make_batch_parser().parse_known_args(argv)
+        try:
+            num_failed = run_batch(batch_args, common_options)
+        except BrunnhildeError as e:
+            log_error_and_exit_message(str(e))
+            sys.exit(1)
+        sys.exit(1 if num_failed else 0)
+
+    parser = _make_parser()
+    args = parser.parse_args(argv)
+
+    _configure_logging()
+
+    try:
+        Brunnhilde(args).run()
+    except BrunnhildeError as e:
+        log_error_and_exit_message(str(e))
+        sys.exit(1)
 
 
 if __name__ == "__main__":
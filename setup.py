@@ -11,6 +11,7 @@ setup(
     description="A Siegfried-based digital archives reporting tool for directories and disk images",
     keywords="archives reporting characterization identification diskimages",
     platforms=["POSIX", "Windows"],
+    python_requires=">=3.5",
     install_requires=[],
     test_suite="test",
     classifiers=[
@@ -23,11 +24,12 @@ setup(
         "Operating System :: MacOS :: MacOS X",
         "Operating System :: POSIX :: Linux",
         "Operating System :: Microsoft :: Windows",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3.5",
         "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
         "Topic :: System :: Archiving",
         "Topic :: System :: Filesystems",
         "Topic :: Utilities",
@@ -1,15 +1,22 @@
 # encoding: utf-8
-from __future__ import print_function, unicode_literals
 
+import contextlib
 import datetime
+import io
+import json
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
+import sqlite3
+import threading
 import unittest
 from os.path import join as j
 
+import benchmark
+import brunnhilde
+
 
 def is_non_zero_file(fpath):
     return os.path.isfile(fpath) and os.path.getsize(fpath) > 0
@@ -59,8 +66,7 @@ class TestBrunnhildeIntegration(SelfCleaningTestCase):
         self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "report.html")))
 
     def test_integration_simple_positional_args(self):
-        """Test `brunnhilde.py src dest` syntax introduced in 1.9.0.
-        """
+        """Test `brunnhilde.py src dest` syntax introduced in 1.9.0."""
         subprocess.call(
             'python brunnhilde.py -n ./test-data/files/ "%s"' % (self.TEST_REPORT_DIR),
             shell=True,
@@ -96,6 +102,208 @@ class TestBrunnhildeIntegration(SelfCleaningTestCase):
         if not sys.platform.startswith("win"):
             self.assertTrue(os.path.isfile(j(self.TEST_REPORT_DIR, "tree.txt")))
 
+    def test_integration_stream(self):
+        subprocess.call(
+            'python brunnhilde.py -n --stream ./test-data/files/ "%s" test'
+            % (self.dest_tmpdir),
+            shell=True,
+        )
+        self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "siegfried.csv")))
+        self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "report.html")))
+        self.assertTrue(
+            is_non_zero_file(j(self.TEST_REPORT_DIR, "csv_reports", "formats.csv"))
+        )
+
+    def test_integration_stream_no_sf_csv(self):
+        subprocess.call(
+            'python brunnhilde.py -n --stream --no-sf-csv ./test-data/files/ "%s" test'
+            % (self.dest_tmpdir),
+            shell=True,
+        )
+        self.assertFalse(os.path.isfile(j(self.TEST_REPORT_DIR, "siegfried.csv")))
+        self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "report.html")))
+
+    def test_integration_sf_format_json_matches_csv(self):
+        subprocess.call(
+            'python brunnhilde.py -n ./test-data/files/ "%s" csv' % (self.dest_tmpdir),
+            shell=True,
+        )
+        subprocess.call(
+            'python brunnhilde.py -n --stream --sf-format json ./test-data/files/ "%s" json'
+            % (self.dest_tmpdir),
+            shell=True,
+        )
+        json_report_dir = j(self.dest_tmpdir, "json")
+        self.assertTrue(is_non_zero_file(j(json_report_dir, "siegfried.json")))
+        for report in ("formats.csv", "formatVersions.csv", "mimetypes.csv"):
+            with open(j(self.dest_tmpdir, "csv", "csv_reports", report)) as f:
+                csv_report = f.read()
+            with open(j(json_report_dir, "csv_reports", report)) as f:
+                self.assertEqual(f.read(), csv_report)
+
+    def test_integration_cache_rerun(self):
+        cache = j(self.dest_tmpdir, "sf_cache.sqlite")
+        for _ in range(2):
+            subprocess.call(
+                'python brunnhilde.py -n -o --cache "%s" ./test-data/files/ "%s" test'
+                % (cache, self.dest_tmpdir),
+                shell=True,
+            )
+            self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "siegfried.csv")))
+            with open(j(self.TEST_REPORT_DIR, "siegfried.csv"), "r") as f:
+                self.assertEqual(len(f.readlines()), 4)
+        self.assertTrue(is_non_zero_file(cache))
+
+    def test_integration_shards(self):
+        subprocess.call(
+            'python brunnhilde.py -n --shards 2 ./test-data/files/ "%s" test'
+            % (self.dest_tmpdir),
+            shell=True,
+        )
+        with open(j(self.TEST_REPORT_DIR, "siegfried.csv"), "r") as f:
+            self.assertEqual(len(f.readlines()), 4)
+        self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "report.html")))
+        self.assertFalse(os.path.exists(j(self.TEST_REPORT_DIR, "sf_shards")))
+
+    def test_integration_dup_index_other_accessions(self):
+        dup_index = j(self.dest_tmpdir, "dup_index.sqlite")
+        for accession in ("first", "second"):
+            subprocess.call(
+                'python brunnhilde.py -n --dup-index "%s" ./test-data/files/ "%s" %s'
+                % (dup_index, self.dest_tmpdir, accession),
+                shell=True,
+            )
+        self.assertFalse(
+            os.path.isfile(
+                j(self.dest_tmpdir, "first", "csv_reports", "otherAccessions.csv")
+            )
+        )
+        other_accessions = j(
+            self.dest_tmpdir, "second", "csv_reports", "otherAccessions.csv"
+        )
+        with open(other_accessions, "r") as f:
+            self.assertEqual(len(f.readlines()), 4)
+
+    def test_integration_batch_manifest(self):
+        manifest = j(self.dest_tmpdir, "manifest.csv")
+        summary = j(self.dest_tmpdir, "summary.csv")
+        with open(manifest, "w") as f:
+            f.write("source,destination,basename,options\n")
+            f.write("./test-data/files/,%s,first,\n" % self.dest_tmpdir)
+            f.write("./test-data/files/,%s,second,-w\n" % self.dest_tmpdir)
+        subprocess.call(
+            'python brunnhilde.py --batch="%s" --summary "%s" --workers 2 -n'
+            % (manifest, summary),
+            shell=True,
+        )
+        for accession in ("first", "second"):
+            self.assertTrue(
+                is_non_zero_file(j(self.dest_tmpdir, accession, "report.html"))
+            )
+        with open(summary, "r") as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(",first,ok," in lines[1])
+        self.assertTrue(",second,ok," in lines[2])
+
+    def test_api_batch_workers_must_be_positive(self):
+        batch_args, common_options = brunnhilde._make_batch_parser().parse_known_args(
+            ["--batch", j(self.dest_tmpdir, "manifest.csv"), "--workers", "0"]
+        )
+        self.assertRaises(
+            brunnhilde.BrunnhildeError,
+            brunnhilde.run_batch,
+            batch_args,
+            common_options,
+        )
+
+    def test_api_concurrent_runs(self):
+        runs = [
+            brunnhilde.Brunnhilde.from_options(
+                "./test-data/files/", j(self.dest_tmpdir, name), noclam=True
+            )
+            for name in ("one", "two")
+        ]
+        threads = [threading.Thread(target=r.run) for r in runs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in ("one", "two"):
+            report_dir = j(self.dest_tmpdir, name)
+            self.assertTrue(is_non_zero_file(j(report_dir, "siegfried.csv")))
+            with open(j(report_dir, "report.html")) as f:
+                self.assertTrue(
+                    "<strong>Accession/identifier:</strong> {}".format(name) in f.read()
+                )
+
+    def test_integration_metrics(self):
+        subprocess.call(
+            'python brunnhilde.py -n ./test-data/files/ "%s" test' % (self.dest_tmpdir),
+            shell=True,
+        )
+        with open(j(self.TEST_REPORT_DIR, "metrics.json")) as f:
+            metrics = json.load(f)
+        stages = dict((stage["name"], stage) for stage in metrics["stages"])
+        self.assertEqual(stages["Import"]["rows"], 3)
+        self.assertEqual(stages["Report: File formats"]["rows"], 3)
+        self.assertTrue(stages["Siegfried"]["wall_seconds"] >= 0)
+        with open(j(self.TEST_REPORT_DIR, "report.html")) as f:
+            self.assertTrue("<h2>Run metrics</h2>" in f.read())
+
+    def test_api_existing_output_dir_raises(self):
+        os.makedirs(self.TEST_REPORT_DIR)
+        run = brunnhilde.Brunnhilde.from_options(
+            "./test-data/files/", self.TEST_REPORT_DIR, noclam=True
+        )
+        self.assertRaises(brunnhilde.BrunnhildeError, run.run)
+
+    def test_api_negative_page_size_raises(self):
+        run = brunnhilde.Brunnhilde.from_options(
+            "./test-data/files/", self.TEST_REPORT_DIR, noclam=True, page_size=-1
+        )
+        self.assertRaises(brunnhilde.BrunnhildeError, run.run)
+        self.assertFalse(os.path.exists(self.TEST_REPORT_DIR))
+
+    def test_integration_parallel(self):
+        subprocess.call(
+            'python brunnhilde.py --parallel ./test-data/files/ "%s" test'
+            % (self.dest_tmpdir),
+            shell=True,
+        )
+        self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "siegfried.csv")))
+        self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "report.html")))
+        virus_log = j(self.TEST_REPORT_DIR, "logs", "viruscheck-log.txt")
+        with open(virus_log, "r") as f:
+            self.assertTrue("Infected files: 0" in f.read())
+        if not sys.platform.startswith("win"):
+            self.assertTrue(os.path.isfile(j(self.TEST_REPORT_DIR, "tree.txt")))
+
+    def test_integration_parallel_listing(self):
+        subprocess.call(
+            'python brunnhilde.py -n ./test-data/files/ "%s" serial'
+            % (self.dest_tmpdir),
+            shell=True,
+        )
+        subprocess.call(
+            'python brunnhilde.py -nk --parallel ./test-data/files/ "%s" test'
+            % (self.dest_tmpdir),
+            shell=True,
+        )
+        with open(j(self.dest_tmpdir, "serial", "tree.txt")) as f:
+            serial_tree = f.read()
+        with open(j(self.TEST_REPORT_DIR, "tree.txt")) as f:
+            self.assertEqual(f.read(), serial_tree)
+        self.assertFalse(
+            os.path.exists(j(self.TEST_REPORT_DIR, "source_listing.sqlite"))
+        )
+        conn = sqlite3.connect(j(self.TEST_REPORT_DIR, "siegfried.sqlite"))
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM source_listing WHERE is_file=1;")
+        self.assertEqual(cursor.fetchone()[0], 3)
+        cursor.close()
+        conn.close()
+
     def test_integration_outputs_created_diskimage(self):
         subprocess.call(
             'python brunnhilde.py -nd ./test-data/diskimages/sample-floppy-fat.dd "%s" test'
@@ -189,5 +397,497 @@ class TestBrunnhildeIntegration(SelfCleaningTestCase):
         self.assertTrue(is_non_zero_file(j(self.TEST_REPORT_DIR, "siegfried.sqlite")))
 
 
+class TestBrunnhildeUnit(unittest.TestCase):
+    """
+    Unit tests for functions that do not require external tools.
+    """
+
+    SF_CSV = (
+        "filename,filesize,modified,errors,md5,namespace,id,format,version,mime,class,basis,warning\n"
+        "/a/one.jpg,10,2019-01-02T00:00:00Z,,abc,pronom,fmt/43,JPEG,1.01,image/jpeg,image,ext,\n"
+        "/a/two.jpg,10,2018-01-02T00:00:00Z,,abc,pronom,fmt/43,JPEG,1.01,image/jpeg,image,ext,\n"
+        "/a/empty,0,2020-05-06T00:00:00Z,,d41d,pronom,UNKNOWN,,,,,,no match\n"
+    )
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.cursor = self.conn.cursor()
+
+    def tearDown(self):
+        self.cursor.close()
+        self.conn.close()
+
+    def test_load_siegfried_csv_detects_hash_and_maps_columns(self):
+        use_hash = brunnhilde.load_siegfried_csv(
+            self.cursor, self.conn, io.StringIO(self.SF_CSV), False
+        )
+        self.assertTrue(use_hash)
+        self.cursor.execute(
+            "SELECT filename, hash, id, class, warning FROM siegfried ORDER BY filename"
+        )
+        self.assertEqual(
+            self.cursor.fetchall(),
+            [
+                ("/a/empty", "d41d", "UNKNOWN", "", "no match"),
+                ("/a/one.jpg", "abc", "fmt/43", "image", ""),
+                ("/a/two.jpg", "abc", "fmt/43", "image", ""),
+            ],
+        )
+
+    def test_load_siegfried_csv_without_hash(self):
+        no_hash_csv = "filename,filesize,modified,errors,namespace,id\n/a/b,1,2020,,pronom,fmt/1\n"
+        use_hash = brunnhilde.load_siegfried_csv(
+            self.cursor, self.conn, io.StringIO(no_hash_csv), False
+        )
+        self.assertFalse(use_hash)
+        self.cursor.execute("SELECT filename, hash, id, mime FROM siegfried")
+        self.assertEqual(self.cursor.fetchall(), [("/a/b", None, "fmt/1", None)])
+
+    def test_siegfried_identifications_stored_once(self):
+        brunnhilde.load_siegfried_csv(
+            self.cursor, self.conn, io.StringIO(self.SF_CSV), False
+        )
+        self.cursor.execute("SELECT COUNT(*) FROM siegfried_identifications")
+        self.assertEqual(self.cursor.fetchone()[0], 2)
+        self.cursor.execute("SELECT COUNT(DISTINCT ident_id) FROM siegfried_files")
+        self.assertEqual(self.cursor.fetchone()[0], 2)
+        self.cursor.execute("SELECT filename, format, basis FROM siegfried")
+        self.assertEqual(
+            self.cursor.fetchall(),
+            [
+                ("/a/one.jpg", "JPEG", "ext"),
+                ("/a/two.jpg", "JPEG", "ext"),
+                ("/a/empty", "", ""),
+            ],
+        )
+
+    def test_load_siegfried_json_in_small_chunks(self):
+        sf_json = json.dumps(
+            {
+                "siegfried": "1.9.1",
+                "identifiers": [{"name": "pronom", "details": 'has "files": ['}],
+                "files": [
+                    {
+                        "filename": "/a/one.jpg",
+                        "filesize": 10,
+                        "modified": "2019-01-02T00:00:00Z",
+                        "errors": "",
+                        "md5": "abc",
+                        "matches": [{"ns": "pronom", "id": "fmt/43", "format": "JPEG"}],
+                    },
+                    {
+                        "filename": "/a/empty",
+                        "filesize": 0,
+                        "modified": "2020-05-06T00:00:00Z",
+                        "errors": "empty source",
+                        "md5": "d41d",
+                        "matches": [
+                            {"ns": "pronom", "id": "UNKNOWN", "warning": "no match"}
+                        ],
+                    },
+                ],
+            }
+        )
+        chunks = [sf_json[i : i + 7] for i in range(0, len(sf_json), 7)]
+        use_hash = brunnhilde.load_siegfried_output(
+            self.cursor, self.conn, chunks, False, "json"
+        )
+        self.assertTrue(use_hash)
+        self.cursor.execute(
+            "SELECT filename, filesize, hash, id, warning FROM siegfried"
+        )
+        self.assertEqual(
+            self.cursor.fetchall(),
+            [
+                ("/a/one.jpg", "10", "abc", "fmt/43", None),
+                ("/a/empty", "0", "d41d", "UNKNOWN", "no match"),
+            ],
+        )
+
+    def test_load_siegfried_yaml(self):
+        sf_yaml = (
+            "---\n"
+            "siegfried   : 1.9.1\n"
+            "identifiers : \n"
+            "  - name    : 'pronom'\n"
+            "    details : 'DROID_SignatureFile_V96.xml'\n"
+            "---\n"
+            "filename : '/a/it''s.jpg'\n"
+            "filesize : 10\n"
+            "modified : 2019-01-02T00:00:00Z\n"
+            "errors   : \n"
+            "sha1     : abc\n"
+            "matches  :\n"
+            "  - ns      : 'pronom'\n"
+            "    id      : 'fmt/43'\n"
+            "    format  : 'JPEG File Interchange Format'\n"
+            "    basis   : 'extension match jpg; byte match at 0, 14'\n"
+            "    warning : \n"
+        )
+        self.assertEqual(brunnhilde.siegfried_output_format(sf_yaml), "yaml")
+        use_hash = brunnhilde.load_siegfried_output(
+            self.cursor, self.conn, io.StringIO(sf_yaml), False, "yaml"
+        )
+        self.assertTrue(use_hash)
+        self.cursor.execute(
+            "SELECT filename, filesize, errors, hash, format, basis, warning FROM siegfried"
+        )
+        self.assertEqual(
+            self.cursor.fetchall(),
+            [
+                (
+                    "/a/it's.jpg",
+                    "10",
+                    "",
+                    "abc",
+                    "JPEG File Interchange Format",
+                    "extension match jpg; byte match at 0, 14",
+                    "",
+                )
+            ],
+        )
+
+    def test_get_aggregate_stats(self):
+        brunnhilde.load_siegfried_csv(
+            self.cursor, self.conn, io.StringIO(self.SF_CSV), True
+        )
+        stats = brunnhilde.get_aggregate_stats(self.cursor)
+        self.assertEqual(stats["num_files"], 3)
+        self.assertEqual(stats["empty_files"], 1)
+        self.assertEqual(stats["size_bytes"], 20)
+        self.assertEqual(stats["distinct_files"], 1)
+        self.assertEqual(stats["unidentified_files"], 1)
+        self.assertEqual(stats["num_formats"], 1)
+        self.assertEqual(stats["num_warnings"], 1)
+        self.assertEqual(stats["begin_year"], "2018")
+        self.assertEqual(stats["end_year"], "2020")
+        self.assertEqual(stats["latest_date"], "2020-05-06T00:00:00Z")
+
+    def test_write_duplicates_report_streams_groups(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        brunnhilde.load_siegfried_csv(
+            self.cursor, self.conn, io.StringIO(self.SF_CSV), False
+        )
+        brunnhilde.index_siegfried_table(self.cursor, self.conn, True)
+        html = io.StringIO()
+        num_rows = brunnhilde.write_duplicates_report(
+            brunnhilde.DUPLICATES_SQL,
+            j(tmpdir, "duplicates.csv"),
+            ["Filename", "Size", "Modified", "Errors", "Checksum"],
+            self.cursor,
+            html,
+            page_size=1,
+            report_dir=tmpdir,
+        )
+        self.assertEqual(num_rows, 2)
+        section = html.getvalue()
+        self.assertEqual(section.count("Files matching hash <strong>abc</strong>"), 1)
+        self.assertTrue("/a/one.jpg" in section and "/a/two.jpg" in section)
+        self.assertTrue(section.rstrip().endswith("</table><br>\n</div>"))
+        self.assertFalse(os.path.exists(j(tmpdir, "report_pages")))
+        with open(j(tmpdir, "duplicates.csv")) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_html_pager_splits_rows_into_pages(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        html = io.StringIO()
+        pager = brunnhilde.HtmlPager(
+            "Errors", html, page_size=2, report_dir=tmpdir, basename="test"
+        )
+        for i in range(5):
+            pager.write("<p>row {}</p>".format(i))
+        pager.close()
+        self.assertTrue("row 1" in html.getvalue())
+        self.assertFalse("row 2" in html.getvalue())
+        self.assertTrue("report_pages/errors_3.html" in html.getvalue())
+        with open(j(tmpdir, "report_pages", "errors_2.html")) as f:
+            page = f.read()
+        self.assertTrue("row 3" in page)
+        self.assertTrue('href="errors_3.html"' in page)
+        self.assertFalse(os.path.exists(j(tmpdir, "report_pages", "errors_4.html")))
+
+    def test_html_table_rows_escape_and_link_puids(self):
+        rows = [
+            ("/a/<b> & c.txt", 10, "fmt/43", None),
+            ("/a/d.txt", 20, "x-fmt/111", "fmt/43"),
+        ]
+        html = brunnhilde._html_table_rows(rows)
+        self.assertEqual(
+            html,
+            "".join(
+                brunnhilde._html_table_row(map(brunnhilde._html_cell, row))
+                for row in rows
+            ),
+        )
+        self.assertTrue("<td>/a/&lt;b&gt; &amp; c.txt</td>" in html)
+        self.assertTrue("<td></td>" in html)
+        self.assertEqual(html.count("PRONOM/fmt/43"), 2)
+        self.assertTrue(
+            '<a href="https://nationalarchives.gov.uk/PRONOM/x-fmt/111"' in html
+        )
+        self.assertEqual(brunnhilde._html_table_rows([]), "")
+
+    def _fake_clamav_run(self, ping_status):
+        """Return run with clamd=True and fake ClamAV tools first on PATH"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        bin_dir = j(tmpdir, "bin")
+        os.makedirs(bin_dir)
+        scripts = {
+            "clamdscan": (
+                '[ "$1" = "--ping" ] && exit {}\n'
+                'echo "clamdscan $*"\necho "Infected files: 0"\n'.format(ping_status)
+            ),
+            "clamscan": 'echo "clamscan $*"\necho "Infected files: 0"\n',
+        }
+        for name, script in scripts.items():
+            with open(j(bin_dir, name), "w") as f:
+                f.write("#!/bin/sh\n" + script)
+            os.chmod(j(bin_dir, name), 0o755)
+        path = os.environ["PATH"]
+        os.environ["PATH"] = bin_dir + os.pathsep + path
+        self.addCleanup(os.environ.__setitem__, "PATH", path)
+        run = brunnhilde.Brunnhilde.from_options(
+            "./test-data/files/", j(tmpdir, "report"), clamd=True
+        )
+        os.makedirs(run.log_dir)
+        return run
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Shell script fakes")
+    def test_run_clamav_uses_clamd_multiscan(self):
+        run = self._fake_clamav_run(0)
+        run.run_clamav("./test-data/files/")
+        with open(j(run.log_dir, "viruscheck-log.txt")) as f:
+            log = f.read()
+        self.assertTrue("clamdscan -i --multiscan --fdpass ./test-data/files/" in log)
+        self.assertTrue("Date scanned:" in log)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "Shell script fakes")
+    def test_run_clamav_falls_back_to_clamscan(self):
+        run = self._fake_clamav_run(1)
+        run.run_clamav("./test-data/files/")
+        with open(j(run.log_dir, "viruscheck-log.txt")) as f:
+            log = f.read()
+        self.assertFalse("clamdscan" in log)
+        self.assertTrue("clamscan -i -r ./test-data/files/" in log)
+
+    def test_load_clamav_log_joins_siegfried(self):
+        brunnhilde.load_siegfried_csv(
+            self.cursor, self.conn, io.StringIO(self.SF_CSV), False
+        )
+        log = io.StringIO(
+            "/a/one.jpg: Eicar-Signature FOUND\n"
+            "/a/odd: name.txt: Win.Test.EICAR_HDB-1 FOUND\n"
+            "/a/locked: Access denied: permission denied ERROR\n"
+            "LibClamAV Warning: Bytecode runtime error\n"
+            "\n----------- SCAN SUMMARY -----------\n"
+            "Known viruses: 8683430\n"
+            "Scanned files: 4\n"
+            "Infected files: 2\n"
+            "Date scanned: 2020-01-01 00:00:00"
+        )
+        self.assertEqual(brunnhilde.load_clamav_log(self.cursor, self.conn, log), 3)
+        self.cursor.execute(brunnhilde.CLAMAV_FINDINGS_SQL)
+        self.assertEqual(
+            self.cursor.fetchall(),
+            [
+                (
+                    "/a/one.jpg",
+                    "Eicar-Signature",
+                    "FOUND",
+                    "fmt/43",
+                    "JPEG",
+                    "1.01",
+                    "image/jpeg",
+                ),
+                (
+                    "/a/odd: name.txt",
+                    "Win.Test.EICAR_HDB-1",
+                    "FOUND",
+                    None,
+                    None,
+                    None,
+                    None,
+                ),
+                (
+                    "/a/locked",
+                    "Access denied: permission denied",
+                    "ERROR",
+                    None,
+                    None,
+                    None,
+                    None,
+                ),
+            ],
+        )
+        self.cursor.execute("SELECT name, value FROM clamav_summary ORDER BY rowid;")
+        summary = self.cursor.fetchall()
+        self.assertEqual(summary[2], ("Infected files", "2"))
+        self.assertEqual(summary[3], ("Date scanned", "2020-01-01 00:00:00"))
+
+    def test_load_bulk_extractor_output(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = {
+            "pii.txt": (
+                "\ufeff# BANNER FILE NOT PROVIDED (-b option)\n"
+                "# BULK_EXTRACTOR-Version: 1.6.0\n"
+                "# Feature-Recorder: pii\n"
+                "# Filename: /a\n"
+                "# Feature-File-Version: 1.1\n"
+                "/a/one.jpg-10\t123-45-6789\tSSN: 123-45-6789\n"
+                "/a/one.jpg-90\t987-65-4321\tssn 987-65-4321\n"
+            ),
+            "email.txt": (
+                "# Feature-Recorder: email\n"
+                "/a/one.jpg-5\ta@example.com\tto a@example.com\n"
+                "/a/three.zip-100-ZIP-20\tb@example.com\tfrom b@example.com\n"
+            ),
+            "url_histogram.txt": (
+                "# Histogram-File-Version: 1.1\n"
+                "n=12\thttp://example.com/\n"
+                "n=3\thttp://example.org/\t(utf16=3)\n"
+            ),
+        }
+        for name, text in files.items():
+            with open(j(tmpdir, name), "w", encoding="utf8") as f:
+                f.write(text)
+        brunnhilde.load_siegfried_csv(
+            self.cursor, self.conn, io.StringIO(self.SF_CSV), False
+        )
+        self.assertEqual(
+            brunnhilde.load_bulk_extractor_output(self.cursor, self.conn, tmpdir), 4
+        )
+        self.cursor.execute(brunnhilde.SSNS_SQL)
+        self.assertEqual(
+            [row[1] for row in self.cursor.fetchall()], ["123-45-6789", "987-65-4321"]
+        )
+        self.cursor.execute(brunnhilde.PII_COUNTS_SQL)
+        self.assertEqual(
+            self.cursor.fetchall(),
+            [
+                ("/a/one.jpg", 2, 1, 0, "fmt/43", "JPEG"),
+                ("/a/three.zip", 0, 1, 0, None, None),
+            ],
+        )
+        self.cursor.execute(
+            "SELECT count, feature FROM bulk_extractor_histograms WHERE histogram = 'url_histogram' ORDER BY count DESC;"
+        )
+        self.assertEqual(
+            self.cursor.fetchall(),
+            [(12, "http://example.com/"), (3, "http://example.org/")],
+        )
+
+    def test_synthetic_siegfried_csv_loads(self):
+        sf_csv = io.StringIO()
+        benchmark.make_siegfried_csv(
+            sf_csv, 1000, duplicate_ratio=0.2, unknown_ratio=0.1, unicode_ratio=0.5
+        )
+        sf_csv.seek(0)
+        use_hash = brunnhilde.load_siegfried_csv(self.cursor, self.conn, sf_csv, False)
+        self.assertTrue(use_hash)
+        stats = brunnhilde.get_aggregate_stats(self.cursor)
+        self.assertEqual(stats["num_files"], 1000)
+        self.assertTrue(50 < stats["unidentified_files"] < 150)
+        self.assertTrue(700 < stats["distinct_files"] < 900)
+        self.cursor.execute("SELECT COUNT(*) FROM siegfried WHERE filename LIKE '%写真%'")
+        self.assertTrue(self.cursor.fetchone()[0] > 0)
+
+    def test_make_size_balanced_shards(self):
+        files = [("/big", 100), ("/a", 10), ("/b", 20), ("/c", 30), ("/d", 40)]
+        shards = brunnhilde.make_size_balanced_shards(files, 2)
+        self.assertEqual(shards, [["/big"], ["/a", "/b", "/c", "/d"]])
+        shards = brunnhilde.make_size_balanced_shards(files, 10)
+        self.assertEqual(len(shards), 5)
+
+    def test_job_budget_divides_jobs_between_tools(self):
+        for start_order in (
+            ("bulk_extractor", "ClamAV", "Siegfried"),
+            ("Siegfried", "ClamAV", "bulk_extractor"),
+        ):
+            budget = brunnhilde.JobBudget(8)
+            budget.expect("Siegfried")
+            budget.expect("ClamAV", max_jobs=1)
+            budget.expect("bulk_extractor")
+            with contextlib.ExitStack() as stack:
+                jobs = dict(
+                    (name, stack.enter_context(budget.reserve(name)))
+                    for name in start_order
+                )
+                self.assertEqual(
+                    jobs, {"Siegfried": 4, "ClamAV": 1, "bulk_extractor": 3}
+                )
+        # Tools not expected get the jobs not in use
+        with budget.reserve("ClamAV", max_jobs=1):
+            with budget.reserve("Siegfried") as sf_jobs:
+                self.assertEqual(sf_jobs, 7)
+        budget = brunnhilde.JobBudget(2)
+        budget.expect("ClamAV", max_jobs=1)
+        budget.expect("bulk_extractor")
+        budget.expect("Siegfried")
+        self.assertEqual(budget.shares["bulk_extractor"], 1)
+        self.assertEqual(budget.shares["Siegfried"], 1)
+        with brunnhilde.JobBudget().reserve("Siegfried") as sf_jobs:
+            self.assertEqual(sf_jobs, None)
+
+    def test_stage_runner_wait_all_without_raising(self):
+        def fail():
+            raise ValueError("stage failed")
+
+        stages = brunnhilde.StageRunner(parallel=True)
+        stages.start("fail", fail)
+        with self.assertRaises(ValueError):
+            stages.wait_all()
+        stages.start("fail", fail)
+        stages.wait_all(raise_errors=False)
+        self.assertEqual((stages.threads, stages.errors), ({}, {}))
+
+    def test_sf_jobs_options_not_in_cache_settings(self):
+        args = brunnhilde._make_parser().parse_args(["src", "dest"])
+        self.assertEqual(
+            brunnhilde._build_sf_command(args, "/src", True, jobs=3),
+            'sf -csv -hash md5 -multi 3 "/src"',
+        )
+        self.assertEqual(
+            brunnhilde._build_sf_command(args, "/src", True),
+            'sf -csv -hash md5 "/src"',
+        )
+        self.assertFalse("-multi" in brunnhilde._sf_options(args, True))
+
+    def test_source_listing_matches_os_walk(self):
+        expected_size = 0
+        expected_files = 0
+        for root, dirs, files in os.walk("test-data"):
+            for f in files:
+                expected_size += os.path.getsize(os.path.join(root, f))
+                expected_files += 1
+        num_entries = brunnhilde.record_source_listing(
+            self.cursor, self.conn, "test-data"
+        )
+        self.assertEqual(num_entries, expected_files + 2)
+        self.cursor.execute(
+            "SELECT SUM(size), COUNT(*) FROM source_listing WHERE is_file=1"
+        )
+        self.assertEqual(self.cursor.fetchone(), (expected_size, expected_files))
+
+        tree = io.StringIO()
+        brunnhilde.write_tree_text(self.cursor, "test-data", tree)
+        lines = tree.getvalue().splitlines()
+        self.assertEqual(lines[0], "test-data")
+        self.assertTrue(any(line.endswith("]  kaypro.jpg") for line in lines))
+        self.assertEqual(lines[-1], "2 directories, {} files".format(expected_files))
+
+        tree_json = io.StringIO()
+        brunnhilde.write_tree_json(self.cursor, "test-data", tree_json)
+        root, report = json.loads(tree_json.getvalue())
+        self.assertEqual(root["name"], "test-data")
+        self.assertEqual(
+            sorted(node["name"] for node in root["contents"]), ["diskimages", "files"]
+        )
+        self.assertEqual(report["files"], expected_files)
+
+
 if __name__ == "__main__":
     unittest.main()